@@ -0,0 +1,45 @@
+# Build and query times of the availability index for a synthetic company, without touching the database.
+# Usage: python -m benchmarks.bench_availability [--employees 10000] [--requests-per-employee 12] [--repeat 20]
+import argparse
+import datetime
+import random
+import time
+
+from flaskr.availability import AvailabilityIndex
+from benchmarks.utils import measure, report
+
+
+def synthetic_rows(employees, requests_per_employee, year):
+    first_day = datetime.datetime(year, 1, 1)
+    id = 0
+    for user_id in range(1, employees + 1):
+        for _ in range(requests_per_employee):
+            id += 1
+            start = first_day + datetime.timedelta(days=random.randrange(365))
+            yield id, user_id, random.choice(('accepted', 'accepted', 'pending')), start, \
+                start + datetime.timedelta(days=random.randrange(5))
+
+
+def run(employees, requests_per_employee, repeat):
+    year = datetime.date.today().year
+    index = AvailabilityIndex(ttl=3600)
+    rows = list(synthetic_rows(employees, requests_per_employee, year))
+    started = time.perf_counter()
+    index.rebuild(rows)
+    print(f"built index for {employees * requests_per_employee} requests in "
+          f"{(time.perf_counter() - started) * 1000:.1f} ms")
+    start, end = datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+    for name, states in (('accepted', ('accepted',)), ('accepted + pending', ('accepted', 'pending'))):
+        rps, latencies = measure(lambda: index.daily_counts(start, end, states), repeat)
+        report('full year daily counts, ' + name, rps, latencies)
+        rps, latencies = measure(lambda: index.users_off(start, end, states), repeat)
+        report('full year users off, ' + name, rps, latencies)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--employees', type=int, default=10000)
+    parser.add_argument('--requests-per-employee', type=int, default=12)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    run(args.employees, args.requests_per_employee, args.repeat)
@@ -0,0 +1,56 @@
+# Hammers one user's balance from concurrent threads and checks that no more days were charged than allowed.
+# Usage: python -m benchmarks.bench_balance [--threads 16] [--attempts 50] [--limit 200]
+import argparse
+import time
+from threading import Thread
+
+from flaskr import create_app, db
+from flaskr.balance import charge_days
+from flaskr.models import User
+
+app = create_app({'MIGRATIONS_ENABLED': False})
+
+EMAIL = 'bench_balance@invenshure.com'
+
+
+def worker(user_id, attempts, limit, results):
+    with app.app_context():
+        user = User.query.get(user_id)
+        for _ in range(attempts):
+            granted = charge_days(user, 1, limit=limit)
+            db.session.commit()
+            results.append(granted)
+        db.session.remove()
+
+
+def run(threads, attempts, limit):
+    user = User(email=EMAIL, user_group='employee')
+    db.session.add(user)
+    db.session.commit()
+    results = []
+    try:
+        workers = [Thread(target=worker, args=(user.id, attempts, limit, results)) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        db.session.expire_all()
+        days = User.query.get(user.id).days
+        print(f"{len(results)} charges in {elapsed:.2f} s ({len(results) / elapsed:.0f}/s), "
+              f"{sum(results)} granted, balance {days} of {limit}")
+        assert days == sum(results) == min(limit, threads * attempts), "balance drifted under concurrency"
+    finally:
+        db.session.delete(User.query.get(user.id))
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--attempts', type=int, default=50)
+    parser.add_argument('--limit', type=int, default=200)
+    args = parser.parse_args()
+    with app.app_context():
+        run(args.threads, args.attempts, args.limit)
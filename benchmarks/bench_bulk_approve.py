@@ -0,0 +1,74 @@
+# Approves N pending requests one POST at a time and then with a single bulk call, with mail and Google stubbed.
+# Usage: python -m benchmarks.bench_bulk_approve [--requests 1000]
+import argparse
+import datetime
+import time
+from unittest import mock
+
+from flaskr import create_app, db, routes
+from flaskr.models import LeaveRequest, User
+from benchmarks.utils import StubGoogle
+
+app = create_app({'MIGRATIONS_ENABLED': False})
+
+ADMIN = 'bench_bulk_admin@invenshure.com'
+EMPLOYEE = 'bench_bulk_employee@invenshure.com'
+
+
+def seed(user_id, requests):
+    start = datetime.date(2019, 1, 1)
+    leave_requests = [LeaveRequest(user_id=user_id, state='pending', start_date=start + datetime.timedelta(days=i),
+                                   end_date=start + datetime.timedelta(days=i)) for i in range(requests)]
+    db.session.add_all(leave_requests)
+    db.session.commit()
+    return [leave_request.id for leave_request in leave_requests]
+
+
+def reset(user_id):
+    LeaveRequest.query.filter_by(user_id=user_id).delete()
+    User.query.filter_by(id=user_id).update({User.days: 0})
+    db.session.commit()
+
+
+def run(requests):
+    admin = User(email=ADMIN, user_group='administrator')
+    employee = User(email=EMPLOYEE, user_group='employee')
+    db.session.add_all([admin, employee])
+    db.session.commit()
+    admin_id, employee_id = admin.id, employee.id
+    try:
+        with mock.patch.object(routes.google, 'get', StubGoogle(ADMIN, latency=0)), \
+                mock.patch.object(routes.mail_queue, 'submit') as submit, app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['user'] = ADMIN
+                sess['google_token'] = ('bench_token', '')
+            ids = seed(employee_id, requests)
+            started = time.perf_counter()
+            for id in ids:
+                assert client.post('/handle_request', data={'accept': str(id)}).status_code == 302
+            single = time.perf_counter() - started
+            print(f"{'one POST per request':<32} {single:8.2f} s   {requests / single:10.1f} req/s   "
+                  f"{submit.call_count} mail jobs")
+
+            reset(employee_id)
+            submit.reset_mock()
+            ids = seed(employee_id, requests)
+            started = time.perf_counter()
+            resp = client.post('/handle_requests', json={'accept': ids})
+            bulk = time.perf_counter() - started
+            assert len(resp.json['accepted']) == requests
+            print(f"{'one bulk POST':<32} {bulk:8.2f} s   {requests / bulk:10.1f} req/s   "
+                  f"{submit.call_count} mail jobs")
+            print(f"{'speedup':<32} {single / bulk:8.1f}x")
+    finally:
+        reset(employee_id)
+        User.query.filter(User.id.in_([admin_id, employee_id])).delete(synchronize_session=False)
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+    with app.app_context():
+        run(args.requests)
@@ -0,0 +1,87 @@
+# Requests per second on / with the Google userinfo endpoint stubbed, against verifying the session's ID token
+# locally with a generated key, and with the identity cache.
+# Usage: python -m benchmarks.bench_current_user [--requests 200] [--latency 0.05]
+import argparse
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from flaskr import create_app, routes
+from flaskr.identity import KeySet
+from benchmarks.utils import StubGoogle, measure, report
+
+app = create_app({'MIGRATIONS_ENABLED': False})
+
+EMAIL = 'bench_current_user@invenshure.com'
+
+
+def local_keys():
+    """Returns a KeySet read from a temporary JWKS file and an ID token for EMAIL signed with its key."""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update(kid='bench', alg='RS256', use='sig')
+    fd, path = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'keys': [jwk]}, f)
+    now = int(time.time())
+    token = jwt.encode({'iss': 'accounts.google.com', 'aud': app.config.get('GOOGLE_ID'), 'sub': EMAIL,
+                        'email': EMAIL, 'email_verified': True, 'iat': now, 'exp': now + 3600},
+                       private_key, algorithm='RS256', headers={'kid': 'bench'})
+    return KeySet(path), token
+
+
+def run(requests, latency):
+    user = routes.User(email=EMAIL, user_group='employee')
+    routes.add_to_db(user)
+    stub = StubGoogle(EMAIL, latency)
+    ttl = routes.identity_cache.ttl
+    try:
+        with mock.patch.object(routes.google, 'get', stub), app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['user'] = EMAIL
+                sess['google_token'] = ('bench_token', '')
+
+            def hit():
+                assert client.get('/').status_code == 200
+
+            routes.identity_cache.ttl = 0
+            routes.identity_cache.clear()
+            rps, latencies = measure(hit, requests)
+            report('userinfo on every request', rps, latencies)
+            print(f"{'':<32} {stub.calls} userinfo calls")
+
+            stub.calls = 0
+            keys, token = local_keys()
+            with mock.patch.object(routes, 'google_keys', keys):
+                with client.session_transaction() as sess:
+                    sess['google_id_token'] = token
+                rps, latencies = measure(hit, requests)
+                report('ID token on every request', rps, latencies)
+                print(f"{'':<32} {stub.calls} userinfo calls")
+                with client.session_transaction() as sess:
+                    del sess['google_id_token']
+            os.remove(keys.uri)
+
+            stub.calls = 0
+            routes.identity_cache.ttl = ttl or 300
+            rps, latencies = measure(hit, requests)
+            report('identity cache', rps, latencies)
+            print(f"{'':<32} {stub.calls} userinfo calls")
+    finally:
+        routes.identity_cache.ttl = ttl
+        routes.identity_cache.clear()
+        routes.delete_from_db(user)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated Google round trip in seconds')
+    args = parser.parse_args()
+    with app.app_context():
+        run(args.requests, args.latency)
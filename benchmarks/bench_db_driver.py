@@ -0,0 +1,55 @@
+# Compares the MySQL drivers DATABASE_DRIVER can pick: pymysql (pure Python) and mysqldb (mysqlclient, C).
+# Times round trips of a trivial query and fetching wide result sets, against the database the app is configured
+# for, with the same engine options. Drivers that are not installed are skipped.
+# Usage: python -m benchmarks.bench_db_driver [--queries 2000] [--rows 5000]
+import argparse
+import importlib
+import sys
+
+import pymysql
+from sqlalchemy import create_engine
+
+from flaskr import create_app
+from benchmarks.utils import measure, report
+
+app = create_app({'MIGRATIONS_ENABLED': False})
+
+DRIVERS = {'pymysql': 'pymysql', 'mysqldb': 'MySQLdb'}
+ROWS = "SELECT a.n * 1000 + b.n AS id, REPEAT('x', 64) AS email, NOW() AS start_date, 'pending' AS state " \
+       "FROM (SELECT 0 AS n UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4) a " \
+       "CROSS JOIN (SELECT @row := @row + 1 AS n FROM information_schema.columns, (SELECT @row := 0) r " \
+       "LIMIT 1000) b LIMIT %d"
+
+
+def installed(module):
+    if sys.modules.get(module) is pymysql:
+        # flaskr ran pymysql.install_as_MySQLdb(); look for the real mysqlclient instead
+        del sys.modules[module]
+    try:
+        importlib.import_module(module)
+        return True
+    except ImportError:
+        return False
+
+
+def run(queries, rows):
+    location = app.config['SQLALCHEMY_DATABASE_URI'].split('://', 1)[1]
+    for driver, module in DRIVERS.items():
+        if not installed(module):
+            print(f"{driver:<32} not installed, skipped")
+            continue
+        engine = create_engine('mysql+' + driver + '://' + location, **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        with engine.connect() as conn:
+            rps, latencies = measure(lambda: conn.execute('SELECT 1').scalar(), queries)
+            report(f"{driver} SELECT 1", rps, latencies)
+            rps, latencies = measure(lambda: conn.execute(ROWS % rows).fetchall(), max(1, queries // 100))
+            report(f"{driver} fetch {rows} rows", rps, latencies)
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--rows', type=int, default=5000)
+    args = parser.parse_args()
+    run(args.queries, args.rows)
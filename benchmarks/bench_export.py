@@ -0,0 +1,89 @@
+# Throughput and memory of the leave request export over a synthetic table of --rows requests spread over --users
+# users: CSV, JSON lines and gzipped CSV streamed from a server-side cursor, and for comparison CSV from the same
+# query loaded whole. Memory is the peak traced by tracemalloc in a second, slower pass.
+# Usage: python -m benchmarks.bench_export [--rows 1000000] [--users 1000] [--formats csv,jsonl,csv.gz,csv-all]
+import argparse
+import datetime
+import random
+import time
+import tracemalloc
+
+from flaskr import create_app, db
+from flaskr.export import encode, export, export_rows
+from flaskr.models import User, LeaveRequest, LeaveCategory
+
+app = create_app({'MIGRATIONS_ENABLED': False})
+
+DOMAIN = '@bench-export.invalid'
+CATEGORY = 'bench_export'
+STATES = ['accepted'] * 7 + ['pending'] * 2 + ['declined']
+
+
+def seed(rows, users, chunk=10000):
+    category = LeaveCategory(category=CATEGORY, max_days=25)
+    db.session.add(category)
+    db.session.commit()
+    db.session.bulk_insert_mappings(User, [{'email': f'user{i}{DOMAIN}', 'user_group': 'employee',
+                                            'leave_category_id': category.id} for i in range(users)])
+    db.session.commit()
+    user_ids = [id for id, in db.session.query(User.id).filter(User.email.endswith(DOMAIN))]
+    first_day = datetime.datetime(2000, 1, 1)
+    for offset in range(0, rows, chunk):
+        mappings = []
+        for _ in range(min(chunk, rows - offset)):
+            start = first_day + datetime.timedelta(days=random.randrange(7300))
+            length = random.choice((1, 1, 2, 3, 5, 5, 10))
+            mappings.append({'user_id': random.choice(user_ids), 'state': random.choice(STATES), 'start_date': start,
+                             'end_date': start + datetime.timedelta(days=length - 1), 'days': length})
+        db.session.bulk_insert_mappings(LeaveRequest, mappings)
+        db.session.commit()
+
+
+def clean():
+    user_ids = db.session.query(User.id).filter(User.email.endswith(DOMAIN)).subquery()
+    LeaveRequest.query.filter(LeaveRequest.user_id.in_(user_ids)).delete(synchronize_session=False)
+    User.query.filter(User.email.endswith(DOMAIN)).delete(synchronize_session=False)
+    LeaveCategory.query.filter_by(category=CATEGORY).delete()
+    db.session.commit()
+
+
+def stream(name):
+    if name == 'csv-all':
+        return encode(export_rows().all())
+    format, _, compressed = name.partition('.')
+    return export(format=format, compress=bool(compressed))
+
+
+def consume(chunks):
+    return sum(len(chunk) for chunk in chunks)
+
+
+def run(rows, users, formats):
+    started = time.perf_counter()
+    seed(rows, users)
+    print(f"seeded {rows} requests in {time.perf_counter() - started:.1f} s")
+    try:
+        for name in formats:
+            started = time.perf_counter()
+            size = consume(stream(name))
+            elapsed = time.perf_counter() - started
+            db.session.rollback()
+            tracemalloc.start()
+            consume(stream(name))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            db.session.rollback()
+            print(f"{name:<10} {rows / elapsed:12.0f} rows/s {size / elapsed / 2 ** 20:8.1f} MB/s "
+                  f"{size / 2 ** 20:10.1f} MB   peak memory {peak / 2 ** 20:8.1f} MB")
+    finally:
+        clean()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--formats', default='csv,jsonl,csv.gz,csv-all')
+    args = parser.parse_args()
+    with app.app_context():
+        run(args.rows, args.users, args.formats.split(','))
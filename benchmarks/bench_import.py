@@ -0,0 +1,69 @@
+# Time of a CSV import of --users users and --rows leave requests spread over them, generated back to back so no
+# request overlaps another, as `flask import-csv` runs it.
+# Usage: python -m benchmarks.bench_import [--users 10000] [--rows 100000] [--chunk 1000]
+import argparse
+import datetime
+import io
+import random
+import time
+
+from flaskr import create_app, db
+from flaskr.importer import CSVImport
+from flaskr.models import User, LeaveRequest, LeaveCategory
+
+app = create_app({'MIGRATIONS_ENABLED': False})
+
+DOMAIN = '@bench-import.invalid'
+CATEGORIES = ['bench_import_young', 'bench_import_old']
+STATES = ['accepted'] * 7 + ['pending'] * 2 + ['declined']
+
+
+def generate(users, rows):
+    emails = [f'user{i}{DOMAIN}' for i in range(users)]
+    users_csv = io.StringIO()
+    users_csv.write("email,user_group,category,max_days\n")
+    for i, email in enumerate(emails):
+        users_csv.write(f"{email},{'administrator' if i == 0 else 'employee'},{random.choice(CATEGORIES)},25\n")
+    leave_csv = io.StringIO()
+    leave_csv.write("email,start_date,end_date,state\n")
+    next_free = dict.fromkeys(emails, datetime.date(2000, 1, 3))
+    for _ in range(rows):
+        email = random.choice(emails)
+        start = next_free[email] + datetime.timedelta(days=random.randrange(30))
+        end = start + datetime.timedelta(days=random.choice((0, 0, 1, 2, 4, 4, 9)))
+        next_free[email] = end + datetime.timedelta(days=1)
+        leave_csv.write(f"{email},{start},{end},{random.choice(STATES)}\n")
+    return users_csv.getvalue(), leave_csv.getvalue()
+
+
+def clean():
+    user_ids = db.session.query(User.id).filter(User.email.endswith(DOMAIN)).subquery()
+    LeaveRequest.query.filter(LeaveRequest.user_id.in_(user_ids)).delete(synchronize_session=False)
+    User.query.filter(User.email.endswith(DOMAIN)).delete(synchronize_session=False)
+    LeaveCategory.query.filter(LeaveCategory.category.in_(CATEGORIES)).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def run(users, rows, chunk):
+    users_csv, leave_csv = generate(users, rows)
+    for name, dry_run in (('dry run', True), ('import', False)):
+        csv_import = CSVImport(chunk, dry_run)
+        started = time.perf_counter()
+        errors = sum(1 for _ in csv_import.run(io.StringIO(users_csv), io.StringIO(leave_csv)))
+        elapsed = time.perf_counter() - started
+        print(f"{name:<8} {users} users, {rows} requests {elapsed:8.2f} s {(users + rows) / elapsed:10.0f} rows/s   "
+              f"{errors} error(s)")
+    clean()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--chunk', type=int, default=1000)
+    args = parser.parse_args()
+    with app.app_context():
+        try:
+            run(args.users, args.rows, args.chunk)
+        finally:
+            clean()
@@ -0,0 +1,76 @@
+# Page render times for /admin and /requests on a seeded LeaveRequest table, with and without the hot query indexes.
+# Usage: python -m benchmarks.bench_leave_requests [--requests 50000] [--users 500] [--repeat 20] [--without-indexes]
+import argparse
+import datetime
+import random
+from unittest import mock
+
+from flaskr import create_app, db, routes
+from flaskr.models import User, LeaveRequest
+from flaskr.pagination import encode_cursor
+from benchmarks.utils import StubGoogle, measure, report
+
+app = create_app({'MIGRATIONS_ENABLED': False})
+
+DOMAIN = '@bench.invalid'
+ADMIN = 'admin' + DOMAIN
+STATES = ['pending', 'accepted', 'accepted', 'accepted', 'declined']
+
+
+def seed(users, requests, chunk=5000):
+    db.session.bulk_insert_mappings(User, [{'email': ADMIN, 'user_group': 'administrator'}] +
+                                    [{'email': f'user{i}{DOMAIN}', 'user_group': 'employee'} for i in range(users)])
+    db.session.commit()
+    user_ids = [uid for uid, in db.session.query(User.id).filter(User.email.like('%' + DOMAIN))]
+    first_day = datetime.datetime(2015, 1, 1)
+    rows = []
+    for _ in range(requests):
+        start = first_day + datetime.timedelta(days=random.randrange(3650))
+        rows.append({'user_id': random.choice(user_ids), 'state': random.choice(STATES), 'start_date': start,
+                     'end_date': start + datetime.timedelta(days=random.randrange(10))})
+        if len(rows) == chunk:
+            db.session.bulk_insert_mappings(LeaveRequest, rows)
+            rows = []
+    db.session.bulk_insert_mappings(LeaveRequest, rows)
+    db.session.commit()
+
+
+def cleanup():
+    user_ids = db.session.query(User.id).filter(User.email.like('%' + DOMAIN))
+    LeaveRequest.query.filter(LeaveRequest.user_id.in_(user_ids.subquery())).delete(synchronize_session=False)
+    User.query.filter(User.email.like('%' + DOMAIN)).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def run(users, requests, repeat, without_indexes):
+    indexes = LeaveRequest.__table__.indexes
+    seed(users, requests)
+    try:
+        if without_indexes:
+            for index in indexes:
+                index.drop(db.engine)
+        # Cursor pointing at the last page, the deepest a user can get by pressing "Next"
+        deepest = LeaveRequest.query.order_by(LeaveRequest.start_date.desc(), LeaveRequest.id.desc()) \
+            .offset(app.config.get('REQUESTS_PER_PAGE')).first()
+        last_page = encode_cursor('next', deepest.start_date, deepest.id)
+        with mock.patch.object(routes.google, 'get', StubGoogle(ADMIN, latency=0)), app.test_client() as client:
+            for name, url in (('/admin', '/admin'), ('/requests', '/requests'),
+                              ('/requests (last page)', f'/requests?cursor={last_page}')):
+                rps, latencies = measure(lambda: client.get(url), repeat)
+                report(name, rps, latencies)
+    finally:
+        if without_indexes:
+            for index in indexes:
+                index.create(db.engine)
+        cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--without-indexes', action='store_true', help='drop the LeaveRequest indexes while measuring')
+    args = parser.parse_args()
+    with app.app_context():
+        run(args.users, args.requests, args.repeat, args.without_indexes)
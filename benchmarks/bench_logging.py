@@ -0,0 +1,94 @@
+# Time spent on the calling thread per log call: the old synchronous basicConfig file handler against the queued
+# JSON pipeline, plus the cost of a disabled debug call built by concatenation against %-style arguments.
+# --write-latency adds a delay to every write, standing in for a busy or network-backed disk.
+# Usage: python -m benchmarks.bench_logging [--records 20000] [--write-latency 0.0005]
+import argparse
+import logging
+import logging.handlers
+import os
+import queue
+import tempfile
+import time
+
+from flaskr.logs import JSONFormatter, RequestContextFilter, RotatingFileHandler, StructuredQueueHandler
+
+EMAIL = 'bench_logging@invenshure.com'
+
+
+class SlowFileHandler(logging.FileHandler):
+    latency = 0
+
+    def emit(self, record):
+        if self.latency:
+            time.sleep(self.latency)
+        super().emit(record)
+
+
+class SlowRotatingFileHandler(RotatingFileHandler):
+    latency = 0
+
+    def emit(self, record):
+        if self.latency:
+            time.sleep(self.latency)
+        super().emit(record)
+
+
+def timed(logger, records, call):
+    started = time.perf_counter()
+    for i in range(records):
+        call(logger, i)
+    return (time.perf_counter() - started) / records * 1e6
+
+
+def info(logger, i):
+    logger.info("Leave request by %s id: %s, has been accepted by %s", EMAIL, i, EMAIL)
+
+
+def debug_concatenated(logger, i):
+    logger.debug("Leave request by " + EMAIL + " id: " + str(i) + ", has been accepted by " + EMAIL)
+
+
+def debug_lazy(logger, i):
+    logger.debug("Leave request by %s id: %s, has been accepted by %s", EMAIL, i, EMAIL)
+
+
+def run(records, write_latency):
+    SlowFileHandler.latency = SlowRotatingFileHandler.latency = write_latency
+    directory = tempfile.mkdtemp()
+    logger = logging.getLogger('bench')
+    logger.propagate = False
+
+    handler = SlowFileHandler(os.path.join(directory, 'sync.log'))
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.NOTSET)
+    print(f"{'sync file handler, info':<40} {timed(logger, records, info):8.2f} us/call")
+    logger.removeHandler(handler)
+    handler.close()
+
+    file_handler = SlowRotatingFileHandler(os.path.join(directory, 'queued.log'), 10 * 1024 * 1024, 3)
+    file_handler.setFormatter(JSONFormatter())
+    records_queue = queue.Queue(-1)
+    queue_handler = StructuredQueueHandler(records_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    listener = logging.handlers.QueueListener(records_queue, file_handler)
+    listener.start()
+    logger.addHandler(queue_handler)
+    print(f"{'queued JSON pipeline, info':<40} {timed(logger, records, info):8.2f} us/call")
+    started = time.perf_counter()
+    listener.stop()
+    print(f"{'writer thread drained the rest in':<40} {(time.perf_counter() - started) * 1000:8.2f} ms")
+
+    logger.setLevel(logging.INFO)
+    print(f"{'disabled debug, concatenated':<40} {timed(logger, records, debug_concatenated):8.2f} us/call")
+    print(f"{'disabled debug, %-style':<40} {timed(logger, records, debug_lazy):8.2f} us/call")
+    logger.removeHandler(queue_handler)
+    file_handler.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--write-latency', type=float, default=0)
+    args = parser.parse_args()
+    run(args.records, args.write_latency)
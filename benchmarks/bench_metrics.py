@@ -0,0 +1,48 @@
+# Per-request cost of the /metrics instrumentation: the same route, doing a few SQL queries, served by an app
+# without it and by one with METRICS_ENABLED.
+# Usage: python -m benchmarks.bench_metrics [--requests 5000] [--queries 5]
+import argparse
+
+from flask import Flask
+from sqlalchemy import create_engine
+
+from flaskr import metrics, mail_queue
+from benchmarks.utils import measure, report
+
+
+def make_app(enabled, engine, queries):
+    app = Flask('bench_metrics_%s' % ('on' if enabled else 'off'))
+    app.config['METRICS_ENABLED'] = enabled
+
+    @app.route('/work')
+    def work():
+        with engine.connect() as conn:
+            for i in range(queries):
+                conn.execute('SELECT %d' % i)
+        return 'ok'
+
+    metrics.init_app(app, mail_queue)
+    return app
+
+
+def run(requests, queries):
+    engine = create_engine('sqlite://')
+    for enabled in (False, True):
+        with make_app(enabled, engine, queries).test_client() as client:
+            def hit():
+                assert client.get('/work').status_code == 200
+
+            measure(hit, requests // 10)
+            rps, latencies = measure(hit, requests)
+            report('metrics on' if enabled else 'metrics off', rps, latencies)
+            if enabled:
+                scrape_rps, scrape_latencies = measure(lambda: client.get('/metrics'), 100)
+                report('scraping /metrics', scrape_rps, scrape_latencies)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=5)
+    args = parser.parse_args()
+    run(args.requests, args.queries)
@@ -0,0 +1,56 @@
+# Time of the overlap lookup save_request makes, for one user with a growing history of back-to-back requests:
+# bounded by LEAVE_REQUEST_MAX_DAYS as save_request does it, against the same query without the lower bound.
+# Usage: python -m benchmarks.bench_overlap [--histories 100,1000,10000] [--repeat 500]
+import argparse
+import datetime
+
+from flaskr import create_app, db
+from flaskr.balance import overlapping_requests
+from flaskr.models import User, LeaveRequest
+from benchmarks.utils import measure, report
+
+app = create_app({'MIGRATIONS_ENABLED': False})
+
+EMAIL = 'bench_overlap@bench.invalid'
+# Later than every seeded request, so the lookup has to rule out the whole history
+NEW_START = datetime.datetime(2100, 1, 1)
+# A century back: no lower bound in practice, the whole history is scanned
+UNBOUNDED = 36500
+
+
+def seed(user_id, requests):
+    first_day = NEW_START - datetime.timedelta(days=requests * 7 + 7)
+    db.session.bulk_insert_mappings(LeaveRequest, [
+        {'user_id': user_id, 'state': 'accepted', 'start_date': first_day + datetime.timedelta(days=i * 7),
+         'end_date': first_day + datetime.timedelta(days=i * 7 + 4)} for i in range(requests)])
+    db.session.commit()
+
+
+def run(histories, repeat):
+    max_span = app.config.get('LEAVE_REQUEST_MAX_DAYS', 366)
+    user = User(email=EMAIL, user_group='employee')
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    seeded = 0
+    try:
+        for history in histories:
+            seed(user_id, history - seeded)
+            seeded = history
+            end = NEW_START + datetime.timedelta(days=4)
+            for name, span in (('bounded', max_span), ('unbounded', UNBOUNDED)):
+                rps, latencies = measure(lambda: overlapping_requests(user_id, NEW_START, end, span), repeat)
+                report(f"{history} requests, {name}", rps, latencies)
+    finally:
+        LeaveRequest.query.filter_by(user_id=user_id).delete()
+        db.session.delete(user)
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--histories', default='100,1000,10000')
+    parser.add_argument('--repeat', type=int, default=500)
+    args = parser.parse_args()
+    with app.app_context():
+        run(sorted(int(count) for count in args.histories.split(',')), args.repeat)
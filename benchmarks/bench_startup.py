@@ -0,0 +1,65 @@
+# Cold start: importing flaskr and building an app with create_app, each measured in a fresh interpreter, plus the
+# cost of what the test fixtures do for every test (push an app context, make a test client, pop the context).
+# Usage: python -m benchmarks.bench_startup [--runs 10] [--fixtures 2000]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.utils import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+COLD_START = """
+import json, sys, time
+started = time.perf_counter()
+import flaskr
+imported = time.perf_counter()
+flaskr.create_app({'MIGRATIONS_ENABLED': %r})
+print(json.dumps([imported - started, time.perf_counter() - imported]))
+"""
+
+
+def cold_start(runs, migrations):
+    imports, builds = [], []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', COLD_START % migrations], cwd=ROOT, check=True,
+                                stdout=subprocess.PIPE).stdout
+        imported, built = json.loads(output)
+        imports.append(imported * 1000)
+        builds.append(built * 1000)
+    return imports, builds
+
+
+def fixtures(runs):
+    from flaskr import create_app
+    app = create_app({'TESTING': True, 'MIGRATIONS_ENABLED': False})
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        with app.app_context():
+            app.test_client()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def show(name, latencies):
+    print(f"{name:<40} p50 {percentile(latencies, 50):8.2f} ms   p99 {percentile(latencies, 99):8.2f} ms")
+
+
+def run(runs, fixture_runs):
+    for migrations in (False, True):
+        imports, builds = cold_start(runs, migrations)
+        if not migrations:
+            show("import flaskr", imports)
+        show(f"create_app, migrations {'on' if migrations else 'off'}", builds)
+    show("per-test fixtures", fixtures(fixture_runs))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--fixtures', type=int, default=2000)
+    args = parser.parse_args()
+    run(args.runs, args.fixtures)
@@ -0,0 +1,70 @@
+# Counting the working days of a leave request: the calendar's prefix sums against walking the range day by day,
+# for ranges of growing length, then recompute_leave_days over a table of --rows requests after the holidays changed.
+# Usage: python -m benchmarks.bench_workdays [--lengths 5,30,365] [--repeat 20000] [--rows 10000]
+import argparse
+import datetime
+import time
+
+from flaskr import create_app, db
+from flaskr.balance import recompute_leave_days
+from flaskr.models import User, LeaveRequest
+from flaskr.workdays import WorkingCalendar, calendar
+from benchmarks.utils import measure, report
+
+app = create_app({'MIGRATIONS_ENABLED': False})
+
+EMAIL = 'bench_workdays@bench.invalid'
+HOLIDAYS = ['01-01', '03-15', '05-01', '08-20', '10-23', '11-01', '12-25', '12-26']
+START = datetime.datetime(2019, 3, 11)
+
+
+def day_by_day(working_calendar, start, end):
+    days = (start + datetime.timedelta(days=i) for i in range((end - start).days + 1))
+    return sum(1 for day in days if working_calendar.is_working(day))
+
+
+def run_counts(lengths, repeat):
+    working_calendar = WorkingCalendar(holidays=HOLIDAYS)
+    for length in lengths:
+        end = START + datetime.timedelta(days=length - 1)
+        for name, func in (('prefix sums', lambda: working_calendar.count(START, end)),
+                           ('day by day', lambda: day_by_day(working_calendar, START, end))):
+            rps, latencies = measure(func, repeat)
+            report(f"{length} days, {name}", rps, latencies)
+
+
+def run_recompute(rows):
+    user = User(email=EMAIL, user_group='employee', days=0)
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    try:
+        db.session.bulk_insert_mappings(LeaveRequest, [
+            {'user_id': user_id, 'state': 'accepted', 'start_date': START + datetime.timedelta(days=i * 7),
+             'end_date': START + datetime.timedelta(days=i * 7 + 4), 'days': 5} for i in range(rows)])
+        db.session.commit()
+        # The requests over a holiday on a weekday change, a few in every year
+        calendar.configure(app.config.get('WEEKEND', (5, 6)), HOLIDAYS)
+        try:
+            started = time.perf_counter()
+            changed = recompute_leave_days()
+            elapsed = time.perf_counter() - started
+        finally:
+            calendar.configure(app.config.get('WEEKEND', (5, 6)), app.config.get('PUBLIC_HOLIDAYS', ()))
+        print(f"recompute_leave_days, {rows} requests, {changed} changed {elapsed * 1000:10.1f} ms   "
+              f"{rows / elapsed:10.1f} rows/s")
+    finally:
+        LeaveRequest.query.filter_by(user_id=user_id).delete()
+        db.session.delete(user)
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lengths', default='5,30,365')
+    parser.add_argument('--repeat', type=int, default=20000)
+    parser.add_argument('--rows', type=int, default=10000)
+    args = parser.parse_args()
+    run_counts([int(length) for length in args.lengths.split(',')], args.repeat)
+    with app.app_context():
+        run_recompute(args.rows)
@@ -0,0 +1,98 @@
+# Throughput of the production server (gunicorn -c gunicorn.conf.py wsgi:app) as the number of worker processes
+# grows. For every worker count a server is started, warmed up, then hammered for --duration seconds by
+# --clients client processes over keep-alive connections. The app uses the configured database.
+# Usage: python -m benchmarks.bench_workers [--workers 1,2,4] [--threads 4] [--clients 16] [--duration 10] [--path /]
+import argparse
+import http.client
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.utils import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def start_server(port, workers, threads):
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--workers', str(workers),
+                               '--threads', str(threads), '--bind', f'127.0.0.1:{port}', '--access-logfile', '/dev/null',
+                               'wsgi:app'], cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"gunicorn did not start listening on port {port}")
+
+
+def hammer(port, path, duration):
+    """Sends requests one after the other until `duration` is up, returns (statuses, latencies in ms)."""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    statuses = {}
+    latencies = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+            if response.will_close:
+                connection.close()
+        except (OSError, http.client.HTTPException):
+            status = 'error'
+            connection.close()
+        latencies.append((time.perf_counter() - started) * 1000)
+        statuses[status] = statuses.get(status, 0) + 1
+    connection.close()
+    return statuses, latencies
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run(worker_counts, threads, clients, duration, path):
+    baseline = None
+    with multiprocessing.Pool(clients) as pool:
+        for workers in worker_counts:
+            port = free_port()
+            server = start_server(port, workers, threads)
+            try:
+                pool.starmap(hammer, [(port, path, 1)] * clients)
+                results = pool.starmap(hammer, [(port, path, duration)] * clients)
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait()
+            statuses = {}
+            latencies = []
+            for result_statuses, result_latencies in results:
+                latencies += result_latencies
+                for status, count in result_statuses.items():
+                    statuses[status] = statuses.get(status, 0) + count
+            rps = len(latencies) / duration
+            baseline = baseline or rps
+            print(f"{workers:>3} worker(s) x {threads} thread(s) {rps:10.1f} req/s  x{rps / baseline:5.2f}   "
+                  f"p50 {percentile(latencies, 50):8.2f} ms   p99 {percentile(latencies, 99):8.2f} ms   "
+                  f"statuses {statuses}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--path', default='/')
+    args = parser.parse_args()
+    run([int(count) for count in args.workers.split(',')], args.threads, args.clients, args.duration, args.path)
@@ -0,0 +1,168 @@
+# The benchmark suite: the hot helpers and the main routes against data generated by flaskr.seed, with Google's
+# userinfo endpoint and the mail queue stubbed. The results go to a JSON file under benchmarks/results, and
+# --compare prints them against an earlier file, e.g. one written on another commit.
+# Usage: python -m benchmarks.suite [--users 200] [--requests 5000] [--repeat 200] [--micro-repeat 10000]
+#                                   [--only name,...] [--output FILE] [--compare FILE]
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+from unittest import mock
+
+from flask import session
+
+from flaskr import create_app, db, routes
+from flaskr.models import User, LeaveRequest, LeaveCategory
+from flaskr.seed import clear, seed
+from flaskr.workdays import calendar
+from benchmarks.utils import StubGoogle, measure, report, summarize
+
+app = create_app({'MIGRATIONS_ENABLED': False})
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+DOMAIN = 'suite.invalid'
+ADMIN = 'suite-admin@' + DOMAIN
+TOKEN = ('suite_token', '')
+
+
+def free_days(count):
+    """`count` working days from two years ahead on, one for every request the suite creates for ADMIN."""
+    day = datetime.date.today() + datetime.timedelta(days=730)
+    days = []
+    while len(days) < count:
+        if calendar.is_working(day):
+            days.append(day)
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def prepare(users, requests, repeat):
+    """Seeds the database and adds ADMIN with `repeat` pending requests for /handle_request to accept; returns the
+    days left for /save_request and the ids of the pending requests."""
+    seed(users, requests, domain=DOMAIN, random_seed=0)
+    admin = User(email=ADMIN, user_group='administrator', days=repeat,
+                 leave_category=LeaveCategory(category=DOMAIN + ' unlimited', max_days=10 ** 6))
+    db.session.add(admin)
+    db.session.commit()
+    days = free_days(2 * repeat)
+    db.session.bulk_insert_mappings(LeaveRequest, [
+        {'user_id': admin.id, 'state': 'pending', 'start_date': datetime.datetime.combine(day, datetime.time()),
+         'end_date': datetime.datetime.combine(day, datetime.time()), 'days': 1} for day in days[repeat:]])
+    db.session.commit()
+    pending = [id for id, in db.session.query(LeaveRequest.id)
+               .filter(LeaveRequest.user_id == admin.id, LeaveRequest.state == 'pending')]
+    return iter(days[:repeat]), iter(pending)
+
+
+def benchmarks(client, free, pending):
+    """(name, function to time, whether it is a micro-benchmark) for everything the suite measures."""
+    admin = User.query.filter_by(email=ADMIN).one()
+
+    def current_user():
+        with app.test_request_context('/'):
+            session['user'] = ADMIN
+            session['google_token'] = TOKEN
+            assert routes.get_current_user().email == ADMIN
+
+    def get(url):
+        def call():
+            resp = client.get(url)
+            if resp.status_code != 200:
+                fail(url, resp)
+        return call
+
+    def save_request():
+        day = next(free).strftime('%m/%d/%Y')
+        resp = client.post('/save_request', json={'current_user': ADMIN, 'start-date': day, 'end-date': day})
+        if resp.status_code != 201:
+            fail('/save_request', resp)
+
+    def handle_request():
+        resp = client.post('/handle_request', data={'accept': str(next(pending))})
+        if resp.status_code != 302:
+            fail('/handle_request', resp)
+
+    return [('get_current_user', current_user, True),
+            ('get_days_left', lambda: routes.get_days_left(admin), True),
+            ('send_email', lambda: routes.send_email("A leave request has been accepted.", ADMIN), True),
+            ('create_start_date', lambda: routes.create_start_date(['03', '14', '2019']), True),
+            ('GET /', get('/'), False),
+            ('GET /admin', get('/admin'), False),
+            ('GET /requests', get('/requests'), False),
+            ('POST /save_request', save_request, False),
+            ('POST /handle_request', handle_request, False)]
+
+
+def fail(url, resp):
+    raise RuntimeError(f"{url} answered {resp.status}")
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, path):
+    with open(path) as f:
+        before = json.load(f)
+    print(f"\nagainst {path} ({before.get('commit')}, {before.get('created')})")
+    for name, result in results.items():
+        old = before['results'].get(name)
+        if old is None:
+            continue
+        print(f"{name:<32} {old['rps']:10.1f} -> {result['rps']:10.1f} req/s  x{result['rps'] / old['rps']:5.2f}   "
+              f"p50 {old['p50_ms']:8.3f} -> {result['p50_ms']:8.3f} ms   p99 {old['p99_ms']:8.3f} -> "
+              f"{result['p99_ms']:8.3f} ms")
+
+
+def run(args):
+    only = set(args.only.split(',')) if args.only else None
+    clear(DOMAIN)
+    results = {}
+    try:
+        free, pending = prepare(args.users, args.requests, args.repeat)
+        with mock.patch.object(routes.google, 'get', StubGoogle(ADMIN, latency=0)), \
+                mock.patch.object(routes.mail_queue, 'submit'), app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['user'] = ADMIN
+                sess['google_token'] = TOKEN
+            for name, func, micro in benchmarks(client, free, pending):
+                if only and name not in only:
+                    continue
+                rps, latencies = measure(func, args.micro_repeat if micro else args.repeat)
+                report(name, rps, latencies)
+                results[name] = summarize(rps, latencies)
+    finally:
+        db.session.rollback()
+        clear(DOMAIN)
+    document = {'created': datetime.datetime.utcnow().isoformat(timespec='seconds'), 'commit': commit(),
+                'python': platform.python_version(), 'database': db.engine.dialect.name,
+                'parameters': {'users': args.users, 'requests': args.requests, 'repeat': args.repeat,
+                               'micro_repeat': args.micro_repeat},
+                'results': results}
+    name = '-'.join(part for part in (document['created'].replace(':', ''), document['commit']) if part)
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', name + '.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(document, f, indent=2)
+    print(f"\nwritten to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=200, help='Calls per route.')
+    parser.add_argument('--micro-repeat', type=int, default=10000, help='Calls per helper.')
+    parser.add_argument('--only', help='Comma separated names of the benchmarks to run.')
+    parser.add_argument('--output', help='JSON file to write, benchmarks/results/<time>-<commit>.json by default.')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare with.')
+    with app.app_context():
+        run(parser.parse_args())
@@ -0,0 +1,49 @@
+import time
+
+
+class StubGoogle:
+    """Stands in for `google.get`, answering the userinfo call after a simulated network round trip."""
+
+    class Response:
+        def __init__(self, data):
+            self.data = data
+
+    def __init__(self, email, latency=0.05):
+        self.email = email
+        self.latency = latency
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.Response({'email': self.email})
+
+
+def measure(func, requests):
+    """Calls `func` `requests` times and returns (requests per second, per-call latencies in ms)."""
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        call_started = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - call_started) * 1000)
+    elapsed = time.perf_counter() - started
+    return requests / elapsed, latencies
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(name, rps, latencies):
+    print(f"{name:<32} {rps:10.1f} req/s   p50 {percentile(latencies, 50):8.2f} ms   "
+          f"p99 {percentile(latencies, 99):8.2f} ms")
+
+
+def summarize(rps, latencies):
+    """The numbers `report` prints, as a dict to store as JSON."""
+    return {'calls': len(latencies), 'rps': round(rps, 1), 'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'p50_ms': round(percentile(latencies, 50), 3), 'p90_ms': round(percentile(latencies, 90), 3),
+            'p99_ms': round(percentile(latencies, 99), 3)}
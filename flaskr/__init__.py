@@ -1,31 +1,19 @@
 import os
 import logging
-import pymysql
 
 from flask import Flask, jsonify
 from flask_mail import Mail
-from flask_sqlalchemy import SQLAlchemy
-
-# create and configure the app
-pymysql.install_as_MySQLdb()
-app = Flask(__name__, instance_relative_config=True)
-app.config.from_pyfile('config.py')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config.from_mapping(
-    SECRET_KEY='dev',
-    SQLALCHEMY_DATABASE_URI='mysql+pymysql://root@db:3306/site'
-)
-logging.basicConfig(filename='flaskr_log.log', format='%(asctime)s - %(message)s', level=logging.NOTSET)
-db = SQLAlchemy(app)
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USERNAME'] = app.config.get('USER_EMAIL')
-app.config['MAIL_PASSWORD'] = app.config.get('USER_PW')
-mail = Mail(app)
-
-
-@app.errorhandler(Exception)
+
+from flaskr.logs import init_logging
+from flaskr.mailer import MailQueue
+from flaskr.routing import RoutingSQLAlchemy
+
+# Bound to an app by create_app; importing flaskr builds nothing else and touches neither the database nor the disk
+db = RoutingSQLAlchemy()
+mail = Mail()
+mail_queue = MailQueue()
+
+
 def handle_invalid_usage(error):
     response = jsonify({'message': 'Internal server error', 'description': str(error)})
     response.status_code = 500
@@ -33,15 +21,47 @@ def handle_invalid_usage(error):
     return response
 
 
-from flaskr import routes
+def create_app(config=None):
+    """Creates and configures the app; `config` overrides the instance config. Connections and the files the app
+    writes to are only opened when first needed."""
+    app = Flask(__name__, instance_relative_config=True)
+    app.config.from_pyfile('config.py')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.from_mapping(
+        SECRET_KEY='dev'
+    )
+    if config is not None:
+        app.config.from_mapping(config)
+    # DATABASE_DRIVER picks the MySQL driver: 'pymysql' (pure Python) or 'mysqldb' (mysqlclient, C)
+    database_driver = app.config.get('DATABASE_DRIVER', 'pymysql')
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', 'mysql+' + database_driver + '://root@db:3306/site')
+    if database_driver == 'pymysql':
+        import pymysql
+        pymysql.install_as_MySQLdb()
+    init_logging(app)
+    db.init_app(app)
+    # Alembic takes longer to import than the rest of the app together, and only `flask db` and run.py need it
+    if app.config.get('MIGRATIONS_ENABLED', True):
+        from flask_migrate import Migrate
+        Migrate(app, db, directory=os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                                                'migrations'))
+    app.config['MAIL_SERVER'] = 'smtp.gmail.com'
+    app.config['MAIL_PORT'] = 587
+    app.config['MAIL_USE_TLS'] = True
+    app.config['MAIL_USERNAME'] = app.config.get('USER_EMAIL')
+    app.config['MAIL_PASSWORD'] = app.config.get('USER_PW')
+    mail.init_app(app)
+    mail_queue.init_app(app, mail)
+    app.register_error_handler(Exception, handle_invalid_usage)
+
+    from flaskr import routes, balance, export, importer, metrics, seed
+
+    routes.init_app(app)
+    balance.init_app(app)
+    export.init_app(app)
+    importer.init_app(app)
+    seed.init_app(app)
+    metrics.init_app(app, mail_queue, db)
 
-# ensure the instance and reports folder exists
-try:
-    os.makedirs(app.instance_path)
-except FileExistsError as e:
-    logging.error("\n\n\n" + "Error: " + str(e))
+    return app
 
-try:
-    os.mkdir(os.path.join(os.path.dirname(os.path.realpath(__file__)), "reports"), 0o777)
-except FileExistsError as e:
-    logging.error("Error: " + str(e))
@@ -0,0 +1,136 @@
+import datetime
+import time
+from collections import Counter
+from threading import RLock
+
+from sqlalchemy import select
+
+from flaskr import db
+from flaskr.models import LeaveRequest
+
+INDEXED_STATES = ('accepted', 'pending')
+# Bucket holding every indexed state, so asking for all of them is as cheap as asking for one
+ANY_STATE = INDEXED_STATES
+
+
+class AvailabilityIndex:
+    """Day-bucketed occupancy index over LeaveRequest.
+
+    For every state in INDEXED_STATES and every day it keeps a count per user who is off that day, so
+    "who is off" and "how many are off" for a range only touch the days in the range instead of every request.
+    It is built from the database on first use, updated in place by `update` after a request is saved or
+    handled, and rebuilt after `ttl` seconds to pick up changes made by other processes.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._days = {}
+        self._requests = {}
+        self._built = None
+        self._lock = RLock()
+
+    def rebuild(self, rows=None):
+        """Builds the index from (id, user_id, state, start_date, end_date) rows, read from the database by default.
+        The rows are read under the lock, so an `update_rows` can't slip in between and be lost to older rows."""
+        with self._lock:
+            if rows is None:
+                rows = self._read()
+            self._days = {state: {} for state in INDEXED_STATES + (ANY_STATE,)}
+            self._requests = {}
+            for id, user_id, state, start_date, end_date in rows:
+                if state in INDEXED_STATES:
+                    self._add(id, user_id, state, start_date, end_date)
+            self._built = time.monotonic()
+
+    def _read(self):
+        # On a connection of its own to the primary: the request's session may read a lagging replica, or a
+        # snapshot taken before requests that update_rows has already added were committed
+        table = LeaveRequest.__table__
+        with db.engine.connect() as connection:
+            return connection.execute(select([table.c.id, table.c.user_id, table.c.state, table.c.start_date,
+                                               table.c.end_date]).where(table.c.state.in_(INDEXED_STATES))).fetchall()
+
+    def update(self, leave_request):
+        self.update_rows([(leave_request.id, leave_request.user_id, leave_request.state, leave_request.start_date,
+                           leave_request.end_date)])
+
+    def update_rows(self, rows):
+        """Replaces the entries of the given (id, user_id, state, start_date, end_date) rows."""
+        with self._lock:
+            if self._built is None:
+                return
+            for id, user_id, state, start_date, end_date in rows:
+                self._remove(id)
+                if state in INDEXED_STATES:
+                    self._add(id, user_id, state, start_date, end_date)
+
+    def daily_counts(self, start, end, states=('accepted',)):
+        """Returns [(date, number of users off)] for every day in [start, end]."""
+        self._ensure_fresh()
+        counts = []
+        with self._lock:
+            for day in ordinals(start, end):
+                counts.append((datetime.date.fromordinal(day), len(self._off(day, states))))
+        return counts
+
+    def users_off(self, start, end, states=('accepted',)):
+        """Returns {user id: number of days off} for the users who are off on any day in [start, end]."""
+        self._ensure_fresh()
+        users = Counter()
+        with self._lock:
+            for day in ordinals(start, end):
+                users.update(self._off(day, states))
+        return dict(users)
+
+    def _off(self, day, states):
+        if len(states) == 1:
+            return self._days[states[0]].get(day, {}).keys()
+        if set(states) == set(ANY_STATE):
+            return self._days[ANY_STATE].get(day, {}).keys()
+        off = set()
+        for state in states:
+            off.update(self._days[state].get(day, ()))
+        return off
+
+    def _ensure_fresh(self):
+        if self._stale():
+            with self._lock:
+                # The threads that found it stale together rebuild it once
+                if self._stale():
+                    self.rebuild()
+
+    def _stale(self):
+        return self._built is None or time.monotonic() - self._built > self.ttl
+
+    def _add(self, id, user_id, state, start_date, end_date):
+        self._requests[id] = (user_id, state, start_date, end_date)
+        days = ordinals(start_date, end_date)
+        for bucket in (self._days[state], self._days[ANY_STATE]):
+            for day in days:
+                users = bucket.get(day)
+                if users is None:
+                    bucket[day] = {user_id: 1}
+                else:
+                    users[user_id] = users.get(user_id, 0) + 1
+
+    def _remove(self, id):
+        entry = self._requests.pop(id, None)
+        if entry is None:
+            return
+        user_id, state, start_date, end_date = entry
+        days = ordinals(start_date, end_date)
+        for bucket in (self._days[state], self._days[ANY_STATE]):
+            for day in days:
+                users = bucket.get(day)
+                if users is None or user_id not in users:
+                    continue
+                users[user_id] -= 1
+                if users[user_id] <= 0:
+                    del users[user_id]
+                if not users:
+                    del bucket[day]
+
+
+def ordinals(start, end):
+    """Returns the proleptic ordinals of every day from start to end, both included; the index is keyed by them."""
+    return range(start.toordinal(), end.toordinal() + 1)
@@ -0,0 +1,211 @@
+import datetime
+import logging
+import time
+from collections import defaultdict
+from threading import Thread
+
+import click
+from flask.cli import with_appcontext
+
+from flaskr import db
+from flaskr.cache import TTLCache
+from flaskr.models import User, LeaveRequest
+from flaskr.workdays import calendar, working_days
+
+# Requests whose days are counted in User.days
+CHARGED_STATES = ('pending', 'accepted')
+
+# leave_category_id -> max_days, so working out a balance doesn't lazy-load the category every time
+category_limits = TTLCache(600)
+
+
+def leave_days(start_date, end_date):
+    return (end_date - start_date).days + 1
+
+
+def get_max_days(user):
+    if user.leave_category_id is None:
+        # No category: raises AttributeError just like reading max_days from a missing category
+        return user.leave_category.max_days
+    max_days = category_limits.get(user.leave_category_id)
+    if max_days is None:
+        max_days = user.leave_category.max_days
+        category_limits.set(user.leave_category_id, max_days)
+    return max_days
+
+
+def get_days_left(user):
+    return get_max_days(user) - user.days
+
+
+def charge_days(user, days, limit=None):
+    """Atomically adds `days` (negative for a refund) to the user's balance in the current transaction.
+
+    With `limit` the row is only updated while days + `days` stays within it, so two concurrent requests can't
+    both spend the last days. Returns False when the update was refused. The caller commits.
+    """
+    query = User.query.filter(User.id == user.id)
+    if limit is not None:
+        query = query.filter(User.days + days <= limit)
+    updated = query.update({User.days: User.days + days, User.version: User.version + 1},
+                           synchronize_session=False)
+    # The row changed behind the ORM's back, reload it on the next access
+    db.session.expire(user, ['days', 'version'])
+    return updated == 1
+
+
+def change_state(leave_request, state):
+    """Moves the request to `state` and charges or refunds its days to match, in the current transaction.
+
+    The state is compare-and-set against the one the request was read in, so of two concurrent changes of the same
+    request only one gets to move the balance. Returns False when the request already was in `state` or was
+    changed meanwhile. The caller commits.
+    """
+    old = leave_request.state
+    if old == state:
+        return False
+    updated = LeaveRequest.query.filter(LeaveRequest.id == leave_request.id, LeaveRequest.state == old) \
+        .update({LeaveRequest.state: state}, synchronize_session=False)
+    db.session.expire(leave_request, ['state', 'updated_at'])
+    if updated != 1:
+        return False
+    if (state in CHARGED_STATES) != (old in CHARGED_STATES):
+        charge_days(leave_request.user, leave_request.days if state in CHARGED_STATES else -leave_request.days)
+    return True
+
+
+def lock_user(user):
+    """Locks the user's row until the end of the transaction (SELECT ... FOR UPDATE), so checks made for the user
+    by concurrent transactions happen one after the other."""
+    db.session.query(User.id).filter(User.id == user.id).with_for_update().scalar()
+
+
+def overlapping_requests(user_id, start_date, end_date, max_span, lock=False):
+    """Returns the user's pending and accepted requests sharing a day with [start_date, end_date], by start date.
+
+    No request lasts longer than `max_span` days, so only the ones starting at most that long before start_date
+    can overlap: the lookup is a bounded range scan of the (user_id, start_date, end_date) index however long the
+    user's history is. With `lock` the rows it reads are locked until the end of the transaction.
+    """
+    query = LeaveRequest.query.filter(LeaveRequest.user_id == user_id,
+                                      LeaveRequest.start_date > start_date - datetime.timedelta(days=max_span),
+                                      LeaveRequest.start_date <= end_date,
+                                      LeaveRequest.end_date >= start_date,
+                                      LeaveRequest.state.in_(CHARGED_STATES)) \
+        .order_by(LeaveRequest.start_date)
+    if lock:
+        query = query.with_for_update()
+    return query.all()
+
+
+def conflicting_requests(leave_request, max_span):
+    """Locks the request's user and returns their other pending and accepted requests sharing a day with it, for
+    a request about to be charged again, e.g. a declined one being accepted."""
+    lock_user(leave_request.user)
+    return [other for other in overlapping_requests(leave_request.user_id, leave_request.start_date,
+                                                    leave_request.end_date, max_span, lock=True)
+            if other.id != leave_request.id]
+
+
+def forget_category(category_id):
+    category_limits.pop(category_id)
+
+
+def reconcile_balances(fix=False, chunk=1000):
+    """Recomputes every user's charged days from LeaveRequest and returns {user id: (recorded, expected)} for the
+    users whose User.days drifted. With `fix` the drifted balances are corrected, unless they changed meanwhile."""
+    expected = defaultdict(int)
+    rows = db.session.query(LeaveRequest.user_id, LeaveRequest.days) \
+        .filter(LeaveRequest.state.in_(CHARGED_STATES)).yield_per(chunk)
+    for user_id, days in rows:
+        expected[user_id] += days
+    drift = {}
+    for user_id, recorded in db.session.query(User.id, User.days).yield_per(chunk):
+        if recorded != expected.get(user_id, 0):
+            drift[user_id] = (recorded, expected.get(user_id, 0))
+    if fix and drift:
+        for user_id, (recorded, actual) in drift.items():
+            # Compare-and-set, so a request charged since the scan isn't overwritten
+            User.query.filter_by(id=user_id, days=recorded) \
+                .update({User.days: actual, User.version: User.version + 1}, synchronize_session=False)
+        db.session.commit()
+    return drift
+
+
+def recompute_leave_days(chunk=1000):
+    """Counts the working days of every leave request again with the current calendar, e.g. after PUBLIC_HOLIDAYS
+    changed, and moves the balances by the difference for the requests that are charged. Returns the number of
+    requests whose cost changed.
+
+    It is a single pass over the table: each cost is two lookups in the calendar's prefix sums, the changed costs
+    go back in one executemany and the balances in one update per user, all in one transaction. The rows are read
+    FOR UPDATE, so a request can't be accepted or declined with its old cost meanwhile.
+    """
+    changed = []
+    deltas = defaultdict(int)
+    rows = db.session.query(LeaveRequest.id, LeaveRequest.user_id, LeaveRequest.state, LeaveRequest.start_date,
+                            LeaveRequest.end_date, LeaveRequest.days).with_for_update().yield_per(chunk)
+    for id, user_id, state, start_date, end_date, days in rows:
+        cost = working_days(start_date, end_date)
+        if cost != days:
+            changed.append({'id': id, 'days': cost})
+            if state in CHARGED_STATES:
+                deltas[user_id] += cost - days
+    if changed:
+        db.session.bulk_update_mappings(LeaveRequest, changed)
+    for user_id, delta in deltas.items():
+        if delta:
+            User.query.filter(User.id == user_id) \
+                .update({User.days: User.days + delta, User.version: User.version + 1}, synchronize_session=False)
+    db.session.commit()
+    return len(changed)
+
+
+def report_drift(drift, fixed):
+    for user_id, (recorded, expected) in drift.items():
+        logging.warning("Balance drift for user id %s: recorded %s days, requests add up to %s%s", user_id, recorded,
+                        expected, " (fixed)" if fixed else "")
+
+
+def run_reconciler(app, interval, fix):
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                report_drift(reconcile_balances(fix=fix), fix)
+            except Exception as e:
+                logging.exception("Exception: %s", e)
+            finally:
+                db.session.remove()
+
+
+@click.command('reconcile-balances')
+@click.option('--fix', is_flag=True, help='Correct the balances that drifted.')
+@with_appcontext
+def reconcile_balances_command(fix):
+    """Recompute leave balances from the leave requests and report drift."""
+    drift = reconcile_balances(fix=fix)
+    report_drift(drift, fix)
+    for user_id, (recorded, expected) in drift.items():
+        click.echo(f"user {user_id}: recorded {recorded}, expected {expected}")
+    click.echo(f"{len(drift)} balance(s) drifted{', fixed' if fix and drift else ''}.")
+
+
+@click.command('recompute-leave-days')
+@with_appcontext
+def recompute_leave_days_command():
+    """Recount the working days of every leave request after the holidays changed, adjusting the balances."""
+    click.echo(f"{recompute_leave_days()} leave request(s) changed.")
+
+
+def init_app(app):
+    category_limits.ttl = app.config.get('CATEGORY_LIMIT_CACHE_TTL', 600)
+    calendar.configure(app.config.get('WEEKEND', (5, 6)), app.config.get('PUBLIC_HOLIDAYS', ()))
+    app.cli.add_command(reconcile_balances_command)
+    app.cli.add_command(recompute_leave_days_command)
+    interval = app.config.get('BALANCE_RECONCILE_INTERVAL', 0)
+    if interval:
+        @app.before_first_request
+        def start_reconciler():
+            Thread(target=run_reconciler, args=(app, interval, app.config.get('BALANCE_RECONCILE_FIX', False)),
+                   name='balance-reconciler', daemon=True).start()
@@ -1,9 +0,0 @@
-from threading import Thread
-
-def asynchronous(f):
-    def wrapper(*args, **kwargs):
-        thr = Thread(target=f, args=args, kwargs=kwargs)
-        thr.start()
-    return wrapper
-
-
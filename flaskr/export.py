@@ -0,0 +1,100 @@
+import csv
+import datetime
+import io
+import json
+import zlib
+from itertools import islice
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from flaskr import db
+from flaskr.models import User, LeaveRequest, LeaveCategory
+
+COLUMNS = ('id', 'email', 'user_group', 'category', 'state', 'start_date', 'end_date', 'days')
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+STATES = ('pending', 'accepted', 'declined')
+
+
+def export_rows(start=None, end=None, states=None, chunk=1000):
+    """The leave requests overlapping [start, end) in one of `states`, with their user and category, as tuples in
+    COLUMNS order. They are fetched `chunk` at a time through a server-side cursor, so memory stays flat however
+    many there are."""
+    query = db.session.query(LeaveRequest.id, User.email, User.user_group, LeaveCategory.category,
+                             LeaveRequest.state, LeaveRequest.start_date, LeaveRequest.end_date, LeaveRequest.days) \
+        .join(User, LeaveRequest.user_id == User.id) \
+        .outerjoin(LeaveCategory, User.leave_category_id == LeaveCategory.id)
+    if start is not None:
+        query = query.filter(LeaveRequest.end_date >= start)
+    if end is not None:
+        query = query.filter(LeaveRequest.start_date < end)
+    if states:
+        query = query.filter(LeaveRequest.state.in_(states))
+    return query.order_by(LeaveRequest.id).yield_per(chunk)
+
+
+def encode(rows, format='csv', batch=1000):
+    """Yields the rows as CSV with a header line or as JSON lines, in bytes chunks of `batch` rows."""
+    rows = iter(rows)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if format == 'csv':
+        writer.writerow(COLUMNS)
+    while True:
+        values = [(id, email, user_group, category, state, start_date.date().isoformat(),
+                   end_date.date().isoformat(), days)
+                  for id, email, user_group, category, state, start_date, end_date, days in islice(rows, batch)]
+        if not values:
+            break
+        if format == 'csv':
+            writer.writerows(values)
+        else:
+            buffer.write(''.join(json.dumps(dict(zip(COLUMNS, value))) + '\n' for value in values))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks, level=6):
+    """Compresses a stream of bytes chunks into a gzip stream as they come."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(start=None, end=None, states=None, format='csv', compress=False):
+    """The leave requests as a stream of bytes chunks, gzipped if `compress`; see export_rows."""
+    chunk = current_app.config.get('EXPORT_CHUNK_SIZE', 1000)
+    chunks = encode(export_rows(start, end, states, chunk), format, chunk)
+    if compress:
+        return gzip_chunks(chunks, current_app.config.get('EXPORT_GZIP_LEVEL', 6))
+    return chunks
+
+
+@click.command('export-leave-requests')
+@click.option('--start', type=click.DateTime(['%Y-%m-%d']), help='Only requests ending on or after this day.')
+@click.option('--end', type=click.DateTime(['%Y-%m-%d']), help='Only requests starting on or before this day.')
+@click.option('--state', 'states', multiple=True, type=click.Choice(STATES), help='Only requests in this state; '
+              'can be given more than once.')
+@click.option('--format', type=click.Choice(FORMATS), default='csv', show_default=True)
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--output', type=click.File('wb'), default='-', help='File to write, stdout by default.')
+@with_appcontext
+def export_command(start, end, states, format, compress, output):
+    """Export the leave requests with their users and categories, e.g. for payroll."""
+    if end is not None:
+        end += datetime.timedelta(days=1)
+    for chunk in export(start, end, states, format, compress):
+        output.write(chunk)
+
+
+def init_app(app):
+    app.cli.add_command(export_command)
@@ -0,0 +1,88 @@
+import json
+import logging
+import time
+import urllib.request
+from threading import Lock
+
+import jwt
+
+from flaskr.metrics import oauth_seconds
+
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+
+class KeySet:
+    """The signing keys published as a JWKS document at `uri`: an http(s):// or file:// URL, or a plain path.
+
+    The document is fetched on first use and again once it is `ttl` seconds old. A token signed with a key that
+    isn't in it yet triggers an early fetch, at most every `min_refresh` seconds, so rotated keys are picked up
+    without letting tokens with made-up key ids hammer the endpoint. When a fetch fails the keys fetched before
+    are kept and the next try waits `min_refresh` seconds, so logins don't each wait for an unreachable endpoint.
+    """
+
+    def __init__(self, uri=None, ttl=3600, min_refresh=60):
+        self.uri = uri
+        self.ttl = ttl
+        self.min_refresh = min_refresh
+        self._keys = {}
+        self._fetched = None
+        self._attempted = None
+        self._lock = Lock()
+
+    def get(self, kid):
+        if self._due(self.ttl):
+            self.refresh(self.ttl)
+        key = self._keys.get(kid)
+        if key is None and self._due(self.min_refresh):
+            self.refresh(self.min_refresh)
+            key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"No signing key with id {kid!r}")
+        return key
+
+    def refresh(self, max_age=0):
+        """Fetches the keys unless they are `max_age` seconds old at most, which they are when another thread fetched
+        them while this one waited for the lock. Raises the fetch's error only when there are no keys to keep."""
+        with self._lock:
+            if not self._due(max_age):
+                return
+            self._attempted = time.monotonic()
+            try:
+                with oauth_seconds.time('jwks'):
+                    document = self._fetch()
+                keys = {key.key_id: key.key for key in jwt.PyJWKSet.from_dict(document).keys}
+            except (OSError, ValueError, jwt.PyJWTError) as e:
+                if not self._keys:
+                    raise
+                logging.warning("Fetching the signing keys from %s failed, keeping the %d fetched before: %s",
+                                self.uri, len(self._keys), e)
+                return
+            self._keys = keys
+            self._fetched = self._attempted
+
+    def _due(self, max_age):
+        now = time.monotonic()
+        if self._fetched is not None and now - self._fetched <= max_age:
+            return False
+        # Without keys every use tries again, with keys a failed try isn't repeated for min_refresh seconds
+        return not self._keys or self._attempted is None or now - self._attempted > self.min_refresh
+
+    def _fetch(self):
+        if '://' not in self.uri:
+            with open(self.uri) as f:
+                return json.load(f)
+        with urllib.request.urlopen(self.uri, timeout=10) as response:
+            return json.load(response)
+
+
+def verify_id_token(token, keys, audience, issuers=GOOGLE_ISSUERS, leeway=60):
+    """Returns the claims of an OpenID Connect ID token after checking its signature against `keys`, its expiry,
+    audience and issuer, and that the email in it is verified. Raises jwt.InvalidTokenError otherwise."""
+    header = jwt.get_unverified_header(token)
+    claims = jwt.decode(token, keys.get(header.get('kid')), algorithms=['RS256'], audience=audience, leeway=leeway,
+                        options={'require': ['exp', 'iat', 'aud', 'iss', 'sub']})
+    if claims['iss'] not in issuers:
+        raise jwt.InvalidIssuerError(f"Unexpected issuer {claims['iss']!r}")
+    if not claims.get('email') or not claims.get('email_verified'):
+        raise jwt.InvalidTokenError("The token carries no verified email")
+    return claims
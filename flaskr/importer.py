@@ -0,0 +1,252 @@
+import bisect
+import csv
+import datetime
+from collections import defaultdict
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, func
+
+from flaskr import db
+from flaskr.balance import CHARGED_STATES, leave_days
+from flaskr.export import STATES
+from flaskr.models import User, LeaveRequest, LeaveCategory
+from flaskr.workdays import working_days
+
+
+class CSVImport:
+    """Loads users with their groups and categories, and their past leave requests, from CSV.
+
+    The users CSV has email, user_group and category columns, plus max_days for the categories to create. Users
+    that already exist get the group and category given. The leave requests CSV has email, start_date, end_date
+    (YYYY-MM-DD) and state columns, plus days to override the working days counted, so an export can be imported
+    back. Other columns are ignored.
+
+    `run` yields an error for every row it skips, as it gets to it. The valid rows go in `chunk` at a time with
+    executemany, and the balances of the users with imported requests are recomputed once at the end. It is all
+    one transaction, rolled back instead of committed with `dry_run`.
+    """
+
+    def __init__(self, chunk=1000, dry_run=False):
+        self.chunk = chunk
+        self.dry_run = dry_run
+        self.counts = {'users': 0, 'updated_users': 0, 'categories': 0, 'leave_requests': 0, 'errors': 0}
+        self.committed = False
+
+    def run(self, users=None, leave_requests=None):
+        """Imports the CSV rows of `users` and `leave_requests`, iterables of text lines, yielding error messages."""
+        try:
+            self._ids = dict(db.session.query(User.email, User.id))
+            # Only users that were there before the import can have requests in the database
+            self._existing = set(self._ids.values())
+            self._categories = dict(db.session.query(LeaveCategory.category, LeaveCategory.id))
+            if users is not None:
+                yield from self._import_users(users)
+            if leave_requests is not None:
+                yield from self._import_leave_requests(leave_requests)
+            if (self.counts['users'] or self.counts['updated_users']) and \
+                    not User.query.filter_by(user_group='administrator').count():
+                self.counts['errors'] += 1
+                yield "At least 1 administrator needs to be in the system, nothing was imported!"
+                db.session.rollback()
+            elif self.dry_run:
+                db.session.rollback()
+            else:
+                db.session.commit()
+                self.committed = True
+        except BaseException:
+            db.session.rollback()
+            raise
+
+    def summary(self):
+        counts = self.counts
+        text = (f"{counts['users']} user(s) added, {counts['updated_users']} updated, {counts['categories']} "
+                f"categories added, {counts['leave_requests']} leave request(s) added, {counts['errors']} row(s) "
+                f"skipped")
+        return text if self.committed else text + ", nothing saved"
+
+    def _rows(self, lines, name, columns):
+        reader = csv.DictReader(lines)
+        missing = [column for column in columns if column not in (reader.fieldnames or ())]
+        if missing:
+            self.counts['errors'] += 1
+            yield None, f"{name}: missing column(s) {', '.join(missing)}"
+            return
+        for row in reader:
+            yield reader.line_num, {key: (value or '').strip() for key, value in row.items() if key is not None}
+
+    def _error(self, name, line, message):
+        self.counts['errors'] += 1
+        return f"{name} line {line}: {message}"
+
+    def _import_users(self, lines):
+        table = User.__table__
+        update = table.update().where(table.c.id == bindparam('user_id')) \
+            .values(user_group=bindparam('group'), leave_category_id=bindparam('category_id'),
+                    version=table.c.version + 1)
+        groups = current_app.config.get('USER_GROUPS')
+        added, updated, seen = [], [], set()
+        for line, row in self._rows(lines, 'users', ('email', 'user_group', 'category')):
+            if line is None:
+                yield row
+                return
+            email, group = row['email'], row['user_group']
+            try:
+                if '@' not in email or len(email) > 120:
+                    raise ValueError(f"invalid email {email!r}")
+                if email in seen:
+                    raise ValueError(f"{email} is listed more than once")
+                if group not in groups:
+                    raise ValueError(f"unknown user group {group!r}, expected one of {', '.join(groups)}")
+                category_id = self._category(row['category'], row.get('max_days'))
+            except ValueError as e:
+                yield self._error('users', line, e)
+                continue
+            seen.add(email)
+            if email in self._ids:
+                updated.append({'user_id': self._ids[email], 'group': group, 'category_id': category_id})
+            else:
+                added.append({'email': email, 'user_group': group, 'leave_category_id': category_id, 'days': 0})
+            if len(added) >= self.chunk:
+                self._add_users(added)
+            if len(updated) >= self.chunk:
+                self._update_users(update, updated)
+        self._add_users(added)
+        self._update_users(update, updated)
+        self._ids = dict(db.session.query(User.email, User.id))
+
+    def _category(self, name, max_days):
+        if not name:
+            return None
+        if name not in self._categories:
+            if max_days and not max_days.isdigit():
+                raise ValueError(f"invalid max_days {max_days!r}")
+            category = LeaveCategory(category=name, max_days=int(max_days) if max_days else 20)
+            db.session.add(category)
+            db.session.flush()
+            self._categories[name] = category.id
+            self.counts['categories'] += 1
+        return self._categories[name]
+
+    def _add_users(self, mappings):
+        if mappings:
+            db.session.bulk_insert_mappings(User, mappings)
+            self.counts['users'] += len(mappings)
+            del mappings[:]
+
+    def _update_users(self, update, params):
+        if params:
+            db.session.execute(update, params)
+            self.counts['updated_users'] += len(params)
+            del params[:]
+
+    def _import_leave_requests(self, lines):
+        max_span = current_app.config.get('LEAVE_REQUEST_MAX_DAYS', 366)
+        # The pending and accepted requests of every user met so far as sorted [start, end] ordinals, so an
+        # overlap with the database or an earlier row is found with a bisection
+        taken = {}
+        # Days charged by the imported requests, per user
+        charged = defaultdict(int)
+        batch = []
+        for line, row in self._rows(lines, 'leave requests', ('email', 'start_date', 'end_date', 'state')):
+            if line is None:
+                yield row
+                return
+            try:
+                user_id = self._ids.get(row['email'])
+                if user_id is None:
+                    raise ValueError(f"unknown user {row['email']!r}")
+                start_date = datetime.datetime.fromisoformat(row['start_date'])
+                end_date = datetime.datetime.fromisoformat(row['end_date'])
+                if end_date < start_date:
+                    raise ValueError("end_date is before start_date")
+                if leave_days(start_date, end_date) > max_span:
+                    raise ValueError(f"longer than {max_span} days")
+                if row['state'] not in STATES:
+                    raise ValueError(f"unknown state {row['state']!r}, expected one of {', '.join(STATES)}")
+                days = int(row['days']) if row.get('days') else working_days(start_date, end_date)
+                if days < 0:
+                    raise ValueError("days is negative")
+            except ValueError as e:
+                yield self._error('leave requests', line, e)
+                continue
+            batch.append((line, {'user_id': user_id, 'start_date': start_date, 'end_date': end_date,
+                                 'state': row['state'], 'days': days}))
+            if len(batch) >= self.chunk:
+                yield from self._add_leave_requests(batch, taken, charged)
+        yield from self._add_leave_requests(batch, taken, charged)
+        self._recompute_balances(taken, charged)
+
+    def _add_leave_requests(self, batch, taken, charged):
+        new_users = {mapping['user_id'] for line, mapping in batch} - taken.keys()
+        for user_id in new_users:
+            taken[user_id] = []
+        if new_users & self._existing:
+            existing = db.session.query(LeaveRequest.user_id, LeaveRequest.state, LeaveRequest.start_date,
+                                        LeaveRequest.end_date) \
+                .filter(LeaveRequest.user_id.in_(new_users & self._existing))
+            for user_id, state, start_date, end_date in existing:
+                if state in CHARGED_STATES:
+                    bisect.insort(taken[user_id], (start_date.toordinal(), end_date.toordinal()))
+        mappings = []
+        for line, mapping in batch:
+            if mapping['state'] in CHARGED_STATES:
+                ranges = taken[mapping['user_id']]
+                start, end = mapping['start_date'].toordinal(), mapping['end_date'].toordinal()
+                i = bisect.bisect(ranges, (start, end))
+                if (i and ranges[i - 1][1] >= start) or (i < len(ranges) and ranges[i][0] <= end):
+                    yield self._error('leave requests', line, "overlaps another pending or accepted request of "
+                                                              "the user")
+                    continue
+                ranges.insert(i, (start, end))
+                charged[mapping['user_id']] += mapping['days']
+            mappings.append(mapping)
+        if mappings:
+            db.session.bulk_insert_mappings(LeaveRequest, mappings)
+            self.counts['leave_requests'] += len(mappings)
+        del batch[:]
+
+    def _recompute_balances(self, user_ids, charged):
+        """Sets the balance of the users to the days charged by all their requests. The users added by the import
+        have only the imported ones, so only the others' are summed in the database."""
+        table = User.__table__
+        update = table.update().where(table.c.id == bindparam('user_id')) \
+            .values(days=bindparam('charged'), version=table.c.version + 1)
+        user_ids = sorted(user_ids)
+        for offset in range(0, len(user_ids), self.chunk):
+            chunk = user_ids[offset:offset + self.chunk]
+            existing = [user_id for user_id in chunk if user_id in self._existing]
+            totals = dict(db.session.query(LeaveRequest.user_id, func.sum(LeaveRequest.days))
+                          .filter(LeaveRequest.user_id.in_(existing), LeaveRequest.state.in_(CHARGED_STATES))
+                          .group_by(LeaveRequest.user_id)) if existing else {}
+            db.session.execute(update, [{'user_id': user_id,
+                                         'charged': int(totals.get(user_id) or 0) if user_id in self._existing
+                                         else charged[user_id]} for user_id in chunk])
+
+
+@click.command('import-csv')
+@click.option('--users', type=click.Path(exists=True, dir_okay=False),
+              help='CSV of users: email, user_group, category and optionally max_days.')
+@click.option('--leave-requests', type=click.Path(exists=True, dir_okay=False),
+              help='CSV of leave requests: email, start_date, end_date, state and optionally days.')
+@click.option('--dry-run', is_flag=True, help='Only check the files.')
+@with_appcontext
+def import_command(users, leave_requests, dry_run):
+    """Import users, their groups and categories, and past leave requests from CSV files."""
+    if users is None and leave_requests is None:
+        raise click.UsageError("Give --users, --leave-requests or both.")
+    csv_import = CSVImport(current_app.config.get('IMPORT_CHUNK_SIZE', 1000), dry_run)
+    files = [open(path, newline='', encoding='utf-8-sig') if path else None for path in (users, leave_requests)]
+    try:
+        for error in csv_import.run(*files):
+            click.echo(error, err=True)
+    finally:
+        for f in files:
+            if f is not None:
+                f.close()
+    click.echo(csv_import.summary())
+
+
+def init_app(app):
+    app.cli.add_command(import_command)
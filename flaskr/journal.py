@@ -0,0 +1,178 @@
+import atexit
+import bisect
+import datetime
+import json
+import logging
+import os
+import uuid
+from threading import Condition, Lock, Thread
+
+
+class ReportJournal:
+    """Append-only store for error reports, kept as JSON lines in size-rotated segment files.
+
+    Every process appends to its own segment, named after the time it was opened and the pid, and starts a new
+    one once it grows past `max_bytes`. `append` only buffers the report; a writer thread writes the buffer with
+    one write and one fsync every `flush_interval` seconds, or as soon as `batch_size` reports are waiting, and
+    once more when the process exits.
+
+    An in-memory index of (created, id) -> (user, segment, offset) lets `search` find the matching reports and
+    seek straight to them. It catches up with the segments of other processes by reading only what they
+    appended since the last look.
+    """
+
+    def __init__(self, directory, max_bytes=10 * 1024 * 1024, flush_interval=1.0, batch_size=500):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._buffer = []
+        self._file = None
+        self._keys = []
+        self._entries = {}
+        self._ids = {}
+        self._indexed = {}
+        self._lock = Lock()
+        self._write_lock = Lock()
+        self._index_lock = Lock()
+        self._pending = Condition(self._lock)
+        self._writer = None
+
+    def append(self, user, body):
+        record = {'id': uuid.uuid4().hex, 'created': datetime.datetime.utcnow().isoformat(), 'user': user,
+                  'body': body}
+        self._start()
+        with self._lock:
+            self._buffer.append(record)
+            if len(self._buffer) >= self.batch_size:
+                self._pending.notify()
+        return record
+
+    def flush(self):
+        """Writes and fsyncs everything appended so far, returns the number of reports written."""
+        with self._write_lock:
+            with self._lock:
+                records, self._buffer = self._buffer, []
+            if records:
+                self._write(records)
+        return len(records)
+
+    def get(self, id):
+        self._refresh()
+        with self._index_lock:
+            key = self._ids.get(id)
+            entry = self._entries.get(key)
+        return self._read([entry])[0] if entry else None
+
+    def search(self, user=None, text=None, since=None, until=None, before=None, limit=50):
+        """Returns up to `limit` reports, newest first, matching all given filters: the reporter's email, a
+        case-insensitive substring of the body and an ISO timestamp range [since, until). `before` is the id of
+        the last report of the previous page."""
+        self._refresh()
+        text = text.lower() if text else None
+        with self._index_lock:
+            end = len(self._keys)
+            if before is not None and before in self._ids:
+                end = bisect.bisect_left(self._keys, self._ids[before])
+            if until:
+                end = min(end, bisect.bisect_left(self._keys, (until,)))
+            start = bisect.bisect_left(self._keys, (since,)) if since else 0
+            candidates = [self._entries[key] for key in reversed(self._keys[start:end])
+                          if user is None or self._entries[key][0] == user]
+        results = []
+        # Bodies are only read for the candidates, a page at a time
+        for offset in range(0, len(candidates), limit):
+            for record in self._read(candidates[offset:offset + limit]):
+                if text is None or text in record['body'].lower():
+                    results.append(record)
+                    if len(results) == limit:
+                        return results
+        return results
+
+    def close(self):
+        self.flush()
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _start(self):
+        if self._writer is not None:
+            return
+        with self._lock:
+            if self._writer is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._writer = Thread(target=self._work, name='report-journal', daemon=True)
+                self._writer.start()
+                atexit.register(self.close)
+
+    def _work(self):
+        while True:
+            with self._lock:
+                self._pending.wait(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logging.exception("Exception: %s", e)
+
+    def _write(self, records):
+        if self._file is None or self._file.tell() >= self.max_bytes:
+            self._rotate()
+        data = ''.join(json.dumps(record) + '\n' for record in records).encode()
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        segment = f"{datetime.datetime.utcnow():%Y%m%d%H%M%S%f}-{os.getpid()}.jsonl"
+        self._file = open(os.path.join(self.directory, segment), 'ab')
+
+    def _refresh(self):
+        """Indexes whatever was appended to the segments since the last call."""
+        # Our own reports are searchable as soon as they are appended
+        self.flush()
+        if not os.path.isdir(self.directory):
+            return
+        with self._index_lock:
+            for segment in sorted(os.listdir(self.directory)):
+                if not segment.endswith('.jsonl'):
+                    continue
+                offset = self._indexed.get(segment, 0)
+                path = os.path.join(self.directory, segment)
+                if os.path.getsize(path) <= offset:
+                    continue
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            # Another process is half way through writing this line
+                            break
+                        try:
+                            self._index(json.loads(line), segment, offset, len(line))
+                        except (ValueError, KeyError) as e:
+                            logging.error("Skipping a damaged report in %s at %d: %s", segment, offset, e)
+                        offset += len(line)
+                self._indexed[segment] = offset
+
+    def _index(self, record, segment, offset, length):
+        key = (record['created'], record['id'])
+        bisect.insort(self._keys, key)
+        self._entries[key] = (record['user'], segment, offset, length)
+        self._ids[record['id']] = key
+
+    def _read(self, entries):
+        records = []
+        files = {}
+        try:
+            for user, segment, offset, length in entries:
+                f = files.get(segment)
+                if f is None:
+                    f = files[segment] = open(os.path.join(self.directory, segment), 'rb')
+                f.seek(offset)
+                records.append(json.loads(f.read(length)))
+        finally:
+            for f in files.values():
+                f.close()
+        return records
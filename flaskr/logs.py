@@ -0,0 +1,125 @@
+import atexit
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+import uuid
+
+from flask import g, has_request_context, request, session
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the id of the request being served and the user behind it.
+
+    It runs on the thread that logs, before the record is queued, since the listener thread has no request.
+    """
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.user = session.get('user')
+        else:
+            record.request_id = None
+            record.user = None
+        return True
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """Queues records with their message merged and their traceback rendered, but otherwise intact, so the
+    listener can still write them as structured records."""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'message': record.getMessage(),
+                 'request_id': getattr(record, 'request_id', None),
+                 'user': getattr(record, 'user', None)}
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class RotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Rolls the file over once it reaches `max_bytes` or once it has been written to for `interval` seconds,
+    whichever comes first, keeping `backup_count` numbered backups."""
+
+    def __init__(self, filename, max_bytes=0, backup_count=0, interval=0):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval if interval else None
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return 1
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+
+def init_logging(app):
+    """Routes every record through a queue to a writer thread, so a request only pays for building the record.
+
+    LOG_LEVEL sets the root level and LOG_LEVELS the level of individual loggers (e.g. quieting SQLAlchemy).
+    Records are written as JSON lines to LOG_FILE, rotated at LOG_MAX_BYTES or every LOG_ROTATE_INTERVAL seconds,
+    or to stderr when LOG_FILE is None. The rotation only works for a single process: gunicorn's workers would
+    each rename the shared file under the others, so wsgi.py logs to stderr.
+    """
+    log_file = app.config.get('LOG_FILE', 'flaskr_log.log')
+    if log_file:
+        handler = RotatingFileHandler(log_file,
+                                      app.config.get('LOG_MAX_BYTES', 10 * 1024 * 1024),
+                                      app.config.get('LOG_BACKUP_COUNT', 10),
+                                      app.config.get('LOG_ROTATE_INTERVAL', 24 * 60 * 60))
+    else:
+        handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JSONFormatter())
+    records = queue.Queue(-1)
+    queue_handler = StructuredQueueHandler(records)
+    queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(queue_handler)
+    root.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+    for name, level in app.config.get('LOG_LEVELS', {}).items():
+        logging.getLogger(name).setLevel(level)
+
+    listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    # A forked worker has to start its own writer thread, see gunicorn.conf.py
+    app.extensions['log_listener'] = listener
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+    @app.after_request
+    def return_request_id(response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+        return response
+
+    return listener
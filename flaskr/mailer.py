@@ -0,0 +1,219 @@
+import atexit
+import logging
+import queue
+import time
+from smtplib import SMTPException, SMTPServerDisconnected
+from threading import Lock, Thread
+
+
+class LatencyStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def as_dict(self, prefix):
+        return {prefix + '_count': self.count,
+                prefix + '_avg_ms': self.total / self.count * 1000 if self.count else 0.0,
+                prefix + '_max_ms': self.max * 1000}
+
+
+class MailQueue:
+    """Bounded pool of mail workers fed through a queue.
+
+    Each worker keeps one SMTP connection (Flask-Mail's `mail.connect()`) open while there is mail to send and
+    closes it after MAIL_IDLE_TIMEOUT seconds without work. When the queue is full `submit` blocks for up to
+    MAIL_QUEUE_TIMEOUT seconds and then drops the messages, so a burst of notifications can't pile up threads
+    or memory.
+    """
+
+    def __init__(self, app=None, mail=None):
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.wait_latency = LatencyStats()
+        self.send_latency = LatencyStats()
+        self._queue = queue.Queue()
+        self._threads = []
+        self._started = 0
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app, mail)
+
+    def init_app(self, app, mail):
+        self.app = app
+        self.mail = mail
+        self.workers = app.config.get('MAIL_WORKERS', 2)
+        self.put_timeout = app.config.get('MAIL_QUEUE_TIMEOUT', 5)
+        self.idle_timeout = app.config.get('MAIL_IDLE_TIMEOUT', 30)
+        self._queue.maxsize = app.config.get('MAIL_QUEUE_SIZE', 500)
+
+    def submit(self, messages):
+        """Queues messages that are sent one after the other over the same connection."""
+        self._start()
+        try:
+            self._queue.put((time.monotonic(), list(messages)), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self.dropped += len(messages)
+            logging.error("Mail queue is full, dropped %d message(s)", len(messages))
+            return False
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self):
+        stats = {'queue_depth': self._queue.qsize(), 'workers': len(self._threads), 'sent': self.sent,
+                 'failed': self.failed, 'dropped': self.dropped}
+        stats.update(self.wait_latency.as_dict('queue_wait'))
+        stats.update(self.send_latency.as_dict('send_latency'))
+        return stats
+
+    def _start(self):
+        if len(self._threads) >= self.workers and all(thread.is_alive() for thread in self._threads):
+            return
+        with self._lock:
+            # A worker that died anyway is replaced, so the queue can't stop draining for good
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = Thread(target=self._work, name=f'mail-worker-{self._started}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+                self._started += 1
+
+    def _work(self):
+        with self.app.app_context():
+            connection = None
+            while True:
+                try:
+                    enqueued, messages = self._queue.get(timeout=self.idle_timeout if connection else None)
+                except queue.Empty:
+                    connection = self._close(connection)
+                    continue
+                self.wait_latency.record(time.monotonic() - enqueued)
+                try:
+                    for message in messages:
+                        connection = self._send(connection, message)
+                finally:
+                    self._queue.task_done()
+
+    def _send(self, connection, message):
+        started = time.monotonic()
+        try:
+            if connection is None:
+                connection = self._open()
+            try:
+                connection.send(message)
+            except SMTPServerDisconnected:
+                # The server hung up on the idle connection, try once more on a fresh one
+                self._close(connection)
+                connection = self._open()
+                connection.send(message)
+            self.sent += 1
+        except (SMTPException, OSError) as e:
+            self.failed += 1
+            logging.exception("Exception: %s", e)
+            connection = self._close(connection)
+        except (AssertionError, TypeError) as e:
+            self.failed += 1
+            logging.error("Error: %s", e)
+        except Exception as e:
+            # Anything else, e.g. Flask-Mail's BadHeaderError, only loses this message, never the worker
+            self.failed += 1
+            logging.exception("Exception: %s", e)
+            connection = self._close(connection)
+        self.send_latency.record(time.monotonic() - started)
+        return connection
+
+    def _open(self):
+        connection = self.mail.connect()
+        connection.__enter__()
+        return connection
+
+    def _close(self, connection):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except (SMTPException, OSError):
+                pass
+        return None
+
+
+class MailDigest:
+    """Buffers notification changes per recipient and sends them as one message per recipient.
+
+    The buffer is flushed every MAIL_DIGEST_INTERVAL seconds, as soon as one recipient has MAIL_DIGEST_MAX_CHANGES
+    changes waiting, and when the process exits. A flush hands all its messages to the mail queue as one job, so
+    they go out over a single SMTP connection. `build_message(recipients, changes)` turns the buffered changes
+    into a Message.
+    """
+
+    def __init__(self, app=None, mail_queue=None, build_message=None):
+        self.mail_queue = mail_queue
+        self.build_message = build_message
+        self.enabled = False
+        self._pending = {}
+        self._lock = Lock()
+        self._timer = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('MAIL_DIGEST', False)
+        self.interval = app.config.get('MAIL_DIGEST_INTERVAL', 300)
+        self.max_changes = app.config.get('MAIL_DIGEST_MAX_CHANGES', 50)
+
+    def add(self, recipients, change):
+        self._start()
+        with self._lock:
+            full = False
+            for recipient in recipients:
+                changes = self._pending.setdefault(recipient, [])
+                changes.append(change)
+                full = full or len(changes) >= self.max_changes
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        with self.app.app_context():
+            messages = [self.build_message([recipient], changes) for recipient, changes in pending.items()]
+        self.mail_queue.submit(messages)
+        return len(messages)
+
+    def _start(self):
+        if self._timer is not None:
+            return
+        with self._lock:
+            if self._timer is None:
+                self._timer = Thread(target=self._tick, name='mail-digest', daemon=True)
+                self._timer.start()
+                atexit.register(self._shutdown)
+
+    def _tick(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.exception("Exception: %s", e)
+
+    def _shutdown(self):
+        if self.flush():
+            self.mail_queue.join(timeout=10)
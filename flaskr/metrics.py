@@ -0,0 +1,217 @@
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock, local
+
+from flask import Response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per tuple of label values."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.enabled = False
+        self._series = {}
+        self._lock = Lock()
+
+    def observe(self, value, *labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def clear(self):
+        with self._lock:
+            self._series = {}
+
+    def render(self, constant=()):
+        """Renders every series, with the `constant` (name, value) label pairs in front of its own."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            pairs = list(constant) + list(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(pairs + [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(pairs)} {total}")
+            lines.append(f"{self.name}_count{format_labels(pairs)} {cumulative}")
+        return lines
+
+
+def format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+request_seconds = Histogram('flaskr_request_duration_seconds', 'Time spent serving a request.',
+                            ('endpoint', 'method', 'status'))
+request_queries = Histogram('flaskr_request_sql_queries', 'SQL statements sent while serving a request.',
+                            ('endpoint',), QUERY_BUCKETS)
+request_query_seconds = Histogram('flaskr_request_sql_duration_seconds', 'Time spent in SQL while serving a request.',
+                                  ('endpoint',))
+oauth_seconds = Histogram('flaskr_oauth_call_duration_seconds', 'Time spent waiting for Google OAuth calls.',
+                          ('call',))
+HISTOGRAMS = (request_seconds, request_queries, request_query_seconds, oauth_seconds)
+
+
+def render_mail_queue(mail_queue, constant=()):
+    stats = mail_queue.stats()
+    labels = format_labels(constant)
+    lines = []
+    for name, kind, value, documentation in (
+            ('flaskr_mail_queue_depth', 'gauge', stats['queue_depth'], 'Mail jobs waiting for a worker.'),
+            ('flaskr_mail_sent_total', 'counter', stats['sent'], 'Messages sent.'),
+            ('flaskr_mail_failed_total', 'counter', stats['failed'], 'Messages that could not be sent.'),
+            ('flaskr_mail_dropped_total', 'counter', stats['dropped'], 'Messages dropped on a full queue.')):
+        lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}", f"{name}{labels} {value}"]
+    for prefix, name, documentation in (
+            ('queue_wait', 'flaskr_mail_queue_wait_seconds', 'Time mail jobs waited in the queue.'),
+            ('send_latency', 'flaskr_mail_send_duration_seconds', 'Time spent sending one message.')):
+        lines += [f"# HELP {name} {documentation}", f"# TYPE {name} summary",
+                  f"{name}_sum{labels} {stats[prefix + '_avg_ms'] * stats[prefix + '_count'] / 1000}",
+                  f"{name}_count{labels} {stats[prefix + '_count']}"]
+    return lines
+
+
+# Pool event -> times it happened: new connections, checkouts, and connections thrown away as dead (pre-ping)
+pool_events = {'connect': 0, 'checkout': 0, 'invalidate': 0}
+
+
+def count_pool_event(name):
+    def listener(*args):
+        pool_events[name] += 1
+    listener.__name__ = 'count_' + name
+    return listener
+
+
+POOL_LISTENERS = {name: count_pool_event(name) for name in pool_events}
+
+
+def render_pool(pool, constant=()):
+    labels = format_labels(constant)
+    lines = []
+    for name, method, documentation in (
+            ('flaskr_db_pool_size', 'size', 'Connections the pool keeps open.'),
+            ('flaskr_db_pool_checked_out', 'checkedout', 'Connections in use.'),
+            ('flaskr_db_pool_checked_in', 'checkedin', 'Idle connections in the pool.'),
+            ('flaskr_db_pool_overflow', 'overflow', 'Connections opened beyond the pool size.')):
+        if hasattr(pool, method):
+            lines += [f"# HELP {name} {documentation}", f"# TYPE {name} gauge",
+                      f"{name}{labels} {getattr(pool, method)()}"]
+    name = 'flaskr_db_pool_events_total'
+    lines += [f"# HELP {name} Connections opened, checked out and invalidated.", f"# TYPE {name} counter"]
+    lines += [f"{name}{format_labels(list(constant) + [('event', event_name)])} {count}"
+              for event_name, count in pool_events.items()]
+    return lines
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'query_seconds', 'status')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.status = None
+
+
+# The stats of the request the thread is serving; a plain thread local, since the SQL listeners run for every
+# statement and going through flask.g there costs more than the rest of the bookkeeping together
+_current = local()
+
+
+def start_timer():
+    _current.stats = RequestStats()
+
+
+def record_status(response):
+    stats = getattr(_current, 'stats', None)
+    if stats is not None:
+        stats.status = response.status_code
+    return response
+
+
+def record_request(error=None):
+    stats = getattr(_current, 'stats', None)
+    if stats is None:
+        return
+    _current.stats = None
+    endpoint = request.url_rule.endpoint if request.url_rule is not None else 'unmatched'
+    status = stats.status or (500 if error is not None else 200)
+    request_seconds.observe(time.perf_counter() - stats.started, endpoint, request.method, status)
+    request_queries.observe(stats.queries, endpoint)
+    request_query_seconds.observe(stats.query_seconds, endpoint)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+    stats = getattr(_current, 'stats', None)
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += elapsed
+
+
+def init_app(app, mail_queue, db=None):
+    """With METRICS_ENABLED, times every request, its SQL and the OAuth calls, and serves them together with
+    the mail queue and connection pool stats in Prometheus text format on /metrics. Otherwise nothing is hooked
+    in at all.
+
+    The numbers are those of the process that answers. Under gunicorn that is one worker out of several, so every
+    sample carries its pid: the series of different workers stay apart instead of looking like counter resets,
+    and a worker restarted by max_requests starts new ones."""
+    if not app.config.get('METRICS_ENABLED', False):
+        return
+    for histogram in HISTOGRAMS:
+        histogram.enabled = True
+    app.before_request(start_timer)
+    app.after_request(record_status)
+    app.teardown_request(record_request)
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    for name, listener in POOL_LISTENERS.items():
+        event.listen(Pool, name, listener)
+    token = app.config.get('METRICS_TOKEN')
+
+    @app.route('/metrics')
+    def metrics():
+        if token and request.headers.get('Authorization') != 'Bearer ' + token:
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        constant = [('pid', os.getpid())]
+        lines = []
+        for histogram in HISTOGRAMS:
+            lines += histogram.render(constant)
+        lines += render_mail_queue(mail_queue, constant)
+        if db is not None:
+            lines += render_pool(db.engine.pool, constant)
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
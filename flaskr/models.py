@@ -1,4 +1,5 @@
 from flaskr import db
+from flaskr.workdays import working_days
 from datetime import datetime
 
 class User(db.Model):
@@ -9,16 +10,41 @@ class User(db.Model):
     notification = db.Column(db.Boolean, default=True, nullable=False)
     leave_requests = db.relationship('LeaveRequest', backref='user', lazy=True)
     leave_category_id = db.Column(db.Integer, db.ForeignKey('leave_category.id'), nullable=True)
+    # Bumped by every update of the row; an update based on an outdated read fails instead of overwriting
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)
+
+    __mapper_args__ = {'version_id_col': version}
+    # The /admin directory filters by group or category and sorts by email or group
+    __table_args__ = (
+        db.Index('ix_user_user_group_email', 'user_group', 'email'),
+        db.Index('ix_user_leave_category_id_email', 'leave_category_id', 'email'),
+    )
 
     def __repr__(self):
         return f"User('{self.email}', '{self.user_group}', '{self.days}', '{self.notification}')"
 
+def count_days(context):
+    row = context.get_current_parameters()
+    return working_days(row['start_date'], row['end_date'])
+
 class LeaveRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     start_date = db.Column(db.DateTime, nullable=False)
     end_date = db.Column(db.DateTime, nullable=False)
     state = db.Column(db.String(10), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
+    # Working days the request costs, charged to User.days while it is pending or accepted. Kept with the request,
+    # so a refund gives back what was charged even if the holidays changed since
+    days = db.Column(db.Integer, default=count_days, server_default='0', nullable=False)
+
+    # /admin lists pending requests by start date, /requests and the calendar walk them by start date, and
+    # save_request looks for the user's requests overlapping a new one
+    __table_args__ = (
+        db.Index('ix_leave_request_start_date_id', 'start_date', 'id'),
+        db.Index('ix_leave_request_state_start_date', 'state', 'start_date'),
+        db.Index('ix_leave_request_user_id_start_date_end_date', 'user_id', 'start_date', 'end_date'),
+    )
 
     def __repr__(self):
         return f"LeaveRequest('{self.start_date}', '{self.end_date}', '{self.state}')"
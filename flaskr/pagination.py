@@ -0,0 +1,83 @@
+import base64
+import binascii
+import datetime
+import json
+
+from sqlalchemy import and_, or_
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(direction, value, id):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    raw = json.dumps([direction, value, id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, python_type=datetime.datetime):
+    """Returns (direction, value, id) for a token made by encode_cursor, or None if it is missing or malformed.
+    Dates and datetimes are parsed back according to `python_type`, the type of the sort column."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, value, id = json.loads(raw.decode())
+        if direction not in ('next', 'prev') or not isinstance(id, (int, str)):
+            return None
+        if python_type in (datetime.date, datetime.datetime):
+            value = python_type.fromisoformat(value)
+        elif not isinstance(value, python_type):
+            return None
+        return direction, value, id
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        return None
+
+
+def keyset_paginate(query, sort_column, id_column, per_page, cursor=None, descending=False):
+    """Seeks to the page after/before the (sort value, id) position in `cursor` instead of using OFFSET, so every
+    page is a bounded index range scan no matter how deep it is. `sort_column` must not be nullable and
+    `id_column` must be unique, it breaks ties between rows with the same sort value."""
+    position = decode_cursor(cursor, sort_column.type.python_type)
+    direction = 'next' if position is None else position[0]
+    # Walking backwards is walking forwards in the opposite order
+    backwards = (direction == 'prev') != descending
+    if position is not None:
+        value, id = position[1:]
+        if backwards:
+            query = query.filter(or_(sort_column < value, and_(sort_column == value, id_column < id)))
+        else:
+            query = query.filter(or_(sort_column > value, and_(sort_column == value, id_column > id)))
+    if backwards:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+    # One extra row tells whether there is anything beyond this page in the direction we are walking
+    items = query.limit(per_page + 1).all()
+    more = len(items) > per_page
+    items = items[:per_page]
+    if direction == 'prev':
+        items.reverse()
+    if not items:
+        return KeysetPage(items)
+    has_next = more if direction == 'next' else True
+    has_prev = position is not None if direction == 'next' else more
+    first, last = items[0], items[-1]
+    next_cursor = encode_cursor('next', getattr(last, sort_column.key), getattr(last, id_column.key)) \
+        if has_next else None
+    prev_cursor = encode_cursor('prev', getattr(first, sort_column.key), getattr(first, id_column.key)) \
+        if has_prev else None
+    return KeysetPage(items, next_cursor, prev_cursor)
@@ -1,79 +1,146 @@
-from smtplib import SMTPException
-from flask import redirect, url_for, session, request, render_template, flash
-from flaskr import app, db, mail, logging
+from flask import (Blueprint, Response, current_app, redirect, url_for, session, request, render_template, flash,
+                   jsonify, stream_with_context)
+from flaskr import db, mail_queue, logging
 from flaskr.models import User, LeaveRequest, LeaveCategory
-from .decorators import asynchronous
+from flaskr.cache import TTLCache
+from flaskr.availability import AvailabilityIndex
+from flaskr.balance import (CHARGED_STATES, change_state, charge_days, conflicting_requests, forget_category,
+                            get_days_left, get_max_days, leave_days, lock_user, overlapping_requests)
+from flaskr.export import FORMATS, STATES, export
+from flaskr.identity import KeySet, verify_id_token
+from flaskr.importer import CSVImport
+from flaskr.journal import ReportJournal
+from flaskr.mailer import MailDigest
+from flaskr.metrics import oauth_seconds
+from flaskr.pagination import keyset_paginate
+from flaskr.routing import read_only
+from flaskr.workdays import calendar, working_days
 from flask_oauthlib.client import OAuth, OAuthException
 from flask_mail import Message
+from jwt import InvalidTokenError
 from sqlalchemy import exc
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.exc import StaleDataError
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+import codecs
 import datetime
+import hashlib
+import os
 import time
-import json
 
 REDIRECT_URI = '/oauth2callback'  # one of the Redirect URIs from Google APIs console
 
+bp = Blueprint('main', __name__)
+
 oauth = OAuth()
 
 google = oauth.remote_app('google',
                           base_url='https://www.googleapis.com/oauth2/v1/',
                           authorize_url='https://accounts.google.com/o/oauth2/auth',
                           request_token_url=None,
-                          request_token_params={'scope': 'email'},
+                          request_token_params={'scope': 'openid email'},
                           access_token_url='https://accounts.google.com/o/oauth2/token',
                           access_token_method='POST',
-                          consumer_key=app.config.get('GOOGLE_ID'),
-                          consumer_secret=app.config.get('GOOGLE_SECRET'))
+                          app_key='GOOGLE')
+
+# Google's ID token signing keys, the ID tokens kept in the session are checked against them
+google_keys = KeySet()
+
+# OAuth access token -> {'id': user id, 'email': email}, so the ID token is only verified once in a while
+identity_cache = TTLCache(300, 4096)
+
+# Notification recipients for send_email, dropped whenever a user's group or notification flag changes
+recipient_cache = TTLCache(600, 4096)
+NotificationSettings = namedtuple('NotificationSettings', ['user_group', 'notification'])
+
+# Who is off on which day, kept up to date by save_request and handle_request
+availability = AvailabilityIndex()
+
+# Error reports sent through /report, listed and searched through /api/reports
+report_journal = ReportJournal(None)
 
 
-@app.route('/')
+def init_app(app):
+    app.config['GOOGLE'] = {'consumer_key': app.config.get('GOOGLE_ID'),
+                            'consumer_secret': app.config.get('GOOGLE_SECRET')}
+    oauth.init_app(app)
+    google_keys.uri = app.config.get('GOOGLE_JWKS_URI', 'https://www.googleapis.com/oauth2/v3/certs')
+    google_keys.ttl = app.config.get('GOOGLE_JWKS_TTL', 3600)
+    identity_cache.ttl = app.config.get('IDENTITY_CACHE_TTL', 300)
+    identity_cache.maxsize = app.config.get('IDENTITY_CACHE_SIZE', 4096)
+    recipient_cache.ttl = app.config.get('RECIPIENT_CACHE_TTL', 600)
+    recipient_cache.maxsize = app.config.get('RECIPIENT_CACHE_SIZE', 4096)
+    availability.ttl = app.config.get('AVAILABILITY_INDEX_TTL', 300)
+    report_journal.directory = app.config.get('REPORT_JOURNAL_DIR') or os.path.join(app.root_path, 'reports')
+    report_journal.max_bytes = app.config.get('REPORT_JOURNAL_MAX_BYTES', 10 * 1024 * 1024)
+    report_journal.flush_interval = app.config.get('REPORT_JOURNAL_FLUSH_INTERVAL', 1.0)
+    mail_digest.init_app(app)
+    app.register_blueprint(bp)
+
+
+@bp.route('/')
 def index():
     current_user = get_current_user()
     if 'user' or current_user in session:
         return render_template('index.html', current_user=current_user)
     return render_template('index.html', current_user=None)
 
-@app.route('/admin')
+@bp.route('/admin')
+@read_only
 def admin():
     try:
         current_user = get_current_user()
         if current_user.user_group == 'administrator':
-            users = User.query.all()
+            pending_users = User.query.filter_by(user_group='unapproved').order_by(User.email).all()
             leave_categories = LeaveCategory.query.all()
-            page = request.args.get('page', 1, type=int)
-            leave_requests = LeaveRequest.query.filter_by(state='pending').paginate(page, app.config.get(
-                'REQUESTS_PER_PAGE_ADMIN'), False)
-            next_url = url_for('admin', page=leave_requests.next_num) \
+            leave_requests = keyset_paginate(LeaveRequest.query.options(joinedload(LeaveRequest.user))
+                                             .filter_by(state='pending'), LeaveRequest.start_date,
+                                             LeaveRequest.id, current_app.config.get('REQUESTS_PER_PAGE_ADMIN'),
+                                             request.args.get('cursor'))
+            next_url = url_for('.admin', cursor=leave_requests.next_cursor) \
                 if leave_requests.has_next else None
-            prev_url = url_for('admin', page=leave_requests.prev_num) \
+            prev_url = url_for('.admin', cursor=leave_requests.prev_cursor) \
                 if leave_requests.has_prev else None
-            return render_template('admin.html', users=users, leave_requests=leave_requests.items, next_url=next_url,
-                                   prev_url=prev_url, leave_categories=leave_categories,
-                                   user_groups=app.config.get('USER_GROUPS'), current_user=current_user)
-        return redirect(url_for('index'))
+            return render_template('admin.html', pending_users=pending_users, leave_requests=leave_requests.items,
+                                   next_url=next_url, prev_url=prev_url, leave_categories=leave_categories,
+                                   user_groups=current_app.config.get('USER_GROUPS'), current_user=current_user,
+                                   **get_user_directory(request.args))
+        return redirect(url_for('.index'))
     except OAuthException:
-        return redirect(url_for('logout'))
+        return redirect(url_for('.logout'))
     except AttributeError:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
+
+@bp.route('/admin/users')
+@read_only
+def admin_users():
+    current_user = get_current_user()
+    if not isinstance(current_user, User) or current_user.user_group != 'administrator':
+        return redirect(url_for('.index'))
+    return render_template('users.html', leave_categories=LeaveCategory.query.all(),
+                           user_groups=current_app.config.get('USER_GROUPS'), **get_user_directory(request.args))
 
-@app.route('/requests')
+@bp.route('/requests')
+@read_only
 def requests():
     try:
         current_user = get_current_user()
         if current_user.user_group == 'administrator':
-            page = request.args.get('page', 1, type=int)
-            leave_requests = LeaveRequest.query.order_by(LeaveRequest.start_date.asc()).paginate(page, app.config.get(
-                'REQUESTS_PER_PAGE'), False)
-            next_url = url_for('requests', page=leave_requests.next_num) \
+            leave_requests = keyset_paginate(LeaveRequest.query.options(joinedload(LeaveRequest.user)),
+                                             LeaveRequest.start_date, LeaveRequest.id,
+                                             current_app.config.get('REQUESTS_PER_PAGE'), request.args.get('cursor'))
+            next_url = url_for('.requests', cursor=leave_requests.next_cursor) \
                 if leave_requests.has_next else None
-            prev_url = url_for('requests', page=leave_requests.prev_num) \
+            prev_url = url_for('.requests', cursor=leave_requests.prev_cursor) \
                 if leave_requests.has_prev else None
             return render_template('requests.html', leave_requests=leave_requests.items, next_url=next_url,
                                    prev_url=prev_url, current_user=current_user)
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     except AttributeError as e:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
 
-@app.route('/account')
+@bp.route('/account')
+@read_only
 def account():
     try:
         current_user = get_current_user()
@@ -83,66 +150,249 @@ def account():
             days_left = get_days_left(current_user)
         return render_template('account.html', current_user=current_user, days_left=days_left)
     except AttributeError as e:
-        return redirect(url_for('logout'))
+        return redirect(url_for('.logout'))
 
-@app.route('/save_request', methods=["GET", "POST"])
+@bp.route('/api/calendar')
+@read_only
+def calendar_feed():
+    current_user = get_current_user()
+    if not isinstance(current_user, User):
+        return jsonify({'message': 'Unauthorized'}), 401
+    try:
+        start, end = get_date_range(request.args, current_app.config.get('DATE_RANGE_MAX_DAYS', 366))
+    except ValueError as e:
+        return jsonify({'message': 'Bad request', 'description': str(e)}), 400
+    leave_requests = LeaveRequest.query.filter(LeaveRequest.user_id == current_user.id,
+                                               LeaveRequest.start_date < end,
+                                               LeaveRequest.end_date >= start) \
+        .order_by(LeaveRequest.start_date.asc(), LeaveRequest.id.asc()).all()
+    last = end - datetime.timedelta(days=1)
+    response = jsonify({'start': dateformat(start),
+                        'end': dateformat(last),
+                        'holidays': [dateformat(day) for day in calendar.holidays(start, last)],
+                        'leave_requests': [{'id': leave_request.id,
+                                            'state': leave_request.state,
+                                            'start_date': dateformat(leave_request.start_date),
+                                            'end_date': dateformat(leave_request.end_date),
+                                            'days': leave_request.days}
+                                           for leave_request in leave_requests]})
+    # Browsers revalidate with If-None-Match/If-Modified-Since and get an empty 304 while nothing changed
+    response.set_etag(hashlib.md5(response.get_data()).hexdigest())
+    modified = [leave_request.updated_at for leave_request in leave_requests if leave_request.updated_at]
+    if modified:
+        response.last_modified = max(modified)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@bp.route('/api/availability')
+@read_only
+def availability_feed():
+    current_user = get_current_user()
+    if not isinstance(current_user, User):
+        return jsonify({'message': 'Unauthorized'}), 401
+    if current_user.user_group not in ('administrator', 'employee'):
+        return jsonify({'message': 'Forbidden'}), 403
+    try:
+        start, end = get_date_range(request.args, current_app.config.get('DATE_RANGE_MAX_DAYS', 366))
+    except ValueError as e:
+        return jsonify({'message': 'Bad request', 'description': str(e)}), 400
+    last = end - datetime.timedelta(days=1)
+    states = ('accepted', 'pending') if request.args.get('include_pending') else ('accepted',)
+    users_off = availability.users_off(start, last, states)
+    emails = dict(db.session.query(User.id, User.email).filter(User.id.in_(users_off))) if users_off else {}
+    return jsonify({'start': dateformat(start),
+                    'end': dateformat(last),
+                    'days': [{'date': dateformat(day), 'off': off}
+                             for day, off in availability.daily_counts(start, last, states)],
+                    'users': sorted(({'email': emails.get(user_id), 'days': days}
+                                     for user_id, days in users_off.items()), key=lambda user: user['email'] or '')})
+
+@bp.route('/api/reports')
+def reports_feed():
+    current_user = get_current_user()
+    if not isinstance(current_user, User):
+        return jsonify({'message': 'Unauthorized'}), 401
+    if current_user.user_group != 'administrator':
+        return jsonify({'message': 'Forbidden'}), 403
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+    except ValueError as e:
+        return jsonify({'message': 'Bad request', 'description': str(e)}), 400
+    reports = report_journal.search(user=request.args.get('user'), text=request.args.get('q'),
+                                    since=request.args.get('since'), until=request.args.get('until'),
+                                    before=request.args.get('before'), limit=limit)
+    return jsonify({'reports': reports,
+                    'next': reports[-1]['id'] if len(reports) == limit else None})
+
+@bp.route('/api/export')
+@read_only
+def export_feed():
+    current_user = get_current_user()
+    if not isinstance(current_user, User):
+        return jsonify({'message': 'Unauthorized'}), 401
+    if current_user.user_group != 'administrator':
+        return jsonify({'message': 'Forbidden'}), 403
+    format = request.args.get('format', 'csv')
+    states = request.args.getlist('state')
+    try:
+        if format not in FORMATS:
+            raise ValueError("format must be one of " + ", ".join(FORMATS))
+        if not set(states) <= set(STATES):
+            raise ValueError("state must be one of " + ", ".join(STATES))
+        # Everything unless a year or a range is asked for
+        if any(request.args.get(name) for name in ('year', 'start', 'end')):
+            start, end = get_date_range(request.args)
+        else:
+            start, end = None, None
+    except ValueError as e:
+        return jsonify({'message': 'Bad request', 'description': str(e)}), 400
+    compress = 'gzip' in request.accept_encodings
+    # Rows go out as they are read, so the response is never held in memory whole
+    response = Response(stream_with_context(export(start, end, states, format, compress)), mimetype=FORMATS[format])
+    response.headers['Content-Disposition'] = 'attachment; filename=leave_requests.' + format
+    response.vary.add('Accept-Encoding')
+    if compress:
+        response.content_encoding = 'gzip'
+    return response
+
+@bp.route('/save_request', methods=["GET", "POST"])
 def save_request():
-    email = request.form.get('current_user')
+    form = request.get_json() if request.is_json else request.form
+    email = form.get('current_user')
     current_user = get_user_by_email(email=email)
     if current_user.user_group == 'viewer' or current_user.user_group == 'unapproved':
-        return redirect(url_for('index'))
-    start_date_split = request.form.get('start-date').split("/")
-    end_date_split = request.form.get('end-date').split("/")
+        if request.is_json:
+            return jsonify({'message': 'Forbidden'}), 403
+        return redirect(url_for('.index'))
+    start_date_split = form.get('start-date').split("/")
+    end_date_split = form.get('end-date').split("/")
     start_date = create_start_date(start_date_split)
     end_date = create_end_date(end_date_split)
-    days = (end_date - start_date).days
-    if get_days_left(current_user) >= days + 1 > 0:
+    days = leave_days(start_date, end_date)
+    max_span = current_app.config.get('LEAVE_REQUEST_MAX_DAYS', 366)
+    if days > max_span:
+        return refuse_request("A request can't be longer than " + str(max_span) + " days!")
+    cost = working_days(start_date, end_date)
+    if days > 0 and cost == 0:
+        return refuse_request("There are no working days from " + dateformat(start_date) + " to " +
+                              dateformat(end_date) + "!")
+    if days > 0:
+        # Concurrent submissions of the same user wait for each other here, so they can't both miss the other
+        lock_user(current_user)
+        conflicts = [{'id': other.id, 'start_date': dateformat(other.start_date),
+                      'end_date': dateformat(other.end_date), 'state': other.state}
+                     for other in overlapping_requests(current_user.id, start_date, end_date, max_span, lock=True)]
+        if conflicts:
+            db.session.rollback()
+            return refuse_request("You already have leave from " +
+                                  ", ".join(c['start_date'] + " to " + c['end_date'] for c in conflicts) + "!",
+                                  conflicts)
+    if days > 0 and charge_days(current_user, cost, limit=get_max_days(current_user)):
         leave_request = LeaveRequest(start_date=start_date,
                                      end_date=end_date,
+                                     days=cost,
                                      state='pending',
                                      user_id=current_user.id)
         if current_user.user_group == 'administrator':
             leave_request.state = 'accepted'
-        current_user.days += days + 1
+        # Commits the charge and the request together
         add_to_db(leave_request)
+        availability.update(leave_request)
         change = current_user.email + " created a leave request."
         send_email(change)
-        logging.info(session['user'] + " created a leave request with id:" + str(leave_request.id))
-        return redirect(url_for('index'))
-    flash("You only have " + str(get_days_left(current_user)) + " days left!")
-    return redirect(url_for('index'))
-
-@app.route('/handle_request', methods=["POST", "GET"])
+        logging.info("%s created a leave request with id: %s", session['user'], leave_request.id)
+        if request.is_json:
+            return jsonify({'id': leave_request.id, 'start_date': dateformat(leave_request.start_date),
+                            'end_date': dateformat(leave_request.end_date), 'days': leave_request.days,
+                            'state': leave_request.state}), 201
+        return redirect(url_for('.index'))
+    db.session.rollback()
+    return refuse_request("You only have " + str(get_days_left(current_user)) + " days left!")
+
+def refuse_request(message, conflicts=None):
+    if request.is_json:
+        if conflicts:
+            return jsonify({'message': message, 'conflicts': conflicts}), 409
+        return jsonify({'message': message}), 400
+    flash(message)
+    return redirect(url_for('.index'))
+
+@bp.route('/handle_request', methods=["POST", "GET"])
 def handle_request():
     if request.method == 'POST':
         accept_request = request.form.get('accept')
         decline_request = request.form.get('decline')
         if accept_request is not None:
             leave_request = get_leave_request(id=accept_request)
-            if leave_request.state != 'pending':
-                days = leave_request.end_date - leave_request.start_date
-                leave_request.user.days += days.days + 1
-            leave_request.state = 'accepted'
-            db.session.commit()
-            change = leave_request.user.email + "'s leave request has been accepted."
-            send_email(change, leave_request.user.email)
-            logging.info("Leave request by " + leave_request.user.email + " id: " + accept_request + ", has been "
-            "accepted by " + session['user'])
+            conflicts = conflicting_requests(leave_request, current_app.config.get('LEAVE_REQUEST_MAX_DAYS', 366)) \
+                if leave_request.state not in CHARGED_STATES else []
+            if conflicts:
+                flash(leave_request.user.email + " already has leave from " +
+                      ", ".join(dateformat(other.start_date) + " to " + dateformat(other.end_date)
+                                for other in conflicts) + "!")
+                db.session.rollback()
+            elif change_state(leave_request, 'accepted'):
+                db.session.commit()
+                availability.update(leave_request)
+                change = leave_request.user.email + "'s leave request has been accepted."
+                send_email(change, leave_request.user.email)
+                logging.info("Leave request by %s id: %s, has been accepted by %s", leave_request.user.email,
+                             accept_request, session['user'])
+            else:
+                db.session.rollback()
         else:
             leave_request = get_leave_request(id=decline_request)
-            leave_request.state = 'declined'
-            days_back = leave_request.end_date - leave_request.start_date
-            leave_request.user.days -= days_back.days + 1
-            db.session.commit()
-            change = leave_request.user.email + "'s leave request has been declined."
-            send_email(change, leave_request.user.email)
-            logging.info("Leave request by " + leave_request.user.email + " id: " + decline_request + ", has been "
-            "declined by " + session['user'])
+            if change_state(leave_request, 'declined'):
+                db.session.commit()
+                availability.update(leave_request)
+                change = leave_request.user.email + "'s leave request has been declined."
+                send_email(change, leave_request.user.email)
+                logging.info("Leave request by %s id: %s, has been declined by %s", leave_request.user.email,
+                             decline_request, session['user'])
+            else:
+                db.session.rollback()
         if request.form.get('site'):
-            return redirect(url_for('requests'))
-    return redirect(url_for('index'))
+            return redirect(url_for('.requests'))
+    return redirect(url_for('.index'))
 
-@app.route('/handle_acc', methods=["GET", "POST"])
+@bp.route('/handle_requests', methods=["POST"])
+def handle_requests():
+    current_user = get_current_user()
+    if not isinstance(current_user, User) or current_user.user_group != 'administrator':
+        if request.is_json:
+            return jsonify({'message': 'Forbidden'}), 403
+        return redirect(url_for('.index'))
+    if request.is_json:
+        payload = request.get_json()
+        if not isinstance(payload, dict):
+            return jsonify({'message': 'Bad request', 'description': "expected an object"}), 400
+        accept_ids, decline_ids = payload.get('accept', []), payload.get('decline', [])
+    else:
+        ids = request.form.getlist('ids')
+        accept_ids = ids if request.form.get('action') == 'accept' else []
+        decline_ids = ids if request.form.get('action') == 'decline' else []
+    try:
+        accepted, declined = bulk_handle_requests(accept_ids, decline_ids)
+    except ValueError as e:
+        return jsonify({'message': 'Bad request', 'description': str(e)}), 400
+    except StaleDataError:
+        message = "Some of the leave requests were changed meanwhile, nothing was changed!"
+        if request.is_json:
+            return jsonify({'message': message}), 409
+        flash(message)
+        return redirect(url_for('.requests') if request.form.get('site') else url_for('.admin'))
+    logging.info("%d leave request(s) accepted and %d declined by %s", len(accepted), len(declined),
+                 session.get('user'))
+    if request.is_json:
+        return jsonify({'accepted': accepted, 'declined': declined})
+    if request.form.get('site'):
+        return redirect(url_for('.requests'))
+    return redirect(url_for('.admin'))
+
+@bp.route('/handle_acc', methods=["GET", "POST"])
 def handle_acc():
     if request.method == 'POST':
         delete_email = request.form.get('delete')
@@ -157,27 +407,33 @@ def handle_acc():
                 user = get_user_by_email(email=on)
                 user.notification = False
                 db.session.commit()
-                logging.info("Notification has been set to FALSE by " + session['user'])
+                invalidate_recipients(user.email)
+                logging.info("Notification has been set to FALSE by %s", session['user'])
             else:
                 user = get_user_by_email(email=off)
                 user.notification = True
                 db.session.commit()
-                logging.info("Notification has been set to TRUE by " + session['user'])
-            return redirect(url_for('account'))
+                invalidate_recipients(user.email)
+                logging.info("Notification has been set to TRUE by %s", session['user'])
+            return redirect(url_for('.account'))
 
         if delete_email is not None:
             user = get_user_by_email(email=delete_email)
             change = "The registration of " + user.email + " has been declined!"
             delete_from_db(user)
-            send_email(change, user_email)
-            logging.info(user.email + " has been declined by " + session['user'])
+            forget_identity(user.email)
+            invalidate_recipients(user.email)
+            send_email(change, user_email, urgent=True)
+            logging.info("%s has been declined by %s", user.email, session['user'])
         elif approve_email is not None:
             user = get_user_by_email(email=approve_email)
             user.user_group = 'viewer'
             db.session.commit()
+            forget_identity(user.email)
+            invalidate_recipients(user.email)
             change = user.email + " has been approved."
-            send_email(change, user.email)
-            logging.info(user.email + " has been accepted by " + session['user'])
+            send_email(change, user.email, urgent=True)
+            logging.info("%s has been accepted by %s", user.email, session['user'])
         elif category is not None:
             user = get_user_by_email(email=user_email)
             user.leave_category_id = category
@@ -185,7 +441,7 @@ def handle_acc():
             change = user.email + "'s category has been changed."
             send_email(change, user.email)
             cat = LeaveCategory.query.filter_by(id=category).first()
-            logging.info(user.email + " 's category has been changed to " + cat.category + " by " + session['user'])
+            logging.info("%s 's category has been changed to %s by %s", user.email, cat.category, session['user'])
         elif group is not None:
             user = get_user_by_email(email=user_email)
             admins = User.query.filter_by(user_group='administrator').all()
@@ -195,12 +451,15 @@ def handle_acc():
             else:
                 user.user_group = group
                 db.session.commit()
+                forget_identity(user.email)
+                invalidate_recipients(user.email)
                 change = user.email + "'s user group has been changed."
                 send_email(change, user.email)
-                logging.info(user.email + " 's user group has been changed to " + user.user_group + " by " + session['user'])
-    return redirect(url_for('admin'))
+                logging.info("%s 's user group has been changed to %s by %s", user.email, user.user_group,
+                             session['user'])
+    return redirect(url_for('.admin'))
 
-@app.route('/handle_cat', methods=["POST", "GET"])
+@bp.route('/handle_cat', methods=["POST", "GET"])
 def handle_cat():
     if request.method == "POST":
         delete = request.form.get('delete')
@@ -209,9 +468,10 @@ def handle_cat():
         if delete is not None:
             category = get_leave_category({'id': delete})
             delete_from_db(category)
+            forget_category(category.id)
             change = category.category + " leave category has been deleted."
             send_email(change)
-            logging.info(category.category + " category has been deleted by " + session['user'])
+            logging.info("%s category has been deleted by %s", category.category, session['user'])
         else:
             cat = LeaveCategory(category=new, max_days=max_days)
             categories = get_leave_category({'category': new})
@@ -219,11 +479,34 @@ def handle_cat():
                 add_to_db(cat)
                 change = cat.category + " leave category has been added."
                 send_email(change)
-                logging.info(cat.category + " category has been created by " + session['user'])
-        return redirect(url_for('admin'))
-    return redirect(url_for('index'))
+                logging.info("%s category has been created by %s", cat.category, session['user'])
+        return redirect(url_for('.admin'))
+    return redirect(url_for('.index'))
 
-@app.route('/report', methods=['GET', 'POST'])
+@bp.route('/import', methods=['POST'])
+def import_csv():
+    current_user = get_current_user()
+    if not isinstance(current_user, User) or current_user.user_group != 'administrator':
+        return redirect(url_for('.index'))
+    files = {name: codecs.iterdecode(request.files[name].stream, 'utf-8-sig')
+             for name in ('users', 'leave_requests') if request.files.get(name)}
+    if not files:
+        flash("Choose a users or a leave requests CSV file to import!")
+        return redirect(url_for('.admin'))
+    csv_import = CSVImport(current_app.config.get('IMPORT_CHUNK_SIZE', 1000), bool(request.form.get('dry_run')))
+
+    # The skipped rows are reported while the rest is still being imported
+    def report():
+        for error in csv_import.run(files.get('users'), files.get('leave_requests')):
+            yield error + "\n"
+        if csv_import.committed:
+            recipient_cache.clear()
+            availability.rebuild()
+            logging.info("%s imported from CSV: %s", current_user.email, csv_import.summary())
+        yield csv_import.summary() + "\n"
+    return Response(stream_with_context(report()), mimetype='text/plain')
+
+@bp.route('/report', methods=['GET', 'POST'])
 def report():
     if 'user' in session:
         current_user = get_current_user()
@@ -235,29 +518,29 @@ def report():
                 ts = time.time()
                 report_time = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
                 user = session.get('user')
-                f = open("flaskr/reports/" + report_time, "a+")
-                f.write(user + " " + report_time + " " + report_value + "\n")
-                f.close()
-                email = [app.config.get('USER_EMAIL')]
+                report_journal.append(user, report_value)
+                email = [current_app.config.get('USER_EMAIL')]
                 msg = Message('Vacation Management Error Report',
                               sender='noreply@demo.com',
                               recipients=email)
                 msg.body = f'''New report: {user} {report_time} {report_value}'''
-                send_async_email(app, msg)
+                send_async_email(current_app, msg)
                 return render_template('report.html', success=True)
-        return redirect(url_for('index'))
-    return redirect(url_for('login'))
+        return redirect(url_for('.index'))
+    return redirect(url_for('.login'))
 
 
-@app.route('/login')
+@bp.route('/login')
 def login():
-    return google.authorize(callback=url_for('authorized', _external=True))
+    return google.authorize(callback=url_for('.authorized', _external=True))
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
+    forget_token(session.get('google_token'))
     session.pop('google_token', None)
+    session.pop('google_id_token', None)
     session.pop('user', None)
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
 def create_default_cat():
     categories = LeaveCategory.query.all()
@@ -269,46 +552,57 @@ def create_default_cat():
         logging.info("Default categories have been created.")
 
 
-@app.route('/login/authorized')
+@bp.route('/login/authorized')
 def authorized():
-    resp = google.authorized_response()
+    with oauth_seconds.time('token'):
+        resp = google.authorized_response()
     if resp is None:
         return 'Access denied: reason=%s error=%s' % (
             request.args['error_reason'],
             request.args['error_description']
         )
     session['google_token'] = (resp['access_token'], '')
-    raw_data = json.dumps(google.get('userinfo').data)
-    data = json.loads(raw_data)
-    email = data['email']
+    if 'id_token' in resp:
+        session['google_id_token'] = resp['id_token']
+    try:
+        email = get_google_email()
+    except InvalidTokenError as e:
+        session.pop('google_token', None)
+        session.pop('google_id_token', None)
+        return 'Access denied: reason=invalid_id_token error=%s' % e
     existing = get_user_by_email(email=email)
     session['user'] = email
-    logging.info(session['user'] + " has logged in.")
-    if existing is None:
+    logging.info("%s has logged in.", session['user'])
+    if existing is not None:
+        remember_identity(session['google_token'], existing)
+    else:
         first_user = User.query.all()
         if not first_user:
             user = User(email=email)
             user.user_group = "administrator"
             add_to_db(user)
+            remember_identity(session['google_token'], user)
+            invalidate_recipients(user.email)
             create_default_cat()
             change = user.email + " logged in for the first time.You are administrator now!"
-            send_email(change)
+            send_email(change, urgent=True)
             session['user'] = user.email
-            logging.info(session['user'] + " has logged in.")
-            return redirect(url_for('index'))
+            logging.info("%s has logged in.", session['user'])
+            return redirect(url_for('.index'))
         user = User(email=email)
         add_to_db(user)
+        remember_identity(session['google_token'], user)
         change = user.email + " logged in for the first time."
         send_email(change)
         session['user'] = user.email
-        logging.info(session['user'] + " has logged in.")
-    return redirect(url_for('index'))
+        logging.info("%s has logged in.", session['user'])
+    return redirect(url_for('.index'))
 
 @google.tokengetter
 def get_google_oauth_token():
     return session.get('google_token')
 
-@app.template_filter('dateformat')
+@bp.app_template_filter('dateformat')
 def dateformat(date):
     return date.strftime('%Y-%m-%d')
 
@@ -322,19 +616,45 @@ def delete_from_db(item):
 
 def get_current_user():
     try:
-        raw_data = json.dumps(google.get('userinfo').data)
-        data = json.loads(raw_data)
-        email = data['email']
-        return get_user_by_email(email=email)
+        token = session.get('google_token')
+        identity = identity_cache.get(token[0]) if token else None
+        if identity is not None:
+            user = User.query.get(identity['id'])
+            if user is not None and user.email == identity['email']:
+                return user
+            forget_token(token)
+        user = get_user_by_email(email=get_google_email())
+        if token and user is not None:
+            remember_identity(token, user)
+        return user
     except KeyError as e:
-        logging.error("Error: " + str(e))
-        return redirect(url_for('logout'))
+        logging.error("Error: %s", e)
+        return redirect(url_for('.logout'))
+    except InvalidTokenError as e:
+        logging.info("Rejected the ID token of %s: %s", session.get('user'), e)
+        return redirect(url_for('.logout'))
     except Exception as e:
-        logging.exception("Exception: " + str(e))
-        return redirect(url_for('index'))
+        logging.exception("Exception: %s", e)
+        return redirect(url_for('.index'))
+
+def get_google_email():
+    id_token = session.get('google_id_token')
+    if id_token is None:
+        # Logged in before ID tokens were kept, ask Google
+        with oauth_seconds.time('userinfo'):
+            return google.get('userinfo').data['email']
+    return verify_id_token(id_token, google_keys, current_app.config.get('GOOGLE_ID'),
+                           leeway=current_app.config.get('ID_TOKEN_LEEWAY', 60))['email']
+
+def remember_identity(token, user):
+    identity_cache.set(token[0], {'id': user.id, 'email': user.email})
 
-def get_days_left(user):
-    return user.leave_category.max_days - user.days
+def forget_token(token):
+    if token:
+        identity_cache.pop(token[0])
+
+def forget_identity(email):
+    identity_cache.discard_where(lambda identity: identity['email'] == email)
 
 def get_user_by_email(email):
     return User.query.filter_by(email=email).first()
@@ -347,7 +667,61 @@ def get_leave_category(field=None):
     try:
         return LeaveCategory.query.filter_by(**field).first()
     except exc.SQLAlchemyError as e:
-        logging.exception("Exception: " + str(e))
+        logging.exception("Exception: %s", e)
+
+# Sort key -> (sort column, unique tie-breaker); both orders are served by an index on User
+USER_SORTS = {'email': (User.email, User.id), 'group': (User.user_group, User.email)}
+
+
+def get_user_directory(args):
+    """One page of the approved users for the /admin directory, filtered by email prefix (q), group and category
+    ('none' for users without one) and sorted by email or group."""
+    filters = {'q': args.get('q', '').strip(), 'group': args.get('group', ''), 'category': args.get('category', ''),
+               'sort': args.get('sort', 'email'), 'order': args.get('order', 'asc')}
+    query = User.query.options(joinedload(User.leave_category)).filter(User.user_group != 'unapproved')
+    if filters['q']:
+        query = query.filter(User.email.startswith(filters['q'], autoescape=True))
+    if filters['group'] in current_app.config.get('USER_GROUPS'):
+        query = query.filter(User.user_group == filters['group'])
+    else:
+        filters['group'] = ''
+    if filters['category'] == 'none':
+        query = query.filter(User.leave_category_id.is_(None))
+    elif filters['category'].isdigit():
+        query = query.filter(User.leave_category_id == int(filters['category']))
+    else:
+        filters['category'] = ''
+    if filters['sort'] not in USER_SORTS:
+        filters['sort'] = 'email'
+    if filters['order'] != 'desc':
+        filters['order'] = 'asc'
+    sort_column, id_column = USER_SORTS[filters['sort']]
+    users = keyset_paginate(query, sort_column, id_column, current_app.config.get('USERS_PER_PAGE', 50),
+                            args.get('users_cursor'), descending=filters['order'] == 'desc')
+    users_next_url = url_for('.admin', users_cursor=users.next_cursor, **filters) if users.has_next else None
+    users_prev_url = url_for('.admin', users_cursor=users.prev_cursor, **filters) if users.has_prev else None
+    return {'users': users.items, 'users_next_url': users_next_url, 'users_prev_url': users_prev_url,
+            'filters': filters}
+
+
+def get_date_range(args, max_days=None):
+    """Returns the [start, end) datetimes asked for with ?year=YYYY or ?start=YYYY-MM-DD&end=YYYY-MM-DD, raising
+    ValueError for a range that is invalid or, with `max_days`, longer than that."""
+    try:
+        if args.get('start') or args.get('end'):
+            start = datetime.datetime.strptime(args.get('start', ''), '%Y-%m-%d')
+            end = datetime.datetime.strptime(args.get('end', ''), '%Y-%m-%d') + datetime.timedelta(days=1)
+        else:
+            year = args.get('year', datetime.date.today().year, type=int)
+            start = datetime.datetime(year, 1, 1)
+            end = datetime.datetime(year + 1, 1, 1)
+    except OverflowError:
+        raise ValueError("date out of range")
+    if end <= start:
+        raise ValueError("end is before start")
+    if max_days is not None and (end - start).days > max_days:
+        raise ValueError("the range can't be longer than " + str(max_days) + " days")
+    return start, end
 
 def create_start_date(start_date_split):
     return datetime.datetime.strptime(start_date_split[2] + '-' + start_date_split[0] + '-' + start_date_split[1],
@@ -356,31 +730,140 @@ def create_start_date(start_date_split):
 def create_end_date(end_date_split):
     return datetime.datetime.strptime(end_date_split[2] + '-' + end_date_split[0] + '-' + end_date_split[1], '%Y-%m-%d')
 
-@asynchronous
 def send_async_email(app, msg):
-    with app.app_context():
-        try:
-            mail.send(msg)
-        except SMTPException as e:
-            logging.exception("Exception: " + str(e))
-        except AssertionError as e:
-            logging.error("Error: " + str(e))
-        except TypeError as e:
-            logging.error("Error: " + str(e))
-
-def send_email(change, email=None):
-        admins = User.query.filter_by(user_group='administrator', notification=True).all()
-        emails = []
-        for admin in admins:
-            emails.append(admin.email)
-        if email is not None:
-            user = get_user_by_email(email=email)
-            if user.user_group != 'administrator' and user.notification:
-                emails.append(user.email)
-        msg = Message('Vacation Management',
-                      sender='noreply@demo.com',
-                      recipients=emails)
+    mail_queue.submit([msg])
+
+def send_email(change, email=None, urgent=False):
+        emails = get_recipients(email)
+        if mail_digest.enabled and not urgent:
+            mail_digest.add(emails, change)
+        else:
+            send_async_email(current_app, notification_message(emails, [change]))
+
+def bulk_handle_requests(accept_ids, decline_ids):
+    """Accepts and declines many leave requests in one transaction and returns the ids that changed state.
+    An id that is in both lists is accepted.
+
+    The requests are read FOR UPDATE and every state change is also conditional on the state read, one UPDATE per
+    (old state, new state) pair; if any of them was changed meanwhile nothing is, and StaleDataError is raised."""
+    if not isinstance(accept_ids, list) or not isinstance(decline_ids, list):
+        raise ValueError("accept and decline must be lists of ids")
+    try:
+        new_states = {int(id): 'declined' for id in decline_ids}
+        new_states.update((int(id), 'accepted') for id in accept_ids)
+    except TypeError:
+        raise ValueError("the ids must be integers")
+    if not new_states:
+        return [], []
+    leave_requests = LeaveRequest.query.options(joinedload(LeaveRequest.user)) \
+        .filter(LeaveRequest.id.in_(new_states)).with_for_update().all()
+    charges = Counter()
+    users = {}
+    transitions = defaultdict(list)
+    # Declined requests being accepted again, which must not overlap the user's other leave
+    reaccepted = []
+    # Everything needed after the commit, which expires the loaded objects
+    changed = []
+    for leave_request in leave_requests:
+        state = new_states[leave_request.id]
+        if leave_request.state == state:
+            continue
+        days = leave_request.days
+        if state == 'accepted' and leave_request.state not in CHARGED_STATES:
+            charges[leave_request.user_id] += days
+            reaccepted.append(leave_request)
+        elif state == 'declined' and leave_request.state in CHARGED_STATES:
+            charges[leave_request.user_id] -= days
+        users[leave_request.user_id] = leave_request.user
+        transitions[leave_request.state, state].append(leave_request.id)
+        changed.append((leave_request.id, leave_request.user_id, state, leave_request.start_date,
+                        leave_request.end_date, leave_request.user.email))
+    max_span = current_app.config.get('LEAVE_REQUEST_MAX_DAYS', 366)
+    for i, leave_request in enumerate(reaccepted):
+        conflicts = [other.id for other in conflicting_requests(leave_request, max_span)
+                     if new_states.get(other.id) != 'declined']
+        conflicts += [other.id for other in reaccepted[:i] if other.user_id == leave_request.user_id and
+                      other.start_date <= leave_request.end_date and other.end_date >= leave_request.start_date]
+        if conflicts:
+            db.session.rollback()
+            raise ValueError(f"leave request {leave_request.id} overlaps leave request(s) "
+                             f"{', '.join(map(str, conflicts))} of the same user")
+    for (old, state), ids in transitions.items():
+        updated = LeaveRequest.query.filter(LeaveRequest.id.in_(ids), LeaveRequest.state == old) \
+            .update({LeaveRequest.state: state}, synchronize_session=False)
+        if updated != len(ids):
+            db.session.rollback()
+            raise StaleDataError(f"{len(ids) - updated} leave request(s) were changed meanwhile")
+    # One UPDATE per user no matter how many of their requests changed
+    for user_id, days in charges.items():
+        if days:
+            charge_days(users[user_id], days)
+    db.session.commit()
+    availability.update_rows([row[:5] for row in changed])
+    send_emails([(email + "'s leave request has been " + state + ".", email)
+                 for id, user_id, state, start_date, end_date, email in changed])
+    return ([id for id, user_id, state, *_ in changed if state == 'accepted'],
+            [id for id, user_id, state, *_ in changed if state == 'declined'])
+
+def send_emails(changes):
+    """Notifies about many (change, email) pairs at once: one message per recipient listing all of its changes,
+    handed to the mail queue as a single job so they share one SMTP connection."""
+    pending = OrderedDict()
+    for change, email in changes:
+        for recipient in get_recipients(email):
+            pending.setdefault(recipient, []).append(change)
+    if mail_digest.enabled:
+        for recipient, recipient_changes in pending.items():
+            for change in recipient_changes:
+                mail_digest.add([recipient], change)
+    elif pending:
+        mail_queue.submit([notification_message([recipient], recipient_changes)
+                           for recipient, recipient_changes in pending.items()])
+
+def get_recipients(email=None):
+    emails = list(get_admin_recipients())
+    if email is not None:
+        user = get_notification_settings(email)
+        if user.user_group != 'administrator' and user.notification:
+            emails.append(email)
+    return emails
+
+def get_admin_recipients():
+    emails = recipient_cache.get('administrators')
+    if emails is None:
+        emails = [email for email, in db.session.query(User.email).filter_by(user_group='administrator',
+                                                                           notification=True)]
+        recipient_cache.set('administrators', emails)
+    return emails
+
+def get_notification_settings(email):
+    settings = recipient_cache.get(('user', email))
+    if settings is None:
+        user = get_user_by_email(email=email)
+        if user is None:
+            return None
+        settings = NotificationSettings(user.user_group, user.notification)
+        recipient_cache.set(('user', email), settings)
+    return settings
+
+def invalidate_recipients(email=None):
+    recipient_cache.pop('administrators')
+    if email is not None:
+        recipient_cache.pop(('user', email))
+
+def notification_message(recipients, changes):
+    msg = Message('Vacation Management',
+                  sender='noreply@demo.com',
+                  recipients=recipients)
+    if len(changes) == 1:
         msg.body = f'''There has been a change:
-            {change}
+            {changes[0]}
         If you would like to turn off the notifications visit your account settings!'''
-        send_async_email(app, msg)
+    else:
+        listed = '\n            '.join(changes)
+        msg.body = f'''There have been {len(changes)} changes:
+            {listed}
+        If you would like to turn off the notifications visit your account settings!'''
+    return msg
+
+mail_digest = MailDigest(mail_queue=mail_queue, build_message=notification_message)
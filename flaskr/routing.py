@@ -0,0 +1,125 @@
+import functools
+import logging
+import random
+import time
+from threading import Lock
+
+from flask import g, has_request_context, session as cookie_session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm
+from sqlalchemy.sql.expression import SelectBase
+
+
+def read_only(view):
+    """Marks a view whose queries may be answered by a replica."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def measure_lag(engine):
+    """Seconds the replica behind `engine` is behind its primary, None if replication is broken. Anything that is
+    not a MySQL replica (e.g. a SQLite stand-in) counts as up to date."""
+    if engine.dialect.name != 'mysql':
+        return 0
+    with engine.connect() as conn:
+        status = conn.execute('SHOW SLAVE STATUS').first()
+    return status['Seconds_Behind_Master'] if status is not None else 0
+
+
+class ReplicaSet:
+    """The replica engines of a RoutingSQLAlchemy and how far behind each of them is, rechecked at most every
+    `check_interval` seconds."""
+
+    def __init__(self, db, app):
+        self.db = db
+        self.app = app
+        self.keys = ['replica_%d' % i for i in range(len(app.config.get('DATABASE_REPLICAS', [])))]
+        self.max_lag = app.config.get('REPLICA_MAX_LAG', 5)
+        self.check_interval = app.config.get('REPLICA_LAG_CHECK_INTERVAL', 5)
+        self.measure_lag = measure_lag
+        self._healthy = []
+        self._checked = None
+        self._lock = Lock()
+
+    def choose(self):
+        """Returns the engine of a replica within the lag tolerance, or None if there is none."""
+        if not self.keys:
+            return None
+        if self._checked is None or time.monotonic() - self._checked > self.check_interval:
+            with self._lock:
+                if self._checked is None or time.monotonic() - self._checked > self.check_interval:
+                    self._healthy = [key for key in self.keys if self._within_tolerance(key)]
+                    self._checked = time.monotonic()
+        if not self._healthy:
+            return None
+        return self.db.get_engine(self.app, bind=random.choice(self._healthy))
+
+    def _within_tolerance(self, key):
+        try:
+            lag = self.measure_lag(self.db.get_engine(self.app, bind=key))
+        except Exception as e:
+            logging.warning("Replica %s is unavailable: %s", key, e)
+            return False
+        if lag is None or lag > self.max_lag:
+            logging.warning("Replica %s is %s seconds behind, reading from the primary", key, lag)
+            return False
+        return True
+
+
+class RoutingSession(SignallingSession):
+    """Sends the SELECTs of views marked `read_only` to a replica and everything else to the primary.
+
+    Flushes, bulk updates and SELECT ... FOR UPDATE always go to the primary. So does every query of a session
+    that has written, and, for REPLICA_MAX_LAG seconds after a write, every query made for the same browser
+    session, so users read their own writes even while the replicas catch up.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if not isinstance(clause, SelectBase):
+            # Whatever isn't a SELECT may write without a flush: Query.update()/delete(), Core statements and
+            # bulk inserts all come through here
+            remember_write(self)
+            return super().get_bind(mapper, clause)
+        if self._flushing or self.info.get('wrote') or getattr(clause, '_for_update_arg', None) is not None \
+                or not reads_from_replica():
+            return super().get_bind(mapper, clause)
+        if 'replica' not in self.info:
+            # One replica for the whole session, so its reads are consistent with each other
+            self.info['replica'] = self.app.extensions['replicas'].choose()
+        return self.info['replica'] or super().get_bind(mapper, clause)
+
+
+def reads_from_replica():
+    return has_request_context() and g.get('read_only', False) \
+        and cookie_session.get('primary_until', 0) < time.time()
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def remember_write(session, flush_context=None):
+    session.info['wrote'] = True
+    if has_request_context():
+        g.wrote = True
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy whose session routes reads to the replicas listed in DATABASE_REPLICAS."""
+
+    def init_app(self, app):
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        for i, uri in enumerate(app.config.get('DATABASE_REPLICAS', [])):
+            binds['replica_%d' % i] = uri
+        app.config['SQLALCHEMY_BINDS'] = binds
+        super().init_app(app)
+        replicas = app.extensions['replicas'] = ReplicaSet(self, app)
+
+        @app.after_request
+        def pin_to_primary(response):
+            if g.get('wrote') and replicas.keys:
+                cookie_session['primary_until'] = time.time() + replicas.max_lag
+            return response
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
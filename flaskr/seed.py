@@ -0,0 +1,115 @@
+import bisect
+import datetime
+import random
+
+import click
+from flask.cli import with_appcontext
+
+from flaskr import db
+from flaskr.balance import CHARGED_STATES
+from flaskr.models import User, LeaveRequest, LeaveCategory
+from flaskr.workdays import calendar
+
+# Shares of the user groups, and of the requests' states by whether they started yet
+GROUPS = {'administrator': 2, 'viewer': 10, 'unapproved': 3, 'employee': 85}
+PAST_STATES = {'accepted': 85, 'declined': 10, 'pending': 5}
+FUTURE_STATES = {'pending': 60, 'accepted': 35, 'declined': 5}
+# Leave is taken in summer and around Christmas more than in other months
+MONTHS = (6, 5, 7, 8, 8, 9, 14, 14, 7, 6, 5, 11)
+# Mostly single days and long weekends, now and then a week or two
+LENGTHS = {1: 30, 2: 12, 3: 10, 4: 8, 5: 15, 7: 5, 10: 10, 14: 6, 21: 4}
+
+
+def pick(weights, rng):
+    return rng.choices(list(weights), list(weights.values()))[0]
+
+
+def seed(users, requests, categories=3, domain='seed.invalid', today=None, random_seed=None, chunk=1000):
+    """Adds `users` users with emails at `domain`, `categories` leave categories and up to `requests` leave
+    requests from two years back to half a year ahead, spread like real ones: a few busy users take most of the
+    leave, in summer and around Christmas, mostly for a day or a few. A user's requests don't overlap and a
+    request that would take them over their category's limit is declined, so the balances add up. Returns the
+    number of requests added."""
+    rng = random.Random(random_seed)
+    today = today or datetime.date.today()
+    category_ids = []
+    for i in range(categories):
+        category = LeaveCategory(category=f'{domain} {i + 1}', max_days=20 + 5 * i)
+        db.session.add(category)
+        db.session.flush()
+        category_ids.append((category.id, category.max_days))
+    people = []
+    for i in range(users):
+        group = 'administrator' if i == 0 else pick(GROUPS, rng)
+        category = rng.choice(category_ids) if category_ids and group != 'unapproved' else (None, 0)
+        people.append({'email': f'user{i}@{domain}', 'user_group': group, 'leave_category_id': category[0],
+                       'notification': rng.random() < 0.8, 'days': 0, 'max_days': category[1], 'taken': []})
+    requesters = [person for person in people if person['user_group'] in ('administrator', 'employee')]
+    # Heavy-tailed activity: the busiest users ask for leave many times as often as the quietest
+    activity = [rng.paretovariate(1.5) for _ in requesters]
+    first_year = today.year - 2
+    added = []
+    for person in rng.choices(requesters, activity, k=requests) if requesters else ():
+        year = first_year + rng.randrange(3)
+        start = datetime.date(year, rng.choices(range(1, 13), MONTHS)[0], rng.randrange(1, 29))
+        start += datetime.timedelta(days={5: 2, 6: 1}.get(start.weekday(), 0))
+        end = start + datetime.timedelta(days=pick(LENGTHS, rng) - 1)
+        if end > today + datetime.timedelta(days=183):
+            continue
+        days = calendar.count(start, end)
+        taken = person['taken']
+        i = bisect.bisect(taken, (start, end))
+        if not days or (i and taken[i - 1][1] >= start) or (i < len(taken) and taken[i][0] <= end):
+            continue
+        state = pick(PAST_STATES if start <= today else FUTURE_STATES, rng)
+        if state in CHARGED_STATES:
+            if person['days'] + days > person['max_days']:
+                state = 'declined'
+            else:
+                person['days'] += days
+                taken.insert(i, (start, end))
+        added.append((person['email'], {'start_date': datetime.datetime.combine(start, datetime.time()),
+                                        'end_date': datetime.datetime.combine(end, datetime.time()),
+                                        'state': state, 'days': days}))
+    for offset in range(0, len(people), chunk):
+        db.session.bulk_insert_mappings(User, [{key: person[key] for key in
+                                                ('email', 'user_group', 'leave_category_id', 'notification', 'days')}
+                                               for person in people[offset:offset + chunk]])
+    ids = dict(db.session.query(User.email, User.id).filter(User.email.endswith('@' + domain)))
+    for offset in range(0, len(added), chunk):
+        db.session.bulk_insert_mappings(LeaveRequest, [dict(mapping, user_id=ids[email])
+                                                       for email, mapping in added[offset:offset + chunk]])
+    db.session.commit()
+    return len(added)
+
+
+def clear(domain='seed.invalid'):
+    """Removes the users at `domain`, their leave requests and the categories seeded for them."""
+    user_ids = db.session.query(User.id).filter(User.email.endswith('@' + domain)).subquery()
+    LeaveRequest.query.filter(LeaveRequest.user_id.in_(user_ids)).delete(synchronize_session=False)
+    User.query.filter(User.email.endswith('@' + domain)).delete(synchronize_session=False)
+    LeaveCategory.query.filter(LeaveCategory.category.startswith(domain + ' ')).delete(synchronize_session=False)
+    db.session.commit()
+
+
+@click.command('seed')
+@click.option('--users', type=click.IntRange(0), default=100, show_default=True)
+@click.option('--requests', type=click.IntRange(0), default=1000, show_default=True,
+              help='Leave requests to try; the ones that would overlap are left out.')
+@click.option('--categories', type=click.IntRange(0), default=3, show_default=True)
+@click.option('--domain', default='seed.invalid', show_default=True, help='Email domain of the generated users.')
+@click.option('--random-seed', type=int, help='Generate the same data every time.')
+@click.option('--clear', 'clear_first', is_flag=True, help='Remove the data seeded at --domain before.')
+@with_appcontext
+def seed_command(users, requests, categories, domain, random_seed, clear_first):
+    """Fill the database with generated users, categories and leave requests, for trying out and benchmarking."""
+    if clear_first:
+        clear(domain)
+    elif User.query.filter(User.email.endswith('@' + domain)).first() is not None:
+        raise click.UsageError(f"There are users at {domain} already; give --clear to replace them.")
+    added = seed(users, requests, categories, domain, random_seed=random_seed)
+    click.echo(f"{users} user(s), {categories} categories and {added} leave request(s) added at {domain}.")
+
+
+def init_app(app):
+    app.cli.add_command(seed_command)
@@ -0,0 +1,95 @@
+import datetime
+from array import array
+from threading import Lock
+
+
+class WorkingCalendar:
+    """Tells working days from weekends and public holidays, and counts the working days of a range in O(1).
+
+    It keeps a prefix sum of working days over whole years: entry i is the number of working days from January 1st
+    of the first year covered up to, but not including, the i-th day after it. A count is then the difference of
+    two entries. The table grows to cover the years asked about, about 300 kB per century.
+
+    `holidays` are 'MM-DD' strings for the holidays on the same date every year and 'YYYY-MM-DD' strings for the
+    ones that move.
+    """
+
+    def __init__(self, weekend=(5, 6), holidays=()):
+        self._lock = Lock()
+        self.configure(weekend, holidays)
+
+    def configure(self, weekend, holidays):
+        recurring, dated = set(), set()
+        for holiday in holidays:
+            if holiday.count('-') == 1:
+                recurring.add(tuple(int(part) for part in holiday.split('-')))
+            else:
+                dated.add(datetime.date.fromisoformat(holiday).toordinal())
+        with self._lock:
+            self.weekend = frozenset(weekend)
+            self._recurring = frozenset(recurring)
+            self._dated = frozenset(dated)
+            # (ordinal of the first day covered, first year, last year, prefix sums), swapped as a whole
+            self._table = None
+
+    def count(self, start, end):
+        """Returns the number of working days from start to end, both included; dates or datetimes."""
+        if end < start:
+            return 0
+        origin, prefix = self._cover(start.year, end.year)
+        return prefix[end.toordinal() + 1 - origin] - prefix[start.toordinal() - origin]
+
+    def is_working(self, day):
+        return day.weekday() not in self.weekend and not self.is_holiday(day)
+
+    def is_holiday(self, day):
+        return (day.month, day.day) in self._recurring or day.toordinal() in self._dated
+
+    def holidays(self, start, end):
+        """Returns the public holidays from start to end, both included, weekends or not."""
+        days = (datetime.date.fromordinal(day) for day in range(start.toordinal(), end.toordinal() + 1))
+        return [day for day in days if self.is_holiday(day)]
+
+    def _cover(self, first_year, last_year):
+        table = self._table
+        if table is None or first_year < table[1] or last_year > table[2]:
+            with self._lock:
+                table = self._table
+                if table is None:
+                    table = self._table = self._build(first_year, last_year)
+                elif first_year < table[1] or last_year > table[2]:
+                    # Growing by at least the years already covered keeps a walk through history linear
+                    span = table[2] - table[1] + 1
+                    if first_year < table[1]:
+                        first_year = max(datetime.MINYEAR, min(first_year, table[1] - span))
+                    if last_year > table[2]:
+                        last_year = min(datetime.MAXYEAR, max(last_year, table[2] + span))
+                    table = self._table = self._build(min(first_year, table[1]), max(last_year, table[2]))
+        return table[0], table[3]
+
+    def _build(self, first_year, last_year):
+        origin = datetime.date(first_year, 1, 1).toordinal()
+        end = datetime.date(last_year, 12, 31).toordinal() + 1
+        holidays = {ordinal for ordinal in self._dated if origin <= ordinal < end}
+        for year in range(first_year, last_year + 1):
+            for month, day in self._recurring:
+                try:
+                    holidays.add(datetime.date(year, month, day).toordinal())
+                except ValueError:
+                    pass
+        # Ordinal 1, January 1st of year 1, was a Monday
+        weekend = self.weekend
+        prefix = array('l', [0]) * (end - origin + 1)
+        total = 0
+        for i, ordinal in enumerate(range(origin, end), 1):
+            if (ordinal - 1) % 7 not in weekend and ordinal not in holidays:
+                total += 1
+            prefix[i] = total
+        return origin, first_year, last_year, prefix
+
+# The calendar leave is counted in, configured from WEEKEND and PUBLIC_HOLIDAYS by balance.init_app
+calendar = WorkingCalendar()
+
+
+def working_days(start, end):
+    return calendar.count(start, end)
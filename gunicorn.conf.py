@@ -0,0 +1,36 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Every worker is a separate process with its own threads, so requests are served in parallel instead of one at a
+# time. `kill -HUP <master pid>` reloads gracefully: new workers are started with the current code and config and
+# the old ones finish their in-flight requests (up to graceful_timeout seconds) before they exit.
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+# Restart a worker now and then, so a slow leak can't grow without bound
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+# Preloading imports the app once in the master and shares its memory with the workers, but a HUP then forks
+# the new workers from the old code; leave it off to pick up a deploy with a HUP
+preload_app = os.environ.get('GUNICORN_PRELOAD', '').lower() in ('1', 'true', 'yes')
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    """Throws away what a preloaded app inherited from the master: pooled connections, which must never be shared
+    between processes, and the log writer thread, which doesn't survive the fork."""
+    app = getattr(worker.app, 'callable', None)
+    if app is None:
+        return
+    from flaskr import db
+    with app.app_context():
+        db.engine.dispose()
+        for key in app.config.get('SQLALCHEMY_BINDS') or {}:
+            db.get_engine(app, bind=key).dispose()
+    app.extensions['log_listener'].start()
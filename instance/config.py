@@ -2,12 +2,123 @@ GOOGLE_ID = 'Your google app ID'
 
 GOOGLE_SECRET = 'Google secret'
 
+# Keys the ID tokens from Google are verified with, refetched every GOOGLE_JWKS_TTL seconds; a file:// URL or a
+# path works too
+GOOGLE_JWKS_URI = 'https://www.googleapis.com/oauth2/v3/certs'
+
+GOOGLE_JWKS_TTL = 3600
+
+# Seconds of clock skew tolerated when checking an ID token's expiry
+ID_TOKEN_LEEWAY = 60
+
+DATABASE_DRIVER = 'pymysql'
+
+# Sets up Flask-Migrate for `flask db` and run.py; wsgi.py and the tests turn it off
+MIGRATIONS_ENABLED = True
+
+# pool_recycle stays below MySQL's wait_timeout and pool_pre_ping replaces connections the server dropped anyway,
+# so the first request after a quiet period doesn't fail
+SQLALCHEMY_ENGINE_OPTIONS = {
+    'pool_size': 10,
+    'max_overflow': 10,
+    'pool_timeout': 10,
+    'pool_recycle': 280,
+    'pool_pre_ping': True,
+    'connect_args': {'connect_timeout': 5, 'read_timeout': 30, 'write_timeout': 30},
+}
+
+# URIs of read replicas for the views marked read_only; empty sends everything to the primary
+DATABASE_REPLICAS = []
+
+# Replicas further behind than this are skipped, and a browser session reads from the primary for this long
+# after it wrote something
+REPLICA_MAX_LAG = 5
+
+REPLICA_LAG_CHECK_INTERVAL = 5
+
 USER_GROUPS = ['viewer', 'employee', 'administrator']
 
 REQUESTS_PER_PAGE_ADMIN = 5
 
 REQUESTS_PER_PAGE = 10
 
+# /api/export and `flask export-leave-requests` read this many rows per round trip to the database and write them
+# out together, gzipped at EXPORT_GZIP_LEVEL when the client accepts it
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_GZIP_LEVEL = 6
+
+# Rows `flask import-csv` and /import insert per executemany
+IMPORT_CHUNK_SIZE = 1000
+
+# Leave is counted in working days: every day but the WEEKEND weekdays (Monday is 0) and the PUBLIC_HOLIDAYS,
+# e.g. ['01-01', '12-25', '2019-04-22'], 'MM-DD' for the same date every year and 'YYYY-MM-DD' for the ones that
+# move. After changing them, run `flask recompute-leave-days` to count the existing requests and balances again
+WEEKEND = (5, 6)
+
+PUBLIC_HOLIDAYS = []
+
+# Longest leave request accepted; it also bounds how far back save_request looks for overlapping requests
+LEAVE_REQUEST_MAX_DAYS = 366
+
+# Longest range of days /api/calendar and /api/availability answer for
+DATE_RANGE_MAX_DAYS = 366
+
+USERS_PER_PAGE = 50
+
 USER_EMAIL = 'Your email address'
 
 USER_PW = 'Your email password'
+
+IDENTITY_CACHE_TTL = 300
+
+IDENTITY_CACHE_SIZE = 4096
+
+MAIL_WORKERS = 2
+
+MAIL_QUEUE_SIZE = 500
+
+MAIL_QUEUE_TIMEOUT = 5
+
+MAIL_IDLE_TIMEOUT = 30
+
+MAIL_DIGEST = False
+
+MAIL_DIGEST_INTERVAL = 300
+
+MAIL_DIGEST_MAX_CHANGES = 50
+
+RECIPIENT_CACHE_TTL = 600
+
+RECIPIENT_CACHE_SIZE = 4096
+
+AVAILABILITY_INDEX_TTL = 300
+
+CATEGORY_LIMIT_CACHE_TTL = 600
+
+BALANCE_RECONCILE_INTERVAL = 0
+
+BALANCE_RECONCILE_FIX = False
+
+REPORT_JOURNAL_DIR = None
+
+REPORT_JOURNAL_MAX_BYTES = 10 * 1024 * 1024
+
+REPORT_JOURNAL_FLUSH_INTERVAL = 1.0
+
+# None logs to stderr instead; wsgi.py does that under gunicorn, whose workers can't share a rotating file
+LOG_FILE = 'flaskr_log.log'
+
+LOG_LEVEL = 'INFO'
+
+LOG_LEVELS = {'sqlalchemy': 'WARNING', 'urllib3': 'WARNING', 'oauthlib': 'WARNING', 'requests_oauthlib': 'WARNING'}
+
+LOG_MAX_BYTES = 10 * 1024 * 1024
+
+LOG_BACKUP_COUNT = 10
+
+LOG_ROTATE_INTERVAL = 24 * 60 * 60
+
+METRICS_ENABLED = False
+
+METRICS_TOKEN = None
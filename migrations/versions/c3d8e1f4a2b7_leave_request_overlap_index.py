@@ -0,0 +1,28 @@
+"""leave request overlap index
+
+Revision ID: c3d8e1f4a2b7
+Revises: 7e2a5d9c4b16
+Create Date: 2026-10-18 14:02:31.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d8e1f4a2b7'
+down_revision = '7e2a5d9c4b16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Created before the old index is dropped, MySQL needs an index on user_id for the foreign key at all times
+    op.create_index('ix_leave_request_user_id_start_date_end_date', 'leave_request',
+                    ['user_id', 'start_date', 'end_date'], unique=False)
+    op.drop_index('ix_leave_request_user_id_start_date', table_name='leave_request')
+
+
+def downgrade():
+    op.create_index('ix_leave_request_user_id_start_date', 'leave_request', ['user_id', 'start_date'], unique=False)
+    op.drop_index('ix_leave_request_user_id_start_date_end_date', table_name='leave_request')
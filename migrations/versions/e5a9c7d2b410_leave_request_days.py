@@ -0,0 +1,34 @@
+"""leave request days
+
+Revision ID: e5a9c7d2b410
+Revises: c3d8e1f4a2b7
+Create Date: 2026-10-18 15:21:09.774310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a9c7d2b410'
+down_revision = 'c3d8e1f4a2b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('leave_request', sa.Column('days', sa.Integer(), server_default='0', nullable=False))
+    # Existing requests were charged every calendar day of their range; `flask recompute-leave-days` moves them and
+    # the balances to working days
+    leave_request = sa.table('leave_request', sa.column('id', sa.Integer), sa.column('start_date', sa.DateTime),
+                             sa.column('end_date', sa.DateTime), sa.column('days', sa.Integer))
+    conn = op.get_bind()
+    rows = conn.execute(sa.select([leave_request.c.id, leave_request.c.start_date, leave_request.c.end_date])).fetchall()
+    if rows:
+        conn.execute(leave_request.update().where(leave_request.c.id == sa.bindparam('row_id'))
+                     .values(days=sa.bindparam('row_days')),
+                     [{'row_id': id, 'row_days': (end_date - start_date).days + 1} for id, start_date, end_date in rows])
+
+
+def downgrade():
+    op.drop_column('leave_request', 'days')
@@ -1,6 +1,9 @@
-from flaskr import app
-from flaskr import db
+from flask_migrate import upgrade
+
+from flaskr import create_app
 
 if __name__ == '__main__':
-    db.create_all()
+    app = create_app()
+    with app.app_context():
+        upgrade()
     app.run(debug=False, host='0.0.0.0')
@@ -1,24 +1,165 @@
-import os
-import tempfile
+import json
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+import jwt
 import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from sqlalchemy import event
 
-from flaskr.db import init_db
-from flaskr import app as application
+from flaskr import create_app, routes
+from flaskr.identity import KeySet
 
 
-@pytest.fixture
-def client():
-    app = application
-    db_fd, app.config['DATABASE'] = tempfile.mkstemp()
-    app.config['SECRET_KEY'] = 'sekrit!'
-    app.config['TESTING'] = True
+# One app for the whole session, starting from an empty database
+@pytest.fixture(scope='session')
+def app():
+    app = create_app({'TESTING': True, 'SECRET_KEY': 'sekrit!', 'MIGRATIONS_ENABLED': False})
+    with app.app_context():
+        routes.db.session.query(routes.User).delete()
+        routes.db.session.query(routes.LeaveRequest).delete()
+        routes.db.session.query(routes.LeaveCategory).delete()
+        routes.db.session.commit()
+    return app
 
-    client = app.test_client()
 
+# Every test runs inside an app context, so it can use the database directly
+@pytest.fixture(autouse=True)
+def app_context(app):
     with app.app_context():
-        init_db()
+        yield
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def reset(self):
+        self.statements = []
+
+    @contextmanager
+    def budget(self, limit):
+        """Fails the test if the block sends more than `limit` statements."""
+        self.reset()
+        yield self
+        assert self.count <= limit, "%d queries over a budget of %d:\n%s" % (self.count, limit,
+                                                                             "\n".join(self.statements))
+
+
+# Counts the SQL statements sent to the database while the test runs
+@pytest.fixture
+def query_counter():
+    counter = QueryCounter()
+    event.listen(routes.db.engine, 'before_cursor_execute', counter)
+    yield counter
+    event.remove(routes.db.engine, 'before_cursor_execute', counter)
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """Local stand-in for the SMTP server that records every connection and message it receives."""
+    daemon_threads = True
+    allow_reuse_address = True
 
-    yield client
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.connections = 0
+        self.messages = []
+        # Cleared to hold every DATA command until the test sets it again
+        self.accepting = threading.Event()
+        self.accepting.set()
 
-    os.close(db_fd)
-    os.unlink(app.config['DATABASE'])
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 localhost stand-in")
+        sender, recipients = None, []
+        for raw in self.rfile:
+            command = raw.decode().strip()
+            verb = command[:4].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 localhost")
+            elif verb == "MAIL":
+                sender, recipients = command[10:], []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command[8:])
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.server.accepting.wait()
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                body = []
+                for line in self.rfile:
+                    if line in (b".\r\n", b".\n"):
+                        break
+                    body.append(line)
+                self.server.messages.append({'sender': sender, 'recipients': recipients, 'data': b"".join(body)})
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+@pytest.fixture
+def smtp_server():
+    server = SMTPStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.accepting.set()
+    server.shutdown()
+    server.server_close()
+
+
+class IDTokenSigner:
+    """Stands in for Google's side of OpenID Connect: signs ID tokens with a local key and publishes the key as
+    a JWKS file."""
+
+    def __init__(self, private_key, path, audience, kid='test-key'):
+        self.private_key = private_key
+        self.audience = audience
+        self.kid = kid
+        self.publish(path)
+
+    def publish(self, path):
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self.private_key.public_key()))
+        jwk.update(kid=self.kid, alg='RS256', use='sig')
+        path.write_text(json.dumps({'keys': [jwk]}))
+
+    def sign(self, email, **claims):
+        now = int(time.time())
+        payload = {'iss': 'https://accounts.google.com', 'aud': self.audience, 'sub': email, 'email': email,
+                   'email_verified': True, 'iat': now, 'exp': now + 3600}
+        payload.update(claims)
+        return jwt.encode(payload, self.private_key, algorithm='RS256', headers={'kid': self.kid})
+
+
+@pytest.fixture(scope='session')
+def signing_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+# Points the app at a local JWKS file and returns a signer for ID tokens it accepts
+@pytest.fixture
+def id_tokens(app, signing_key, tmp_path, monkeypatch):
+    signer = IDTokenSigner(signing_key, tmp_path / 'jwks.json', app.config.get('GOOGLE_ID'))
+    monkeypatch.setattr(routes, 'google_keys', KeySet(str(tmp_path / 'jwks.json')))
+    return signer
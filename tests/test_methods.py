@@ -1,14 +1,8 @@
 from unittest import mock
 from flask_mail import Message
 
-from flaskr import routes, app
-import pytest, datetime
-
-# Deleting all data from db before testing
-routes.db.session.query(routes.User).delete()
-routes.db.session.query(routes.LeaveRequest).delete()
-routes.db.session.query(routes.LeaveCategory).delete()
-routes.db.session.commit()
+from flaskr import routes
+import pytest, datetime, time, json, logging, sys, csv, io, gzip, os
 
 # Global variable for db calling
 db = routes.db.session
@@ -20,6 +14,8 @@ def delete_everything_from_db():
     db.query(routes.LeaveRequest).delete()
     db.query(routes.User).delete()
     db.commit()
+    routes.identity_cache.clear()
+    routes.recipient_cache.clear()
 
 
 # Checks the response from the index page
@@ -32,7 +28,7 @@ def test_home_1(client):
 
 
 # Checks if the user is in the session and it is an administrator
-def test_home_2(mocker):
+def test_home_2(app, mocker):
     class MockedUserInfo:
         def __init__(self, userinfo):
             self.data = userinfo
@@ -81,11 +77,11 @@ def test_login_1(client):
 
 
 # Checks the redirection from login page to the Google authorization site
-def test_login_2(client):
+def test_login_2(app, client):
     from flask import url_for
     app.config['SERVER_NAME'] = "{rv}.localdomain"
     with app.app_context():
-        response = client.get(url_for('login'), follow_redirects=False)
+        response = client.get(url_for('main.login'), follow_redirects=False)
         # check if the path changed
         assert b"https://accounts.google.com" in response.data
 
@@ -101,7 +97,7 @@ def test_login_3(client):
 read more:http://flask.pocoo.org/docs/1.0/testing/'''
 
 
-def test_logout_1():
+def test_logout_1(app):
     with app.test_client() as c:
         with c.session_transaction() as sess:
             sess["user"] = "test_session_user"
@@ -162,7 +158,7 @@ def test_send_email():
 
 
 # With no recipients
-def test_send_async_email_1():
+def test_send_async_email_1(app):
     msg = Message('Vacation Management',
                   sender='noreply@demo.com',
                   recipients=None)
@@ -172,7 +168,7 @@ def test_send_async_email_1():
 
 # With 2 recipients in db. The settings does not matter, check logic! If user in db has been added to recipients, email
 # is about to be sent
-def test_send_async_email_2():
+def test_send_async_email_2(app):
     msg = Message('Vacation Management',
                   sender='noreply@demo.com',
                   recipients=['samuelferenczi@invenshure.com', 'huli.opaltest@gmail.com'])
@@ -183,7 +179,7 @@ def test_send_async_email_2():
 # With invalid recipient, warns test_send_async_email_3 never awaited, hence turned off
 @pytest.mark.asyncio
 @pytest.mark.filterwarnings("ignore:")
-async def test_send_async_email_3():
+async def test_send_async_email_3(app):
     msg = Message('Vacation Management',
                   sender='noreply@demo.com',
                   recipients=12345)
@@ -194,7 +190,7 @@ async def test_send_async_email_3():
 # With invalid sender, warns test_send_async_email_4 never awaited, hence turned off
 @pytest.mark.asyncio
 @pytest.mark.filterwarnings("ignore:")
-async def test_send_async_email_4():
+async def test_send_async_email_4(app):
     msg = Message('Vacation Management',
                   sender=12345,
                   recipients="samuelferenczi@invenshure.com")
@@ -205,7 +201,7 @@ async def test_send_async_email_4():
 # With empty sender&recipients, warns test_send_async_email_5 never awaited, hence turned off
 @pytest.mark.asyncio
 @pytest.mark.filterwarnings("ignore:")
-async def test_send_async_email_5():
+async def test_send_async_email_5(app):
     msg = Message('Vacation Management',
                   sender="",
                   recipients="")
@@ -216,7 +212,7 @@ async def test_send_async_email_5():
 # Without first parameter, warns test_send_async_email_6 never awaited, hence turned off
 @pytest.mark.asyncio
 @pytest.mark.filterwarnings("ignore:")
-async def test_send_async_email_6():
+async def test_send_async_email_6(app):
     msg = Message(sender='noreply@demo.com', recipients="samuelferenczi@invenshure.com")
     msg.body = "test_email"
     routes.send_async_email(app, msg)
@@ -225,7 +221,7 @@ async def test_send_async_email_6():
 # Without integer body, warns test_send_async_email_7 never awaited, hence turned off
 @pytest.mark.asyncio
 @pytest.mark.filterwarnings("ignore:")
-async def test_send_async_email_7():
+async def test_send_async_email_7(app):
     msg = Message('Vacation Management',
                   sender='noreply@demo.com',
                   recipients="samuelferenczi@invenshure.com")
@@ -237,7 +233,7 @@ async def test_send_async_email_7():
 # never awaited, hence turned off
 @pytest.mark.asyncio
 @pytest.mark.filterwarnings("ignore:")
-async def test_send_async_email_8():
+async def test_send_async_email_8(app):
     msg = Message('Vacation Management',
                   sender='noreply@demo.com',
                   recipients=['samuelferenczi@invenshure.com', 'samu.ferenczi@gmail.com'])
@@ -346,7 +342,7 @@ def test_get_user_by_email():
         remove_tester_user()
 
 
-def test_get_days_left():
+def test_get_days_left(app):
     try:
         # Adding test user and category
         fake_category = routes.LeaveCategory(category="test_test_1", max_days=20)
@@ -360,7 +356,7 @@ def test_get_days_left():
         q = routes.get_days_left(fake_user)
         assert q == 20
 
-        # With created leave request for 6 days
+        # With created leave request for 4 working days (03/16 and 03/17 are a weekend)
         data = {"current_user": "test_elek@invenshure.com", "start-date": "03/14/2019", "end-date": "03/19/2019"}
         with app.test_client() as client:
             with client.session_transaction() as sess:
@@ -369,10 +365,10 @@ def test_get_days_left():
             assert resp.status_code == 302
         fake_user_2 = routes.User.query.filter_by(email="test_elek@invenshure.com").first()
         q = routes.get_days_left(fake_user_2)
-        assert q == 14
+        assert q == 16
 
-        # With created leave request for 16 days ( more than we have ) Does not get created.
-        data_2 = {"current_user": "test_elek@invenshure.com", "start-date": "03/20/2019", "end-date": "04/05/2019"}
+        # With created leave request for 18 working days ( more than we have ) Does not get created.
+        data_2 = {"current_user": "test_elek@invenshure.com", "start-date": "03/20/2019", "end-date": "04/12/2019"}
         with app.test_client() as client:
             with client.session_transaction() as sess:
                 sess['user'] = 'test_elek@invenshure.com'
@@ -383,7 +379,7 @@ def test_get_days_left():
         l_requests = routes.LeaveRequest.query.all()
         assert len(l_requests) == 1
         q = routes.get_days_left(fake_user_3)
-        assert q == 14
+        assert q == 16
 
         # With random email from db
         with pytest.raises(AttributeError):
@@ -523,7 +519,7 @@ def test_report(client):
 
 
 # Checks if we are trying to visit /report endpoint with being logged in
-def test_report_2(mocker):
+def test_report_2(app, mocker):
     class MockedUserInfo:
         def __init__(self, userinfo):
             self.data = userinfo
@@ -562,11 +558,12 @@ def test_report_3(client):
 
 
 # Checks if the report is created after the submit with the given message.
-def test_report_4(mocker):
+def test_report_4(app, mocker, tmp_path):
     class MockedUserInfo:
         def __init__(self, userinfo):
             self.data = userinfo
 
+    mocker.patch.object(routes, 'report_journal', routes.ReportJournal(str(tmp_path)))
     try:
         routes.create_default_cat()
         fake_user = routes.User(email="test_elek@invenshure.com", user_group="administrator", days=0,
@@ -589,12 +586,14 @@ def test_report_4(mocker):
             data = {"report": "Hi! This is the report test body!"}
             resp = c.post('/report', data=data)
         assert resp.status_code == 200
+        assert routes.report_journal.search(user="test_session_user", limit=1)[0]["body"] == data["report"]
     finally:
         delete_everything_from_db()
+        routes.report_journal.close()
 
 
 # Checks if we are trying to visit /report endpoint with being logged in as viewer
-def test_report_5(mocker):
+def test_report_5(app, mocker):
     class MockedUserInfo:
         def __init__(self, userinfo):
             self.data = userinfo
@@ -632,7 +631,7 @@ def test_handle_cat_1(client):
 
 
 # Checks if we can delete leave category
-def test_handle_cat_2():
+def test_handle_cat_2(app):
     try:
         routes.create_default_cat()
         data = {"current_user": "test@invenshure.com", "delete": 1}
@@ -649,7 +648,7 @@ def test_handle_cat_2():
 
 
 # Checks if we can create new leave category
-def test_handle_cat_3():
+def test_handle_cat_3(app):
     try:
         routes.create_default_cat()
         data = {"current_user": "test@invenshure.com", "add": "Test_Category", "max_days": 20}
@@ -666,7 +665,7 @@ def test_handle_cat_3():
 
 
 # Checks if we can create leave category with the same name
-def test_handle_cat_4():
+def test_handle_cat_4(app):
     try:
         routes.create_default_cat()
         data = {"current_user": "test@invenshure.com", "add": "Young", "max_days": 20}
@@ -689,7 +688,7 @@ def test_handle_acc_1(client):
 
 
 # Checks if new user can be accepted
-def test_handle_acc_2():
+def test_handle_acc_2(app):
     try:
         user = routes.User(email="test_elek@invenshure.com")
         db.add(user)
@@ -707,7 +706,7 @@ def test_handle_acc_2():
 
 
 # Checks if new user can be denied
-def test_handle_acc_3():
+def test_handle_acc_3(app):
     try:
         user = routes.User(email="test_elek@invenshure.com")
         db.add(user)
@@ -725,7 +724,7 @@ def test_handle_acc_3():
 
 
 # Checks if user_group can be modified to employee
-def test_handle_acc_4():
+def test_handle_acc_4(app):
     try:
         user = routes.User(email="test_elek@invenshure.com")
         db.add(user)
@@ -743,7 +742,7 @@ def test_handle_acc_4():
 
 
 # Checks if user_group can be modified to administrator
-def test_handle_acc_5():
+def test_handle_acc_5(app):
     try:
         user = routes.User(email="test_elek@invenshure.com")
         db.add(user)
@@ -761,7 +760,7 @@ def test_handle_acc_5():
 
 
 # Checks if user_group can be modified from administrator to unapproved with 1 administrator(s) in the system
-def test_handle_acc_6():
+def test_handle_acc_6(app):
     try:
         user = routes.User(email="test_elek@invenshure.com")
         db.add(user)
@@ -788,7 +787,7 @@ def test_handle_acc_6():
 
 
 # Checks if leave_category is None as default
-def test_handle_acc_7():
+def test_handle_acc_7(app):
     try:
         user = routes.User(email="test_elek@invenshure.com")
         db.add(user)
@@ -806,7 +805,7 @@ def test_handle_acc_7():
 
 
 # Checks if leave_category can be set
-def test_handle_acc_8():
+def test_handle_acc_8(app):
     try:
         routes.create_default_cat()
         user = routes.User(email="test_elek@invenshure.com")
@@ -832,7 +831,7 @@ def test_handle_acc_8():
 
 
 # Checks if leave_category is can be changed
-def test_handle_acc_9():
+def test_handle_acc_9(app):
     try:
         routes.create_default_cat()
         user = routes.User(email="test_elek@invenshure.com")
@@ -867,7 +866,7 @@ def test_handle_acc_9():
 
 
 # Checks if notification is set and can be changed
-def test_handle_acc_10():
+def test_handle_acc_10(app):
     try:
         user = routes.User(email="test_elek@invenshure.com")
         db.add(user)
@@ -901,7 +900,7 @@ def test_handle_acc_10():
 
 
 # Checks if user's leave_category sets None after assigned category gets deleted
-def test_handle_acc_11():
+def test_handle_acc_11(app):
     try:
         routes.create_default_cat()
         user = routes.User(email="test_elek@invenshure.com")
@@ -931,7 +930,7 @@ def test_handle_acc_11():
 
 
 # Checks if user_group can be modified from administrator to unapproved with 2 administrator(s) in the system
-def test_handle_acc_12():
+def test_handle_acc_12(app):
     try:
         user = routes.User(email="test_elek@invenshure.com")
         user_2 = routes.User(email="test_elek_2@invenshure.com", user_group="administrator")
@@ -966,7 +965,7 @@ def test_handle_request_1(client):
 
 
 # Checks if the request changes status from pending to approved
-def test_handle_request_2():
+def test_handle_request_2(app):
     try:
         routes.create_default_cat()
         user = routes.User(email="test_elek@invenshure.com", user_group="employee", leave_category_id=1)
@@ -989,7 +988,7 @@ def test_handle_request_2():
 
 
 # Checks if the request changes status from pending to declined
-def test_handle_request_3():
+def test_handle_request_3(app):
     try:
         routes.create_default_cat()
         user = routes.User(email="test_elek@invenshure.com", user_group="employee", leave_category_id=1)
@@ -1012,7 +1011,7 @@ def test_handle_request_3():
 
 
 # Checks if the request changes status from pending to declined and than to approved
-def test_handle_request_4():
+def test_handle_request_4(app):
     try:
         routes.create_default_cat()
         user = routes.User(email="test_elek@invenshure.com", user_group="employee", leave_category_id=1)
@@ -1044,7 +1043,7 @@ def test_handle_request_4():
 
 
 # Creating a request with an employee for 6 days
-def test_save_request_1():
+def test_save_request_1(app):
     try:
         # Adding test user and category
         routes.create_default_cat()
@@ -1067,7 +1066,7 @@ def test_save_request_1():
 
 
 # Creating a request with an administrator for 6 days and checks if the status is accepted automatically
-def test_save_request_2():
+def test_save_request_2(app):
     try:
         # Adding test user and category
         routes.create_default_cat()
@@ -1090,7 +1089,7 @@ def test_save_request_2():
 
 
 # Trying to create a request with administrator for more days than we have
-def test_save_request_3():
+def test_save_request_3(app):
     try:
         # Adding test user and category
         routes.create_default_cat()
@@ -1099,7 +1098,7 @@ def test_save_request_3():
         db.add(fake_user)
         db.commit()
 
-        # With created leave request for 6 days
+        # With created leave request for 4 working days
         data = {"current_user": "test_elek@invenshure.com", "start-date": "03/14/2019", "end-date": "03/19/2019"}
         data_2 = {"current_user": "test_elek@invenshure.com", "start-date": "04/01/2019", "end-date": "04/25/2019"}
         with app.test_client() as client:
@@ -1112,13 +1111,13 @@ def test_save_request_3():
         l_requests = routes.LeaveRequest.query.all()
         assert len(l_requests) == 1
         user = routes.User.query.filter_by(email="test_elek@invenshure.com").first()
-        assert user.days == 6
+        assert user.days == 4
     finally:
         delete_everything_from_db()
 
 
 # Trying to create a request with employee for more days than we have
-def test_save_request_4():
+def test_save_request_4(app):
     try:
         # Adding test user and category
         routes.create_default_cat()
@@ -1127,7 +1126,7 @@ def test_save_request_4():
         db.add(fake_user)
         db.commit()
 
-        # With created leave request for 6 days
+        # With created leave request for 4 working days
         data = {"current_user": "test_elek@invenshure.com", "start-date": "03/14/2019", "end-date": "03/19/2019"}
         data_2 = {"current_user": "test_elek@invenshure.com", "start-date": "04/01/2019", "end-date": "04/25/2019"}
         with app.test_client() as client:
@@ -1140,13 +1139,13 @@ def test_save_request_4():
         l_requests = routes.LeaveRequest.query.all()
         assert len(l_requests) == 1
         user = routes.User.query.filter_by(email="test_elek@invenshure.com").first()
-        assert user.days == 6
+        assert user.days == 4
     finally:
         delete_everything_from_db()
 
 
 # Trying to create request with bigger start date than end date // Fails until i don't fix this bug
-def test_save_request_5():
+def test_save_request_5(app):
     try:
         # Adding test user and category
         routes.create_default_cat()
@@ -1169,7 +1168,7 @@ def test_save_request_5():
 
 
 # Trying to create requests with invalid inputs
-def test_save_request_6():
+def test_save_request_6(app):
     try:
         # Adding test user and category
         routes.create_default_cat()
@@ -1196,8 +1195,59 @@ def test_save_request_6():
         delete_everything_from_db()
 
 
+# Requests overlapping a pending or accepted request of the same user are refused and the conflicts returned
+def test_save_request_overlap(app):
+    try:
+        routes.create_default_cat()
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="employee", days=0, notification=0,
+                                leave_category_id=1)
+        db.add(fake_user)
+        db.commit()
+        db.add(routes.LeaveRequest(start_date=datetime.datetime(2019, 3, 1), end_date=datetime.datetime(2019, 3, 31),
+                                   user_id=fake_user.id, state="declined"))
+        db.commit()
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['user'] = 'test_elek@invenshure.com'
+            data = {"current_user": "test_elek@invenshure.com", "start-date": "03/14/2019", "end-date": "03/19/2019"}
+            # A declined request doesn't count
+            resp = client.post('/save_request', data=data)
+            assert resp.status_code == 302
+            data = {"current_user": "test_elek@invenshure.com", "start-date": "03/19/2019", "end-date": "03/20/2019"}
+            resp = client.post('/save_request', data=data, follow_redirects=True)
+            assert b"You already have leave from 2019-03-14 to 2019-03-19!" in resp.data
+            resp = client.post('/save_request', json={"current_user": "test_elek@invenshure.com",
+                                                      "start-date": "03/10/2019", "end-date": "03/14/2019"})
+            assert resp.status_code == 409
+            assert resp.json['conflicts'] == [{'id': resp.json['conflicts'][0]['id'], 'start_date': '2019-03-14',
+                                               'end_date': '2019-03-19', 'state': 'pending'}]
+            # Adjacent days are fine
+            resp = client.post('/save_request', json={"current_user": "test_elek@invenshure.com",
+                                                      "start-date": "03/20/2019", "end-date": "03/21/2019"})
+            assert resp.status_code == 201
+            assert resp.json['start_date'] == '2019-03-20' and resp.json['state'] == 'pending'
+            assert resp.json['days'] == 2
+            # Nothing to take leave from on a weekend
+            resp = client.post('/save_request', json={"current_user": "test_elek@invenshure.com",
+                                                      "start-date": "03/23/2019", "end-date": "03/24/2019"})
+            assert resp.status_code == 400
+            assert resp.json['message'] == "There are no working days from 2019-03-23 to 2019-03-24!"
+            # Longer than any request may be, so it could hide overlaps from the bounded lookup
+            resp = client.post('/save_request', json={"current_user": "test_elek@invenshure.com",
+                                                      "start-date": "01/01/2019", "end-date": "01/10/2020"})
+            assert resp.status_code == 400
+        assert routes.LeaveRequest.query.filter_by(state='pending').count() == 2
+        user = routes.User.query.filter_by(email="test_elek@invenshure.com").first()
+        assert user.days == 6
+        overlapping = routes.overlapping_requests(user.id, datetime.datetime(2019, 3, 21),
+                                                  datetime.datetime(2019, 4, 2), 366)
+        assert [r.start_date for r in overlapping] == [datetime.datetime(2019, 3, 20)]
+    finally:
+        delete_everything_from_db()
+
 # Trying to save a request as a viewer
-def test_save_request_7():
+def test_save_request_7(app):
     try:
         # Adding test user and category
         routes.create_default_cat()
@@ -1226,7 +1276,7 @@ def test_account_1(client):
 
 
 # Sending get request, expecting proper values
-def test_account_2(mocker):
+def test_account_2(app, mocker):
     class MockedUserInfo:
         def __init__(self, userinfo):
             self.data = userinfo
@@ -1259,7 +1309,7 @@ def test_account_2(mocker):
 
 
 # Sending get request with None leavecategory
-def test_account_3(mocker):
+def test_account_3(app, mocker):
     class MockedUserInfo:
         def __init__(self, userinfo):
             self.data = userinfo
@@ -1292,7 +1342,7 @@ def test_account_3(mocker):
 
 
 # Checks response from /requests endpoint With 1 request
-def test_requests_1(mocker):
+def test_requests_1(app, mocker):
     class MockedUserInfo:
         def __init__(self, userinfo):
             self.data = userinfo
@@ -1331,7 +1381,7 @@ def test_requests_1(mocker):
 
 
 # Checks response from /requests endpoint With 11 request
-def test_requests_2(mocker):
+def test_requests_2(app, mocker):
     class MockedUserInfo:
         def __init__(self, userinfo):
             self.data = userinfo
@@ -1374,8 +1424,58 @@ def test_requests_2(mocker):
         delete_everything_from_db()
 
 
+# Checks that the /requests cursors walk forward to the last request and back again
+def test_requests_3(app, mocker):
+    class MockedUserInfo:
+        def __init__(self, userinfo):
+            self.data = userinfo
+
+    try:
+        routes.create_default_cat()
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="administrator", days=0,
+                                notification=0,
+                                leave_category_id=1)
+        db.add(fake_user)
+        db.commit()
+        for day in range(1, 12):
+            leave_request = routes.LeaveRequest(end_date=datetime.date(year=2018, month=4, day=day),
+                                                start_date=datetime.date(year=2018, month=4, day=day),
+                                                user_id=fake_user.id, state="pending")
+            db.add(leave_request)
+        db.commit()
+
+        json_data = {"email": "test_elek@invenshure.com"}
+
+        with app.test_client() as client:
+            mocker.patch('flaskr.routes.google.get', return_value=MockedUserInfo(json_data))
+            resp = client.get('/requests')
+            assert b"2018-04-01" in resp.data
+            assert b"2018-04-11" not in resp.data
+            assert b"Previous" not in resp.data
+            next_cursor = routes.keyset_paginate(routes.LeaveRequest.query, routes.LeaveRequest.start_date,
+                                                 routes.LeaveRequest.id, 10).next_cursor
+            resp = client.get('/requests?cursor=' + next_cursor)
+            assert b"2018-04-11" in resp.data
+            assert b"2018-04-10" not in resp.data
+            assert b"Next" not in resp.data
+            assert b"Previous" in resp.data
+            prev_cursor = routes.keyset_paginate(routes.LeaveRequest.query, routes.LeaveRequest.start_date,
+                                                 routes.LeaveRequest.id, 10, next_cursor).prev_cursor
+            resp = client.get('/requests?cursor=' + prev_cursor)
+            assert b"2018-04-01" in resp.data
+            assert b"2018-04-10" in resp.data
+            assert b"2018-04-11" not in resp.data
+            assert b"Previous" not in resp.data
+            # A tampered cursor falls back to the first page
+            resp = client.get('/requests?cursor=garbage')
+            assert resp.status_code == 200
+            assert b"2018-04-01" in resp.data
+    finally:
+        delete_everything_from_db()
+
+
 # Checks if /admin endpoint gives back the expected values for administrator user
-def test_admin_1(mocker):
+def test_admin_1(app, mocker):
     class MockedUserInfo:
         def __init__(self, userinfo):
             self.data = userinfo
@@ -1424,7 +1524,7 @@ def test_admin_1(mocker):
 
 
 # Checks if /admin endpoint redirects for a non administrator user
-def test_admin_2(mocker):
+def test_admin_2(app, mocker):
     class MockedUserInfo:
         def __init__(self, userinfo):
             self.data = userinfo
@@ -1467,7 +1567,7 @@ def test_admin_2(mocker):
 
 
 # Logging in for the first time, checks if we are admin and default 2 categories are created
-def test_login_auth_1(mocker):
+def test_login_auth_1(app, mocker, id_tokens):
     class MockedUserInfo:
         def __init__(self, userinfo):
             self.data = userinfo
@@ -1477,7 +1577,7 @@ def test_login_auth_1(mocker):
                 'expires_in': 3600,
                 'scope': 'openid https://www.googleapis.com/auth/userinfo.email',
                 'token_type': 'Bearer',
-                'id_token': 'test'
+                'id_token': id_tokens.sign("test_elni_jo@invenshure.com")
                 }
 
         json_data = {
@@ -1506,7 +1606,7 @@ def test_login_auth_1(mocker):
 
 
 # Logging in for the first time, checks if we are unapproved and the categories are not created
-def test_login_auth_2(mocker):
+def test_login_auth_2(app, mocker, id_tokens):
     class MockedUserInfo:
         def __init__(self, userinfo):
             self.data = userinfo
@@ -1521,7 +1621,7 @@ def test_login_auth_2(mocker):
                 'expires_in': 3600,
                 'scope': 'openid https://www.googleapis.com/auth/userinfo.email',
                 'token_type': 'Bearer',
-                'id_token': 'test'
+                'id_token': id_tokens.sign("test_elni_jo_2@invenshure.com")
                 }
 
         json_data = {
@@ -1551,7 +1651,7 @@ def test_login_auth_2(mocker):
 
 
 # Logging in as a user already, checks if we are redirected properly and the categories are not created
-def test_login_auth_3(mocker):
+def test_login_auth_3(app, mocker, id_tokens):
     class MockedUserInfo:
         def __init__(self, userinfo):
             self.data = userinfo
@@ -1566,7 +1666,7 @@ def test_login_auth_3(mocker):
                 'expires_in': 3600,
                 'scope': 'openid https://www.googleapis.com/auth/userinfo.email',
                 'token_type': 'Bearer',
-                'id_token': 'test'
+                'id_token': id_tokens.sign("test_elni_jo@invenshure.com")
                 }
 
         json_data = {
@@ -1595,7 +1695,7 @@ def test_login_auth_3(mocker):
 
 
 # Logging in as a user already, checks if we are redirected properly and the categories are not created
-def test_login_auth_4(mocker):
+def test_login_auth_4(app, mocker):
     class MockedUserInfo:
         def __init__(self, userinfo):
             self.data = userinfo
@@ -1628,7 +1728,7 @@ def test_login_auth_4(mocker):
 
 
 # Tests if the exception is caught
-def test_login_except(mocker):
+def test_login_except(app, mocker):
     with app.test_client() as client:
         mocker.patch('flaskr.routes.google.authorized_response', side_effect=Exception('my error'))
         with pytest.raises(Exception):
@@ -1636,3 +1736,1431 @@ def test_login_except(mocker):
         resp = client.get('/login/authorized')
         assert resp.json['description'] == 'my error'
         assert resp.status_code == 500
+
+
+# Checks that Google is only asked for the user info once per login and the identity is dropped on logout
+def test_identity_cache_1(app, mocker):
+    class MockedUserInfo:
+        def __init__(self, userinfo):
+            self.data = userinfo
+
+    try:
+        routes.identity_cache.clear()
+        routes.create_default_cat()
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="administrator", days=0,
+                                notification=0,
+                                leave_category_id=1)
+        db.add(fake_user)
+        db.commit()
+
+        json_data = {"email": "test_elek@invenshure.com"}
+
+        with app.test_client() as client:
+            userinfo = mocker.patch('flaskr.routes.google.get', return_value=MockedUserInfo(json_data))
+            with client.session_transaction() as sess:
+                sess['user'] = 'test_elek@invenshure.com'
+                sess['google_token'] = ('cached_token', '')
+            for _ in range(3):
+                resp = client.get('/')
+                assert resp.status_code == 200
+                assert b"Admin" in resp.data
+            assert userinfo.call_count == 1
+            assert routes.identity_cache.get('cached_token')['email'] == "test_elek@invenshure.com"
+            client.get('/logout')
+            assert routes.identity_cache.get('cached_token') is None
+    finally:
+        routes.identity_cache.clear()
+        delete_everything_from_db()
+
+
+
+# ID tokens are checked locally: signature against the key set, expiry, audience, issuer and a verified email
+def test_verify_id_token(id_tokens, signing_key, tmp_path):
+    import jwt
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from flaskr.identity import verify_id_token
+    keys = routes.google_keys
+    audience = id_tokens.audience
+    claims = verify_id_token(id_tokens.sign("test_elek@invenshure.com"), keys, audience)
+    assert claims['email'] == "test_elek@invenshure.com"
+    for token, error in ((id_tokens.sign("test_elek@invenshure.com", aud='someone else'), jwt.InvalidAudienceError),
+                         (id_tokens.sign("test_elek@invenshure.com", exp=int(time.time()) - 120),
+                          jwt.ExpiredSignatureError),
+                         (id_tokens.sign("test_elek@invenshure.com", iss='https://evil.example'),
+                          jwt.InvalidIssuerError),
+                         (id_tokens.sign("test_elek@invenshure.com", email_verified=False), jwt.InvalidTokenError)):
+        with pytest.raises(error):
+            verify_id_token(token, keys, audience)
+    # Expired a moment ago, within the allowed clock skew
+    verify_id_token(id_tokens.sign("test_elek@invenshure.com", exp=int(time.time()) - 5), keys, audience)
+    forger = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    forged = jwt.encode({'iss': 'accounts.google.com', 'aud': audience, 'sub': '1', 'email': "test_elek@invenshure.com",
+                         'email_verified': True, 'iat': int(time.time()), 'exp': int(time.time()) + 60},
+                        forger, algorithm='RS256', headers={'kid': id_tokens.kid})
+    with pytest.raises(jwt.InvalidSignatureError):
+        verify_id_token(forged, keys, audience)
+
+
+# The key set is read once, and read again early only for a key it doesn't know yet
+def test_key_set_refresh(id_tokens, tmp_path):
+    import jwt
+    from flaskr.identity import KeySet
+    from tests.conftest import IDTokenSigner
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    keys = KeySet(str(tmp_path / 'jwks.json'), min_refresh=3600)
+    assert keys.get(id_tokens.kid) is not None
+    rotated = IDTokenSigner(rsa.generate_private_key(public_exponent=65537, key_size=2048), tmp_path / 'jwks.json',
+                            id_tokens.audience, kid='rotated-key')
+    with pytest.raises(jwt.InvalidTokenError):
+        keys.get(rotated.kid)
+    keys.min_refresh = 0
+    assert keys.get(rotated.kid) is not None
+    with pytest.raises(jwt.InvalidTokenError):
+        keys.get(id_tokens.kid)
+
+
+# Checks that the keys fetched before still verify tokens once the JWKS can't be fetched, without a fetch on every use
+def test_key_set_fetch_failure(id_tokens, tmp_path, caplog):
+    import threading
+    from flaskr.identity import KeySet, verify_id_token
+    keys = KeySet(str(tmp_path / 'jwks.json'), ttl=3600, min_refresh=60)
+    assert keys.get(id_tokens.kid) is not None
+    (tmp_path / 'jwks.json').unlink()
+    # Past the TTL
+    keys._fetched -= 3601
+    keys._attempted -= 3601
+    with mock.patch.object(keys, '_fetch', wraps=keys._fetch) as fetch:
+        token = id_tokens.sign("test_elek@invenshure.com")
+        assert verify_id_token(token, keys, id_tokens.audience)['email'] == "test_elek@invenshure.com"
+        assert keys.get(id_tokens.kid) is not None
+    assert fetch.call_count == 1
+    assert "keeping the 1 fetched before" in caplog.text
+    # With no keys to keep, the error is raised
+    with pytest.raises(FileNotFoundError):
+        KeySet(str(tmp_path / 'jwks.json')).get(id_tokens.kid)
+    # Threads that find the keys stale together fetch them once
+    id_tokens.publish(tmp_path / 'jwks.json')
+    keys._fetched -= 3601
+    keys._attempted -= 3601
+    with mock.patch.object(keys, '_fetch', wraps=keys._fetch) as fetch:
+        threads = [threading.Thread(target=keys.get, args=(id_tokens.kid,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert fetch.call_count == 1
+
+
+# After the login only the ID token is used to know who the user is, Google isn't asked again
+def test_login_id_token(app, mocker, id_tokens):
+    try:
+        routes.identity_cache.clear()
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="administrator", days=0)
+        db.add(fake_user)
+        db.commit()
+        userinfo = mocker.patch('flaskr.routes.google.get', side_effect=AssertionError("userinfo was called"))
+        mocker.patch('flaskr.routes.google.authorized_response',
+                     return_value={'access_token': 'id_token_test', 'id_token': id_tokens.sign("test_elek@invenshure.com")})
+        with app.test_client() as client:
+            resp = client.get('/login/authorized', follow_redirects=True)
+            assert resp.status_code == 200
+            assert b"Admin" in resp.data
+            routes.identity_cache.clear()
+            assert b"Admin" in client.get('/').data
+            # An expired token ends the session
+            routes.identity_cache.clear()
+            with app.test_request_context():
+                routes.session['google_token'] = ('id_token_test', '')
+                routes.session['google_id_token'] = id_tokens.sign("test_elek@invenshure.com",
+                                                                   exp=int(time.time()) - 120)
+                assert routes.get_current_user().location.endswith('/logout')
+            mocker.patch('flaskr.routes.google.authorized_response',
+                         return_value={'access_token': 'id_token_test', 'id_token': id_tokens.sign(
+                             "test_elek@invenshure.com", aud='someone else')})
+            resp = client.get('/login/authorized')
+            assert b"Access denied: reason=invalid_id_token" in resp.data
+        assert userinfo.call_count == 0
+    finally:
+        routes.identity_cache.clear()
+        delete_everything_from_db()
+
+# Checks that changing the user group of a user drops its cached identity
+def test_identity_cache_2(app, mocker):
+    try:
+        routes.identity_cache.clear()
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="employee")
+        fake_admin = routes.User(email="test_elni_jo@invenshure.com", user_group="administrator")
+        db.add(fake_user)
+        db.add(fake_admin)
+        db.commit()
+        routes.remember_identity(('cached_token', ''), fake_user)
+        data = {"user": "test_elek@invenshure.com", "group": "viewer"}
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['user'] = 'test_elni_jo@invenshure.com'
+            resp = client.post('/handle_acc', data=data)
+            assert resp.status_code == 302
+        assert routes.identity_cache.get('cached_token') is None
+    finally:
+        routes.identity_cache.clear()
+        delete_everything_from_db()
+
+
+# Builds a mail queue that delivers to the local SMTP stand-in
+def stand_in_mail_queue(smtp_server, **config):
+    from flask import Flask
+    from flask_mail import Mail
+    from flaskr.mailer import MailQueue
+    mail_app = Flask('mail_queue_test')
+    mail_app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=smtp_server.server_address[1], MAIL_USE_TLS=False,
+                           MAIL_SUPPRESS_SEND=False, **config)
+    return MailQueue(mail_app, Mail(mail_app))
+
+
+def stand_in_message(number):
+    msg = Message('Vacation Management', sender='noreply@demo.com', recipients=['test_elek@invenshure.com'])
+    msg.body = "test_email " + str(number)
+    return msg
+
+
+# Checks that a burst of emails is sent by a bounded number of workers over one connection each
+def test_mail_queue_1(smtp_server):
+    mail_queue = stand_in_mail_queue(smtp_server, MAIL_WORKERS=1)
+    for number in range(20):
+        assert mail_queue.submit([stand_in_message(number)])
+    mail_queue.join()
+    assert len(smtp_server.messages) == 20
+    assert smtp_server.connections == 1
+    stats = mail_queue.stats()
+    assert stats['workers'] == 1
+    assert stats['sent'] == 20
+    assert stats['queue_depth'] == 0
+    assert stats['send_latency_count'] == 20
+
+
+# Checks that submitting blocks and then gives up when the queue is full
+def test_mail_queue_2(smtp_server):
+    mail_queue = stand_in_mail_queue(smtp_server, MAIL_WORKERS=1, MAIL_QUEUE_SIZE=1, MAIL_QUEUE_TIMEOUT=0.1)
+    smtp_server.accepting.clear()
+    assert mail_queue.submit([stand_in_message(1)])
+    # Wait until the worker holds the first message, so the second one fills the queue
+    while mail_queue.stats()['queue_wait_count'] == 0:
+        time.sleep(0.01)
+    assert mail_queue.submit([stand_in_message(2)])
+    assert not mail_queue.submit([stand_in_message(3)])
+    assert mail_queue.stats()['queue_depth'] == 1
+    assert mail_queue.stats()['dropped'] == 1
+    smtp_server.accepting.set()
+    mail_queue.join()
+    assert len(smtp_server.messages) == 2
+
+
+# Checks that a message that can't be sent only loses itself, and that a worker that died is replaced
+def test_mail_queue_3(smtp_server):
+    mail_queue = stand_in_mail_queue(smtp_server, MAIL_WORKERS=1)
+    bad = stand_in_message(1)
+    bad.subject = "Vacation\nManagement"
+    assert mail_queue.submit([bad, stand_in_message(2)])
+    assert mail_queue.submit([stand_in_message(3)])
+    mail_queue.join()
+    assert len(smtp_server.messages) == 2
+    assert mail_queue.stats()['failed'] == 1
+    mail_queue._threads[0].is_alive = lambda: False
+    assert mail_queue.submit([stand_in_message(4)])
+    mail_queue.join()
+    assert len(smtp_server.messages) == 3
+    assert mail_queue.stats()['workers'] == 1
+
+
+# Checks that buffered changes go out as one message per recipient over a single connection
+def test_mail_digest_1(app, smtp_server):
+    from flaskr.mailer import MailDigest
+    mail_queue = stand_in_mail_queue(smtp_server, MAIL_WORKERS=2)
+    digest = MailDigest(mail_queue.app, mail_queue, routes.notification_message)
+    for number in range(10):
+        digest.add(['test_elek@invenshure.com', 'test_elni_jo@invenshure.com'], "change " + str(number))
+    assert digest.flush() == 2
+    mail_queue.join()
+    assert len(smtp_server.messages) == 2
+    assert smtp_server.connections == 1
+    assert b"There have been 10 changes" in smtp_server.messages[0]['data']
+    assert digest.flush() == 0
+
+
+# Checks that the digest is flushed as soon as a recipient reaches the size threshold
+def test_mail_digest_2(app, smtp_server):
+    from flaskr.mailer import MailDigest
+    mail_queue = stand_in_mail_queue(smtp_server, MAIL_DIGEST_MAX_CHANGES=3)
+    digest = MailDigest(mail_queue.app, mail_queue, routes.notification_message)
+    digest.add(['test_elek@invenshure.com'], "change 1")
+    digest.add(['test_elek@invenshure.com'], "change 2")
+    mail_queue.join()
+    assert len(smtp_server.messages) == 0
+    digest.add(['test_elek@invenshure.com'], "change 3")
+    mail_queue.join()
+    assert len(smtp_server.messages) == 1
+
+
+# Checks that urgent notifications skip the digest
+def test_mail_digest_3(mocker):
+    try:
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="employee")
+        db.add(fake_user)
+        db.commit()
+        mocker.patch.object(routes.mail_digest, 'enabled', True)
+        add = mocker.patch.object(routes.mail_digest, 'add')
+        send = mocker.patch('flaskr.routes.send_async_email')
+        routes.send_email("test change", "test_elek@invenshure.com")
+        assert add.call_count == 1
+        assert send.call_count == 0
+        routes.send_email("test change", "test_elek@invenshure.com", urgent=True)
+        assert add.call_count == 1
+        assert send.call_count == 1
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that the recipients of send_email are only looked up once
+def test_recipient_cache_1(app, query_counter):
+    try:
+        fake_admin = routes.User(email="test_elni_jo@invenshure.com", user_group="administrator")
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="employee")
+        db.add(fake_admin)
+        db.add(fake_user)
+        db.commit()
+        sent = []
+        with mock.patch('flaskr.routes.send_async_email', lambda app, msg: sent.append(msg)):
+            query_counter.reset()
+            routes.send_email("first change", "test_elek@invenshure.com")
+            assert query_counter.count == 2
+            query_counter.reset()
+            routes.send_email("second change", "test_elek@invenshure.com")
+            assert query_counter.count == 0
+        assert sent[1].recipients == ["test_elni_jo@invenshure.com", "test_elek@invenshure.com"]
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that turning off notifications through /handle_acc drops the cached recipients
+def test_recipient_cache_2(app):
+    try:
+        fake_admin = routes.User(email="test_elni_jo@invenshure.com", user_group="administrator")
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="employee")
+        db.add(fake_admin)
+        db.add(fake_user)
+        db.commit()
+        sent = []
+        with mock.patch('flaskr.routes.send_async_email', lambda app, msg: sent.append(msg)):
+            routes.send_email("first change", "test_elek@invenshure.com")
+            with app.test_client() as client:
+                with client.session_transaction() as sess:
+                    sess['user'] = 'test_elni_jo@invenshure.com'
+                client.post('/handle_acc', data={"on": "test_elni_jo@invenshure.com"})
+            routes.send_email("second change", "test_elek@invenshure.com")
+        assert sent[0].recipients == ["test_elni_jo@invenshure.com", "test_elek@invenshure.com"]
+        assert sent[1].recipients == ["test_elek@invenshure.com"]
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that with a warm recipient cache notifying adds no queries to a mutation route
+def test_recipient_cache_3(app, query_counter):
+    try:
+        routes.create_default_cat()
+        fake_admin = routes.User(email="test_elni_jo@invenshure.com", user_group="administrator")
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="employee", leave_category_id=1)
+        db.add(fake_admin)
+        db.add(fake_user)
+        db.commit()
+        leave_requests = []
+        for _ in range(2):
+            leave_request = routes.LeaveRequest(end_date=datetime.date(year=2018, month=4, day=13),
+                                                start_date=datetime.date(year=2018, month=4, day=10),
+                                                user_id=fake_user.id, state="pending")
+            db.add(leave_request)
+            leave_requests.append(leave_request)
+        db.commit()
+        ids = [leave_request.id for leave_request in leave_requests]
+        counts = []
+        with mock.patch('flaskr.routes.send_async_email'):
+            routes.send_email("warm up", "test_elek@invenshure.com")
+            with app.test_client() as client:
+                with client.session_transaction() as sess:
+                    sess['user'] = 'test_elni_jo@invenshure.com'
+                query_counter.reset()
+                client.post('/handle_request', data={"accept": ids[0]})
+                counts.append(query_counter.count)
+                with mock.patch('flaskr.routes.send_email'):
+                    query_counter.reset()
+                    client.post('/handle_request', data={"accept": ids[1]})
+                    counts.append(query_counter.count)
+        assert counts[0] == counts[1]
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that the calendar feed only returns the requested year and can be revalidated with its ETag
+def test_calendar_feed_1(app, mocker):
+    class MockedUserInfo:
+        def __init__(self, userinfo):
+            self.data = userinfo
+
+    try:
+        routes.create_default_cat()
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="employee", leave_category_id=1)
+        db.add(fake_user)
+        db.commit()
+        for year in (2018, 2019):
+            db.add(routes.LeaveRequest(start_date=datetime.date(year=year, month=4, day=10),
+                                       end_date=datetime.date(year=year, month=4, day=13),
+                                       user_id=fake_user.id, state="pending"))
+        # Spans the new year, so it is part of both years
+        db.add(routes.LeaveRequest(start_date=datetime.date(year=2018, month=12, day=30),
+                                   end_date=datetime.date(year=2019, month=1, day=2),
+                                   user_id=fake_user.id, state="accepted"))
+        db.commit()
+
+        with app.test_client() as client:
+            mocker.patch('flaskr.routes.google.get', return_value=MockedUserInfo({"email": "test_elek@invenshure.com"}))
+            resp = client.get('/api/calendar?year=2019')
+            assert resp.status_code == 200
+            assert [r['start_date'] for r in resp.json['leave_requests']] == ['2018-12-30', '2019-04-10']
+            assert [r['days'] for r in resp.json['leave_requests']] == [3, 3]
+            assert resp.json['holidays'] == []
+            assert resp.headers['ETag']
+            assert resp.headers['Last-Modified']
+            resp_2 = client.get('/api/calendar?year=2019', headers={'If-None-Match': resp.headers['ETag']})
+            assert resp_2.status_code == 304
+            assert resp_2.data == b""
+            resp_3 = client.get('/api/calendar?start=2018-01-01&end=2018-06-30')
+            assert [r['start_date'] for r in resp_3.json['leave_requests']] == ['2018-04-10']
+            assert resp_3.headers['ETag'] != resp.headers['ETag']
+            resp_4 = client.get('/api/calendar?start=2018-06-30&end=2018-01-01')
+            assert resp_4.status_code == 400
+            resp_5 = client.get('/api/calendar?start=2018-01-01&end=9999-12-31')
+            assert resp_5.status_code == 400
+            resp_6 = client.get('/api/calendar?start=2018-01-01&end=2019-06-30')
+            assert resp_6.status_code == 400
+            assert "366 days" in resp_6.json['description']
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that the calendar feed needs a logged in user
+def test_calendar_feed_2(client):
+    resp = client.get('/api/calendar?year=2019')
+    assert resp.status_code == 401
+
+
+# Checks that /api/export streams the requests with their users and categories, filtered, as CSV, JSON lines or gzip
+def test_export_1(app, mocker):
+    class MockedUserInfo:
+        def __init__(self, userinfo):
+            self.data = userinfo
+
+    try:
+        routes.create_default_cat()
+        fake_admin = routes.User(email="test_elni_jo@invenshure.com", user_group="administrator", leave_category_id=1)
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="employee")
+        db.add(fake_admin)
+        db.add(fake_user)
+        db.commit()
+        for user, day, state in ((fake_admin, 1, "accepted"), (fake_user, 10, "pending"), (fake_user, 20, "declined")):
+            db.add(routes.LeaveRequest(start_date=datetime.datetime(2019, 4, day),
+                                       end_date=datetime.datetime(2019, 4, day + 3), user_id=user.id, state=state))
+        db.add(routes.LeaveRequest(start_date=datetime.datetime(2018, 4, 2), end_date=datetime.datetime(2018, 4, 3),
+                                   user_id=fake_user.id, state="accepted"))
+        db.commit()
+        with app.test_client() as client:
+            mocker.patch('flaskr.routes.google.get',
+                         return_value=MockedUserInfo({"email": "test_elni_jo@invenshure.com"}))
+            resp = client.get('/api/export?year=2019')
+            assert resp.status_code == 200
+            assert resp.mimetype == 'text/csv'
+            assert resp.is_streamed
+            rows = list(csv.reader(io.StringIO(resp.get_data(as_text=True))))
+            assert rows[0] == ['id', 'email', 'user_group', 'category', 'state', 'start_date', 'end_date', 'days']
+            assert [row[1:] for row in rows[1:]] == [
+                ['test_elni_jo@invenshure.com', 'administrator', 'Young', 'accepted', '2019-04-01', '2019-04-04', '4'],
+                ['test_elek@invenshure.com', 'employee', '', 'pending', '2019-04-10', '2019-04-13', '3'],
+                ['test_elek@invenshure.com', 'employee', '', 'declined', '2019-04-20', '2019-04-23', '2']]
+            resp = client.get('/api/export?format=jsonl&state=accepted&state=pending')
+            lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+            assert [(line['start_date'], line['state']) for line in lines] == [
+                ('2019-04-01', 'accepted'), ('2019-04-10', 'pending'), ('2018-04-02', 'accepted')]
+            assert lines[0]['category'] == 'Young' and lines[1]['category'] is None
+            resp = client.get('/api/export?start=2018-01-01&end=2018-12-31', headers={'Accept-Encoding': 'gzip'})
+            assert resp.headers['Content-Encoding'] == 'gzip'
+            assert gzip.decompress(resp.data).decode().splitlines()[1].endswith(',accepted,2018-04-02,2018-04-03,2')
+            assert client.get('/api/export?format=xml').status_code == 400
+            assert client.get('/api/export?state=approved').status_code == 400
+            mocker.patch('flaskr.routes.google.get', return_value=MockedUserInfo({"email": "test_elek@invenshure.com"}))
+            routes.identity_cache.clear()
+            assert client.get('/api/export').status_code == 403
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that `flask export-leave-requests` writes the same export to a file
+def test_export_2(app, tmpdir):
+    try:
+        routes.create_default_cat()
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="employee", leave_category_id=1)
+        db.add(fake_user)
+        db.commit()
+        for day in (10, 20):
+            db.add(routes.LeaveRequest(start_date=datetime.datetime(2019, 4, day),
+                                       end_date=datetime.datetime(2019, 4, day + 3), user_id=fake_user.id,
+                                       state="accepted"))
+        db.commit()
+        output = tmpdir.join('export.csv.gz')
+        result = app.test_cli_runner().invoke(args=['export-leave-requests', '--end', '2019-04-19', '--gzip',
+                                                    '--output', str(output)])
+        assert result.exit_code == 0, result.output
+        lines = gzip.decompress(output.read_binary()).decode().splitlines()
+        assert len(lines) == 2
+        assert lines[1].endswith(',test_elek@invenshure.com,employee,Young,accepted,2019-04-10,2019-04-13,3')
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that `flask import-csv` loads users, categories and leave requests, reports the bad rows and recomputes the
+# balances once
+def test_import_1(app, tmpdir):
+    try:
+        routes.create_default_cat()
+        db.add(routes.User(email="test_elni_jo@invenshure.com", user_group="administrator", leave_category_id=1))
+        db.add(routes.User(email="test_elek@invenshure.com", user_group="unapproved"))
+        db.commit()
+        users = tmpdir.join('users.csv')
+        users.write("email,user_group,category,max_days\n"
+                    "test_elek@invenshure.com,employee,Young,\n"
+                    "test_new@invenshure.com,employee,Part time,10\n"
+                    "test_boss@invenshure.com,boss,Young,\n"
+                    "not an email,viewer,,\n"
+                    "test_new@invenshure.com,viewer,,\n")
+        leave_requests = tmpdir.join('leave_requests.csv')
+        leave_requests.write("email,start_date,end_date,state\n"
+                             "test_elek@invenshure.com,2019-03-11,2019-03-15,accepted\n"
+                             "test_elek@invenshure.com,2019-03-14,2019-03-18,pending\n"
+                             "test_elek@invenshure.com,2019-03-14,2019-03-18,declined\n"
+                             "test_new@invenshure.com,2019-04-01,2019-04-02,pending\n"
+                             "test_boss@invenshure.com,2019-04-01,2019-04-02,pending\n"
+                             "test_new@invenshure.com,2019-04-05,2019-04-01,accepted\n"
+                             "test_new@invenshure.com,2019-04-08,2019-04-09,approved\n")
+        runner = app.test_cli_runner(mix_stderr=False)
+        args = ['import-csv', '--users', str(users), '--leave-requests', str(leave_requests)]
+        result = runner.invoke(args=args + ['--dry-run'])
+        assert result.exit_code == 0, result.output
+        assert routes.User.query.count() == 2
+        result = runner.invoke(args=args)
+        assert result.stderr.splitlines() == [
+            "users line 4: unknown user group 'boss', expected one of viewer, employee, administrator",
+            "users line 5: invalid email 'not an email'",
+            "users line 6: test_new@invenshure.com is listed more than once",
+            "leave requests line 6: unknown user 'test_boss@invenshure.com'",
+            "leave requests line 7: end_date is before start_date",
+            "leave requests line 8: unknown state 'approved', expected one of pending, accepted, declined",
+            # Overlaps are looked for a chunk of rows at a time
+            "leave requests line 3: overlaps another pending or accepted request of the user"]
+        assert result.stdout == ("1 user(s) added, 1 updated, 1 categories added, 3 leave request(s) added, "
+                                 "7 row(s) skipped\n")
+        user = routes.get_user_by_email("test_elek@invenshure.com")
+        assert (user.user_group, user.leave_category.category, user.days) == ("employee", "Young", 5)
+        user = routes.get_user_by_email("test_new@invenshure.com")
+        assert (user.leave_category.category, user.leave_category.max_days, user.days) == ("Part time", 10, 2)
+        # Importing the same requests again only finds overlaps
+        result = runner.invoke(args=['import-csv', '--leave-requests', str(leave_requests)])
+        assert result.stdout.startswith("0 user(s) added, 0 updated, 0 categories added, 1 leave request(s) added")
+        assert routes.get_user_by_email("test_elek@invenshure.com").days == 5
+    finally:
+        delete_everything_from_db()
+
+
+# Checks the /import upload: administrators only, the report streamed back, and nothing saved when no administrator
+# would be left
+def test_import_2(app, mocker):
+    class MockedUserInfo:
+        def __init__(self, userinfo):
+            self.data = userinfo
+
+    try:
+        db.add(routes.User(email="test_elni_jo@invenshure.com", user_group="administrator"))
+        db.commit()
+        with app.test_client() as client:
+            mocker.patch('flaskr.routes.google.get',
+                         return_value=MockedUserInfo({"email": "test_elni_jo@invenshure.com"}))
+            resp = client.post('/import', data={})
+            assert resp.status_code == 302
+            users = b"email,user_group,category\ntest_elek@invenshure.com,administrator,\n"
+            resp = client.post('/import', data={'users': (io.BytesIO(b"\xef\xbb\xbf" + users), 'users.csv')})
+            assert resp.is_streamed
+            assert resp.get_data(as_text=True) == ("1 user(s) added, 0 updated, 0 categories added, "
+                                                   "0 leave request(s) added, 0 row(s) skipped\n")
+            users = (b"email,user_group,category\n"
+                     b"test_elni_jo@invenshure.com,viewer,\ntest_elek@invenshure.com,viewer,\n")
+            resp = client.post('/import', data={'users': (io.BytesIO(users), 'users.csv')})
+            assert resp.get_data(as_text=True).splitlines() == [
+                "At least 1 administrator needs to be in the system, nothing was imported!",
+                "0 user(s) added, 2 updated, 0 categories added, 0 leave request(s) added, 1 row(s) skipped, "
+                "nothing saved"]
+            assert routes.get_user_by_email("test_elni_jo@invenshure.com").user_group == "administrator"
+            mocker.patch('flaskr.routes.google.get', return_value=MockedUserInfo({"email": "test_elek@invenshure.com"}))
+            routes.identity_cache.clear()
+            db.query(routes.User).filter_by(email="test_elek@invenshure.com").update({'user_group': 'employee'})
+            db.commit()
+            resp = client.post('/import', data={'users': (io.BytesIO(users), 'users.csv')})
+            assert resp.status_code == 302
+        assert routes.User.query.filter_by(user_group='viewer').count() == 0
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that `flask seed` generates consistent data: balances matching the requests, no overlaps, same data for the
+# same --random-seed
+def test_seed(app):
+    from flaskr.balance import reconcile_balances
+    try:
+        runner = app.test_cli_runner()
+        args = ['seed', '--users', '50', '--requests', '500', '--random-seed', '1']
+        result = runner.invoke(args=args)
+        assert result.exit_code == 0, result.output
+        assert result.output.startswith("50 user(s), 3 categories and ")
+        assert routes.User.query.count() == 50
+        assert routes.LeaveCategory.query.count() == 3
+        assert routes.User.query.filter_by(user_group='administrator').count() >= 1
+        assert reconcile_balances() == {}
+        rows = db.query(routes.LeaveRequest.user_id, routes.LeaveRequest.start_date, routes.LeaveRequest.end_date) \
+            .filter(routes.LeaveRequest.state.in_(('pending', 'accepted'))) \
+            .order_by(routes.LeaveRequest.user_id, routes.LeaveRequest.start_date).all()
+        assert len(rows) > 100
+        for previous, row in zip(rows, rows[1:]):
+            assert previous.user_id != row.user_id or previous.end_date < row.start_date
+        first = sorted((r.start_date, r.end_date, r.state) for r in routes.LeaveRequest.query)
+        assert runner.invoke(args=args).exit_code != 0
+        result = runner.invoke(args=args + ['--clear'])
+        assert result.exit_code == 0, result.output
+        assert sorted((r.start_date, r.end_date, r.state) for r in routes.LeaveRequest.query) == first
+        assert routes.User.query.count() == 50
+    finally:
+        delete_everything_from_db()
+
+
+# Checks the day counts of the availability index and that it follows updates without a rebuild
+def test_availability_index():
+    from flaskr.availability import AvailabilityIndex
+    index = AvailabilityIndex(ttl=3600)
+    index.rebuild([(1, 10, 'accepted', datetime.datetime(2019, 4, 10), datetime.datetime(2019, 4, 12)),
+                   (2, 11, 'accepted', datetime.datetime(2019, 4, 12), datetime.datetime(2019, 4, 13)),
+                   (3, 12, 'pending', datetime.datetime(2019, 4, 11), datetime.datetime(2019, 4, 11))])
+    counts = dict(index.daily_counts(datetime.date(2019, 4, 9), datetime.date(2019, 4, 13)))
+    assert counts == {datetime.date(2019, 4, 9): 0, datetime.date(2019, 4, 10): 1, datetime.date(2019, 4, 11): 1,
+                      datetime.date(2019, 4, 12): 2, datetime.date(2019, 4, 13): 1}
+    assert dict(index.daily_counts(datetime.date(2019, 4, 11), datetime.date(2019, 4, 11),
+                                   ('accepted', 'pending'))) == {datetime.date(2019, 4, 11): 2}
+    assert index.users_off(datetime.date(2019, 4, 12), datetime.date(2019, 4, 30)) == {10: 1, 11: 2}
+    declined = routes.LeaveRequest(id=1, user_id=10, state='declined', start_date=datetime.datetime(2019, 4, 10),
+                                   end_date=datetime.datetime(2019, 4, 12))
+    index.update(declined)
+    assert index.users_off(datetime.date(2019, 4, 1), datetime.date(2019, 4, 30)) == {11: 2}
+    accepted = routes.LeaveRequest(id=3, user_id=12, state='accepted', start_date=datetime.datetime(2019, 4, 11),
+                                   end_date=datetime.datetime(2019, 4, 11))
+    index.update(accepted)
+    assert index.users_off(datetime.date(2019, 4, 1), datetime.date(2019, 4, 30)) == {11: 2, 12: 1}
+    assert index.users_off(datetime.date(2019, 4, 1), datetime.date(2019, 4, 30), ('pending',)) == {}
+
+
+# Checks that /api/availability reports who is off across the company
+def test_availability_feed(app, mocker):
+    class MockedUserInfo:
+        def __init__(self, userinfo):
+            self.data = userinfo
+
+    try:
+        routes.create_default_cat()
+        fake_admin = routes.User(email="test_elni_jo@invenshure.com", user_group="administrator", leave_category_id=1)
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="employee", leave_category_id=1)
+        db.add(fake_admin)
+        db.add(fake_user)
+        db.commit()
+        db.add(routes.LeaveRequest(start_date=datetime.date(year=2019, month=4, day=10),
+                                   end_date=datetime.date(year=2019, month=4, day=11),
+                                   user_id=fake_user.id, state="accepted"))
+        db.commit()
+        routes.availability.rebuild()
+        with app.test_client() as client:
+            mocker.patch('flaskr.routes.google.get',
+                         return_value=MockedUserInfo({"email": "test_elni_jo@invenshure.com"}))
+            with client.session_transaction() as sess:
+                sess['user'] = 'test_elni_jo@invenshure.com'
+            data = {"current_user": "test_elni_jo@invenshure.com", "start-date": "04/11/2019",
+                    "end-date": "04/12/2019"}
+            client.post('/save_request', data=data)
+            resp = client.get('/api/availability?start=2019-04-09&end=2019-04-12')
+            assert resp.status_code == 200
+            assert [day['off'] for day in resp.json['days']] == [0, 1, 2, 1]
+            assert resp.json['users'] == [{'email': 'test_elek@invenshure.com', 'days': 2},
+                                          {'email': 'test_elni_jo@invenshure.com', 'days': 2}]
+            resp_2 = client.get('/api/availability?start=2019-01-01&end=2119-01-01')
+            assert resp_2.status_code == 400
+    finally:
+        delete_everything_from_db()
+        routes.availability.rebuild()
+
+
+# Checks that a change made while the index reads the database isn't lost when the rows read are swapped in
+def test_availability_rebuild():
+    from flaskr.availability import AvailabilityIndex
+    import threading
+    index = AvailabilityIndex()
+    index.rebuild([])
+    day = datetime.datetime(2019, 4, 10)
+    updater = threading.Thread(target=index.update_rows, args=([(1, 1, 'accepted', day, day)],))
+    read = index._read
+
+    def slow_read():
+        updater.start()
+        updater.join(0.2)
+        return read()
+
+    with mock.patch.object(index, '_read', side_effect=slow_read):
+        index.rebuild()
+    updater.join()
+    assert index.users_off(day, day) == {1: 1}
+
+
+# Checks that the index is rebuilt from what is committed, not from the snapshot of the session's open transaction
+def test_availability_rebuild_2():
+    from flaskr.availability import AvailabilityIndex
+    try:
+        user = routes.User(email="test_elek@invenshure.com", user_group="employee")
+        db.add(user)
+        db.commit()
+        user_id = user.id
+        # The session's transaction is open, as it is once a request has looked up its user
+        routes.User.query.get(user_id)
+        day = datetime.datetime(2019, 4, 10)
+        with routes.db.engine.begin() as connection:
+            connection.execute(routes.LeaveRequest.__table__.insert(), user_id=user_id, state='accepted',
+                               start_date=day, end_date=day, days=1)
+        index = AvailabilityIndex()
+        index.rebuild()
+        assert index.users_off(day, day) == {user_id: 1}
+    finally:
+        db.rollback()
+        delete_everything_from_db()
+
+
+# Checks that charging days is refused once it would go over the limit, whatever the loaded object says
+def test_charge_days():
+    try:
+        routes.create_default_cat()
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="employee", days=17, leave_category_id=1)
+        db.add(fake_user)
+        db.commit()
+        # Another request spends days behind the back of the loaded object
+        routes.User.query.filter_by(id=fake_user.id).update({routes.User.days: 18}, synchronize_session=False)
+        db.commit()
+        assert routes.charge_days(fake_user, 2, limit=20)
+        assert not routes.charge_days(fake_user, 1, limit=20)
+        db.commit()
+        assert fake_user.days == 20
+        assert routes.get_days_left(fake_user) == 0
+        assert routes.charge_days(fake_user, -5)
+        db.commit()
+        assert routes.get_days_left(fake_user) == 5
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that declining a request twice only gives its days back once
+def test_handle_request_5(app):
+    try:
+        routes.create_default_cat()
+        user = routes.User(email="test_elek@invenshure.com", user_group="employee", days=4, leave_category_id=1)
+        db.add(user)
+        db.commit()
+        leave_request = routes.LeaveRequest(end_date=datetime.date(year=2018, month=4, day=13),
+                                            start_date=datetime.date(year=2018, month=4, day=10),
+                                            user_id=user.id, state="accepted")
+        db.add(leave_request)
+        db.commit()
+        leave_request_id = leave_request.id
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['user'] = 'test_elek@invenshure.com'
+            client.post('/handle_request', data={"decline": leave_request_id})
+            client.post('/handle_request', data={"decline": leave_request_id})
+        assert routes.User.query.filter_by(email="test_elek@invenshure.com").first().days == 0
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that two concurrent declines of the same request only give its days back once
+def test_handle_request_6(app):
+    import threading
+    try:
+        routes.create_default_cat()
+        user = routes.User(email="test_elek@invenshure.com", user_group="employee", days=4, leave_category_id=1)
+        db.add(user)
+        db.commit()
+        leave_request = routes.LeaveRequest(end_date=datetime.date(year=2018, month=4, day=13),
+                                            start_date=datetime.date(year=2018, month=4, day=10),
+                                            user_id=user.id, state="pending", days=4)
+        db.add(leave_request)
+        db.commit()
+        leave_request_id = leave_request.id
+        # Both declines have read the request as pending before either of them changes it
+        both_read = threading.Barrier(2, timeout=5)
+        get_leave_request = routes.get_leave_request
+
+        def get_leave_request_together(id):
+            leave_request = get_leave_request(id)
+            leave_request.state
+            both_read.wait()
+            return leave_request
+
+        def decline():
+            with app.app_context(), app.test_client() as client:
+                with client.session_transaction() as sess:
+                    sess['user'] = 'test_elek@invenshure.com'
+                client.post('/handle_request', data={"decline": leave_request_id})
+
+        with mock.patch.object(routes, 'get_leave_request', get_leave_request_together):
+            threads = [threading.Thread(target=decline) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        db.expire_all()
+        assert routes.User.query.filter_by(email="test_elek@invenshure.com").first().days == 0
+        assert routes.LeaveRequest.query.get(leave_request_id).state == "declined"
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that a declined request can't be accepted again over days the user has booked since, one by one or in bulk
+def test_handle_request_7(app, mocker):
+    class MockedUserInfo:
+        def __init__(self, userinfo):
+            self.data = userinfo
+
+    try:
+        routes.create_default_cat()
+        fake_admin = routes.User(email="test_elni_jo@invenshure.com", user_group="administrator", leave_category_id=1)
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="employee", days=2, leave_category_id=1)
+        db.add(fake_admin)
+        db.add(fake_user)
+        db.commit()
+        declined = routes.LeaveRequest(start_date=datetime.date(year=2019, month=4, day=10),
+                                       end_date=datetime.date(year=2019, month=4, day=11),
+                                       user_id=fake_user.id, state="declined", days=2)
+        booked = routes.LeaveRequest(start_date=datetime.date(year=2019, month=4, day=11),
+                                     end_date=datetime.date(year=2019, month=4, day=12),
+                                     user_id=fake_user.id, state="accepted", days=2)
+        db.add_all([declined, booked])
+        db.commit()
+        declined_id, booked_id = declined.id, booked.id
+        mocker.patch('flaskr.routes.send_emails')
+        with app.test_client() as client:
+            mocker.patch('flaskr.routes.google.get',
+                         return_value=MockedUserInfo({"email": "test_elni_jo@invenshure.com"}))
+            with client.session_transaction() as sess:
+                sess['user'] = 'test_elni_jo@invenshure.com'
+            resp = client.post('/handle_request', data={"accept": declined_id}, follow_redirects=True)
+            assert b"already has leave from 2019-04-11 to 2019-04-12" in resp.data
+            resp = client.post('/handle_requests', json={"accept": [declined_id]})
+            assert resp.status_code == 400
+            assert str(booked_id) in resp.json['description']
+            # Declining the booked request in the same batch frees the days
+            resp = client.post('/handle_requests', json={"accept": [declined_id], "decline": [booked_id]})
+            assert resp.json == {"accepted": [declined_id], "declined": [booked_id]}
+        assert routes.User.query.filter_by(email="test_elek@invenshure.com").first().days == 2
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that reconciliation finds and fixes balances that don't match the requests
+def test_reconcile_balances():
+    from flaskr.balance import reconcile_balances
+    try:
+        routes.create_default_cat()
+        user = routes.User(email="test_elek@invenshure.com", user_group="employee", days=9, leave_category_id=1)
+        user_2 = routes.User(email="test_elni_jo@invenshure.com", user_group="employee", days=0, leave_category_id=1)
+        db.add(user)
+        db.add(user_2)
+        db.commit()
+        for state in ("accepted", "pending", "declined"):
+            db.add(routes.LeaveRequest(end_date=datetime.date(year=2018, month=4, day=13),
+                                       start_date=datetime.date(year=2018, month=4, day=10),
+                                       user_id=user.id, state=state))
+        db.commit()
+        assert reconcile_balances() == {user.id: (9, 8)}
+        assert reconcile_balances(fix=True) == {user.id: (9, 8)}
+        assert reconcile_balances() == {}
+        assert routes.User.query.filter_by(email="test_elek@invenshure.com").first().days == 8
+    finally:
+        delete_everything_from_db()
+
+
+# Checks the working day counts against counting day by day, across years and with both kinds of holidays
+def test_working_calendar():
+    from flaskr.workdays import WorkingCalendar
+    calendar = WorkingCalendar(holidays=['03-15', '12-25', '2019-04-22'])
+    assert calendar.count(datetime.date(2019, 3, 14), datetime.date(2019, 3, 19)) == 3
+    assert calendar.count(datetime.datetime(2019, 4, 19), datetime.datetime(2019, 4, 23)) == 2
+    assert calendar.count(datetime.date(2019, 3, 16), datetime.date(2019, 3, 17)) == 0
+    assert calendar.count(datetime.date(2019, 3, 19), datetime.date(2019, 3, 14)) == 0
+    assert calendar.holidays(datetime.date(2019, 3, 1), datetime.date(2019, 4, 30)) == [datetime.date(2019, 3, 15),
+                                                                                         datetime.date(2019, 4, 22)]
+    start = datetime.date(2018, 12, 1)
+    for length in range(0, 800, 37):
+        end = start + datetime.timedelta(days=length)
+        days = (start + datetime.timedelta(days=i) for i in range(length + 1))
+        assert calendar.count(start, end) == sum(1 for day in days if calendar.is_working(day))
+    # Covering earlier years later on keeps the counts right
+    assert calendar.count(datetime.date(2000, 12, 22), datetime.date(2000, 12, 26)) == 2
+    calendar.configure((4, 5, 6), [])
+    assert calendar.count(datetime.date(2019, 3, 14), datetime.date(2019, 3, 19)) == 3
+
+
+# Checks that changing the holidays recounts the requests and moves only the charged ones' balances
+def test_recompute_leave_days(app):
+    from flaskr.balance import recompute_leave_days
+    from flaskr.workdays import calendar
+    try:
+        routes.create_default_cat()
+        user = routes.User(email="test_elek@invenshure.com", user_group="employee", days=8, leave_category_id=1)
+        db.add(user)
+        db.commit()
+        for state in ("accepted", "pending", "declined"):
+            db.add(routes.LeaveRequest(start_date=datetime.datetime(2019, 3, 11), end_date=datetime.datetime(2019, 3, 15),
+                                       user_id=user.id, state=state))
+        db.commit()
+        assert [r.days for r in routes.LeaveRequest.query.all()] == [5, 5, 5]
+        assert recompute_leave_days() == 0
+        calendar.configure((5, 6), ['03-15'])
+        assert recompute_leave_days() == 3
+        assert [r.days for r in routes.LeaveRequest.query.all()] == [4, 4, 4]
+        assert routes.User.query.filter_by(email="test_elek@invenshure.com").first().days == 6
+    finally:
+        calendar.configure(app.config['WEEKEND'], app.config['PUBLIC_HOLIDAYS'])
+        delete_everything_from_db()
+
+
+# Checks that many requests are accepted and declined with one call and the balances follow
+def test_handle_requests_1(app, mocker, query_counter):
+    class MockedUserInfo:
+        def __init__(self, userinfo):
+            self.data = userinfo
+
+    try:
+        routes.create_default_cat()
+        fake_admin = routes.User(email="test_elni_jo@invenshure.com", user_group="administrator", leave_category_id=1)
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="employee", days=12, leave_category_id=1)
+        db.add(fake_admin)
+        db.add(fake_user)
+        db.commit()
+        ids = []
+        for day in (1, 10, 20):
+            leave_request = routes.LeaveRequest(start_date=datetime.date(year=2019, month=4, day=day),
+                                                end_date=datetime.date(year=2019, month=4, day=day + 3),
+                                                user_id=fake_user.id, state="pending")
+            db.add(leave_request)
+            db.commit()
+            ids.append(leave_request.id)
+        send = mocker.patch('flaskr.routes.send_emails')
+        with app.test_client() as client:
+            mocker.patch('flaskr.routes.google.get',
+                         return_value=MockedUserInfo({"email": "test_elni_jo@invenshure.com"}))
+            query_counter.reset()
+            resp = client.post('/handle_requests', json={"accept": ids[:2], "decline": ids[2:]})
+            assert resp.status_code == 200
+            assert resp.json == {"accepted": ids[:2], "declined": ids[2:]}
+            # Current user, the requests with their users, one balance update and the state updates
+            assert query_counter.count <= 5
+            # Handling the same requests again changes nothing
+            resp = client.post('/handle_requests', json={"accept": ids[:2], "decline": ids[2:]})
+            assert resp.json == {"accepted": [], "declined": []}
+        assert send.call_count == 2
+        assert len(send.call_args_list[0][0][0]) == 3
+        states = [routes.get_leave_request(id).state for id in ids]
+        assert states == ["accepted", "accepted", "declined"]
+        # The declined request, 04/20 to 04/23, has 2 working days
+        assert routes.User.query.filter_by(email="test_elek@invenshure.com").first().days == 10
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that only administrators can use the bulk endpoint
+def test_handle_requests_2(app, mocker):
+    class MockedUserInfo:
+        def __init__(self, userinfo):
+            self.data = userinfo
+
+    try:
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="employee")
+        db.add(fake_user)
+        db.commit()
+        with app.test_client() as client:
+            mocker.patch('flaskr.routes.google.get', return_value=MockedUserInfo({"email": "test_elek@invenshure.com"}))
+            resp = client.post('/handle_requests', json={"accept": [1]})
+            assert resp.status_code == 403
+            resp = client.post('/handle_requests', data={"ids": [1], "action": "accept"})
+            assert resp.status_code == 302
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that the bulk endpoint refuses malformed bodies, and changes nothing when a request changed meanwhile
+def test_handle_requests_3(app, mocker):
+    class MockedUserInfo:
+        def __init__(self, userinfo):
+            self.data = userinfo
+
+    try:
+        routes.create_default_cat()
+        fake_admin = routes.User(email="test_elni_jo@invenshure.com", user_group="administrator", leave_category_id=1)
+        fake_user = routes.User(email="test_elek@invenshure.com", user_group="employee", days=4, leave_category_id=1)
+        db.add(fake_admin)
+        db.add(fake_user)
+        db.commit()
+        leave_requests = [routes.LeaveRequest(start_date=datetime.date(year=2019, month=4, day=day),
+                                              end_date=datetime.date(year=2019, month=4, day=day + 1),
+                                              user_id=fake_user.id, state="pending", days=2) for day in (1, 8)]
+        db.add_all(leave_requests)
+        db.commit()
+        ids = [leave_request.id for leave_request in leave_requests]
+        send = mocker.patch('flaskr.routes.send_emails')
+        with app.test_client() as client:
+            mocker.patch('flaskr.routes.google.get',
+                         return_value=MockedUserInfo({"email": "test_elni_jo@invenshure.com"}))
+            for body in ("null", "[1]", '{"accept": "1"}', '{"decline": [{}]}', '{"accept": ["x"]}'):
+                resp = client.post('/handle_requests', data=body, content_type='application/json')
+                assert resp.status_code == 400
+            # Declined by someone else after this session read it as pending
+            leave_requests[1].state
+            with routes.db.engine.begin() as connection:
+                connection.execute(routes.LeaveRequest.__table__.update()
+                                   .where(routes.LeaveRequest.id == ids[1]).values(state='declined'))
+            resp = client.post('/handle_requests', json={"decline": ids})
+            assert resp.status_code == 409
+        db.expire_all()
+        assert [routes.get_leave_request(id).state for id in ids] == ["pending", "declined"]
+        assert routes.User.query.filter_by(email="test_elek@invenshure.com").first().days == 4
+        assert not send.called
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that /admin and /requests stay within a fixed number of queries however many rows they show
+def test_query_budget(app, mocker, query_counter):
+    class MockedUserInfo:
+        def __init__(self, userinfo):
+            self.data = userinfo
+
+    try:
+        routes.create_default_cat()
+        fake_admin = routes.User(email="test_elni_jo@invenshure.com", user_group="administrator", leave_category_id=1)
+        db.add(fake_admin)
+        db.commit()
+        with app.test_client() as client:
+            mocker.patch('flaskr.routes.google.get',
+                         return_value=MockedUserInfo({"email": "test_elni_jo@invenshure.com"}))
+            for users in (1, 10):
+                for i in range(users):
+                    fake_user = routes.User(email="test_elek%d_%d@invenshure.com" % (users, i), user_group="employee",
+                                            leave_category_id=1 + i % 2)
+                    db.add(fake_user)
+                    db.commit()
+                    db.add(routes.LeaveRequest(start_date=datetime.date(year=2019, month=5, day=1 + i),
+                                               end_date=datetime.date(year=2019, month=5, day=1 + i),
+                                               user_id=fake_user.id, state="pending"))
+                    db.commit()
+                # Current user, pending accounts, categories, pending requests with their users, one page of the
+                # user directory with the categories
+                with query_counter.budget(5):
+                    assert client.get('/admin').status_code == 200
+                # Current user, requests with their users
+                with query_counter.budget(2):
+                    assert client.get('/requests').status_code == 200
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that the user directory on /admin filters, sorts and pages on the server
+def test_user_directory(app, mocker):
+    class MockedUserInfo:
+        def __init__(self, userinfo):
+            self.data = userinfo
+
+    users_per_page = app.config.get('USERS_PER_PAGE')
+    app.config['USERS_PER_PAGE'] = 2
+    try:
+        routes.create_default_cat()
+        db.add(routes.User(email="test_elni_jo@invenshure.com", user_group="administrator", leave_category_id=1))
+        db.add(routes.User(email="test_anna@invenshure.com", user_group="employee", leave_category_id=2))
+        db.add(routes.User(email="test_bela@invenshure.com", user_group="viewer", leave_category_id=None))
+        db.add(routes.User(email="test_cili@invenshure.com", user_group="employee", leave_category_id=1))
+        db.add(routes.User(email="test_new@invenshure.com", user_group="unapproved"))
+        db.commit()
+        with app.test_client() as client:
+            mocker.patch('flaskr.routes.google.get',
+                         return_value=MockedUserInfo({"email": "test_elni_jo@invenshure.com"}))
+            resp = client.get('/admin/users')
+            assert b"test_anna@invenshure.com" in resp.data
+            assert b"test_bela@invenshure.com" in resp.data
+            assert b"test_cili@invenshure.com" not in resp.data
+            assert b"test_new@invenshure.com" not in resp.data
+            assert b"Next" in resp.data
+            assert b"Previous" not in resp.data
+            directory = routes.get_user_directory({})
+            resp = client.get(directory['users_next_url'].replace('/admin', '/admin/users'))
+            assert b"test_cili@invenshure.com" in resp.data
+            assert b"test_elni_jo@invenshure.com" in resp.data
+            assert b"test_anna@invenshure.com" not in resp.data
+            assert b"Previous" in resp.data
+            resp = client.get('/admin/users?group=employee&sort=email&order=desc')
+            assert resp.data.index(b"test_cili@") < resp.data.index(b"test_anna@")
+            assert b"<td>test_elni_jo@invenshure.com</td>" not in resp.data
+            resp = client.get('/admin/users?category=none')
+            assert b"<td>test_bela@invenshure.com</td>" in resp.data
+            assert b"<td>test_anna@invenshure.com</td>" not in resp.data
+            resp = client.get('/admin/users?q=test_c')
+            assert b"<td>test_cili@invenshure.com</td>" in resp.data
+            assert b"<td>test_anna@invenshure.com</td>" not in resp.data
+            # LIKE wildcards in the prefix are matched literally
+            resp = client.get('/admin/users?q=test%25')
+            assert b"<td>test_" not in resp.data
+            resp = client.get('/admin?q=test_b')
+            assert b"test_new@invenshure.com" in resp.data
+            assert b"<td>test_bela@invenshure.com</td>" in resp.data
+            assert b"<td>test_anna@invenshure.com</td>" not in resp.data
+    finally:
+        app.config['USERS_PER_PAGE'] = users_per_page
+        delete_everything_from_db()
+
+
+# Checks that the user directory is only served to administrators
+def test_user_directory_2(app, mocker):
+    class MockedUserInfo:
+        def __init__(self, userinfo):
+            self.data = userinfo
+
+    try:
+        db.add(routes.User(email="test_elek@invenshure.com", user_group="employee"))
+        db.commit()
+        with app.test_client() as client:
+            mocker.patch('flaskr.routes.google.get', return_value=MockedUserInfo({"email": "test_elek@invenshure.com"}))
+            resp = client.get('/admin/users')
+            assert resp.status_code == 302
+            assert b"test_elek@invenshure.com" not in resp.data
+    finally:
+        delete_everything_from_db()
+
+
+# Checks that the report journal rotates its segments and finds reports by user, text and time
+def test_report_journal(tmp_path):
+    journal = routes.ReportJournal(str(tmp_path), max_bytes=1024, flush_interval=60)
+    try:
+        first = journal.append("test_elek@invenshure.com", "The calendar is empty")
+        for i in range(50):
+            journal.append("test_elni_jo@invenshure.com", "Report number %d" % i)
+        assert journal.flush() == 51
+        last = journal.append("test_elek@invenshure.com", "Cannot save my request")
+        journal.flush()
+        journal.append("test_elek@invenshure.com", "Same segment")
+        journal.flush()
+        # The first batch filled a segment, the later ones went to a second
+        assert len(list(tmp_path.iterdir())) == 2
+        assert [r["body"] for r in journal.search(user="test_elek@invenshure.com")] == \
+            ["Same segment", "Cannot save my request", "The calendar is empty"]
+        assert [r["id"] for r in journal.search(text="CANNOT")] == [last["id"]]
+        assert journal.search(until=first["created"]) == []
+        assert journal.search(since=last["created"], limit=1)[0]["body"] == "Same segment"
+        page = journal.search(limit=20)
+        assert page[0]["body"] == "Same segment"
+        assert journal.search(before=page[-1]["id"], limit=20)[0]["body"] == "Report number 31"
+        assert journal.get(first["id"])["body"] == "The calendar is empty"
+        # Another process appending to the same directory is picked up without rereading what is indexed
+        other = routes.ReportJournal(str(tmp_path), max_bytes=1024, flush_interval=60)
+        other.append("test_other@invenshure.com", "From another worker")
+        other.close()
+        assert journal.search(limit=1)[0]["body"] == "From another worker"
+    finally:
+        journal.close()
+
+
+# Checks that only administrators can search the reports
+def test_reports_feed(app, mocker, tmp_path):
+    class MockedUserInfo:
+        def __init__(self, userinfo):
+            self.data = userinfo
+
+    mocker.patch.object(routes, 'report_journal', routes.ReportJournal(str(tmp_path), flush_interval=60))
+    try:
+        db.add(routes.User(email="test_elni_jo@invenshure.com", user_group="administrator"))
+        db.add(routes.User(email="test_elek@invenshure.com", user_group="employee"))
+        db.commit()
+        routes.report_journal.append("test_elek@invenshure.com", "First report")
+        routes.report_journal.append("test_elek@invenshure.com", "Second report")
+        with app.test_client() as client:
+            mocker.patch('flaskr.routes.google.get', return_value=MockedUserInfo({"email": "test_elek@invenshure.com"}))
+            assert client.get('/api/reports').status_code == 403
+        routes.identity_cache.clear()
+        with app.test_client() as client:
+            mocker.patch('flaskr.routes.google.get',
+                         return_value=MockedUserInfo({"email": "test_elni_jo@invenshure.com"}))
+            resp = client.get('/api/reports?limit=1')
+            assert [r["body"] for r in resp.json["reports"]] == ["Second report"]
+            resp = client.get('/api/reports?limit=1&before=' + resp.json["next"])
+            assert [r["body"] for r in resp.json["reports"]] == ["First report"]
+            resp = client.get('/api/reports?q=first&user=test_elek@invenshure.com')
+            assert len(resp.json["reports"]) == 1
+            assert resp.json["next"] is None
+            assert client.get('/api/reports?limit=x').status_code == 400
+    finally:
+        routes.report_journal.close()
+        delete_everything_from_db()
+
+
+# Checks that log records are written as JSON carrying the request id and the user
+def test_structured_logging(app):
+    from flaskr.logs import JSONFormatter, RequestContextFilter, StructuredQueueHandler
+    handler = StructuredQueueHandler(None)
+    handler.addFilter(RequestContextFilter())
+    with app.test_request_context('/', headers={'X-Request-ID': 'abc123'}):
+        app.preprocess_request()
+        routes.session['user'] = 'test_elek@invenshure.com'
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = logging.getLogger('flaskr.test').makeRecord('flaskr.test', logging.ERROR, __file__, 1,
+                                                                 "%s failed", ('Saving',), sys.exc_info())
+        assert handler.filter(record)
+        record = handler.prepare(record)
+    entry = json.loads(JSONFormatter().format(record))
+    assert entry['message'] == 'Saving failed'
+    assert entry['level'] == 'ERROR'
+    assert entry['request_id'] == 'abc123'
+    assert entry['user'] == 'test_elek@invenshure.com'
+    assert 'ValueError: boom' in entry['exception']
+    with app.test_client() as client:
+        assert client.get('/', headers={'X-Request-ID': 'abc123'}).headers['X-Request-ID'] == 'abc123'
+        assert client.get('/').headers['X-Request-ID']
+
+
+# Checks that the log file rolls over by size and by age
+def test_log_rotation(tmp_path):
+    from flaskr.logs import RotatingFileHandler
+    path = str(tmp_path / 'flaskr_log.log')
+    handler = RotatingFileHandler(path, max_bytes=100, backup_count=2, interval=3600)
+    record = logging.makeLogRecord({'msg': 'x' * 60})
+    try:
+        handler.emit(record)
+        handler.emit(record)
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['flaskr_log.log', 'flaskr_log.log.1']
+        handler.rollover_at = time.time() - 1
+        handler.emit(record)
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['flaskr_log.log', 'flaskr_log.log.1',
+                                                              'flaskr_log.log.2']
+        assert handler.rollover_at > time.time()
+    finally:
+        handler.close()
+
+
+# Checks that without a LOG_FILE the records go to stderr
+def test_log_to_stderr(capsys):
+    from flask import Flask
+    from flaskr.logs import init_logging
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    log_app = Flask('log_test')
+    log_app.config.update(LOG_FILE=None)
+    listener = init_logging(log_app)
+    try:
+        logging.getLogger('log_test').warning("to stderr")
+        listener.queue.join()
+    finally:
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        for handler in handlers:
+            root.addHandler(handler)
+        root.setLevel(level)
+    assert json.loads(capsys.readouterr().err.splitlines()[-1])['message'] == "to stderr"
+
+
+# Checks that migrating the database, as run.py does before serving, leaves the app's logging in place
+def test_upgrade_keeps_logging(tmp_path):
+    from flask_migrate import upgrade
+    from flaskr import create_app
+    from flaskr.logs import StructuredQueueHandler
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    migrate_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'site.db'),
+                              'SQLALCHEMY_ENGINE_OPTIONS': {}, 'MIGRATIONS_ENABLED': True,
+                              'LOG_FILE': str(tmp_path / 'flaskr_log.log')})
+    try:
+        with migrate_app.app_context():
+            upgrade()
+        assert [type(handler) for handler in root.handlers] == [StructuredQueueHandler]
+        assert root.level == logging.INFO
+        logging.getLogger('upgrade_test').info("after the upgrade")
+        migrate_app.extensions['log_listener'].queue.join()
+        assert "after the upgrade" in (tmp_path / 'flaskr_log.log').read_text()
+    finally:
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        for handler in handlers:
+            root.addHandler(handler)
+        root.setLevel(level)
+
+
+# Checks that requests, their SQL and the mail queue show up on /metrics, and that it honours the token
+def test_metrics():
+    from types import SimpleNamespace
+    from flask import Flask
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.engine import Engine
+    from sqlalchemy.pool import Pool, QueuePool
+    from flaskr import metrics
+
+    metrics_app = Flask('metrics_test')
+    metrics_app.config.update(METRICS_ENABLED=True, METRICS_TOKEN='sekrit')
+    engine = create_engine('sqlite://', poolclass=QueuePool, pool_size=3)
+
+    @metrics_app.route('/queries')
+    def queries():
+        with engine.connect() as conn:
+            conn.execute('SELECT 1')
+            conn.execute('SELECT 2')
+        return 'ok'
+
+    try:
+        metrics.init_app(metrics_app, routes.mail_queue, SimpleNamespace(engine=engine))
+        held = engine.connect()
+        with metrics_app.test_client() as client:
+            assert client.get('/queries').status_code == 200
+            assert client.get('/missing').status_code == 404
+            assert client.get('/metrics').status_code == 401
+            body = client.get('/metrics', headers={'Authorization': 'Bearer sekrit'}).data.decode()
+        pid = f'pid="{os.getpid()}"'
+        assert 'flaskr_request_duration_seconds_count{%s,endpoint="queries",method="GET",status="200"} 1' % pid in body
+        assert 'flaskr_request_duration_seconds_count{%s,endpoint="unmatched",method="GET",status="404"} 1' % pid \
+            in body
+        assert 'flaskr_request_sql_queries_bucket{%s,endpoint="queries",le="2"} 1' % pid in body
+        assert 'flaskr_request_sql_queries_bucket{%s,endpoint="queries",le="1"} 0' % pid in body
+        assert 'flaskr_request_sql_duration_seconds_count{%s,endpoint="queries"} 1' % pid in body
+        assert '# TYPE flaskr_mail_queue_depth gauge' in body
+        assert 'flaskr_mail_queue_wait_seconds_count{%s}' % pid in body
+        assert 'flaskr_db_pool_size{%s} 3' % pid in body
+        assert 'flaskr_db_pool_checked_out{%s} 1' % pid in body
+        assert 'flaskr_db_pool_events_total{%s,event="checkout"}' % pid in body
+        held.close()
+    finally:
+        event.remove(Engine, 'before_cursor_execute', metrics.before_cursor_execute)
+        event.remove(Engine, 'after_cursor_execute', metrics.after_cursor_execute)
+        for name, listener in metrics.POOL_LISTENERS.items():
+            event.remove(Pool, name, listener)
+        for histogram in metrics.HISTOGRAMS:
+            histogram.enabled = False
+            histogram.clear()
+
+
+# Checks that nothing is recorded while metrics are off
+def test_metrics_2(app, mocker):
+    from flaskr import metrics
+    mocker.patch('flaskr.routes.google.get', side_effect=KeyError('email'))
+    with app.test_client() as client:
+        client.get('/')
+    assert 'metrics' not in app.view_functions
+    assert all(not histogram.render()[2:] for histogram in metrics.HISTOGRAMS)
+
+
+# Checks that read-only views read from a replica while writes and reads after a write go to the primary,
+# using two SQLite files as primary and replica
+def test_replica_routing(tmp_path):
+    from flask import Flask
+    from flaskr.routing import RoutingSQLAlchemy, read_only
+
+    routing_app = Flask('routing_test')
+    routing_app.config.update(SECRET_KEY='sekrit', SQLALCHEMY_TRACK_MODIFICATIONS=False,
+                              SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmp_path / 'primary.db'),
+                              DATABASE_REPLICAS=['sqlite:///' + str(tmp_path / 'replica.db')],
+                              REPLICA_MAX_LAG=5, REPLICA_LAG_CHECK_INTERVAL=0)
+    routing_db = RoutingSQLAlchemy(routing_app)
+
+    class Note(routing_db.Model):
+        id = routing_db.Column(routing_db.Integer, primary_key=True)
+        text = routing_db.Column(routing_db.String(20))
+
+    @routing_app.route('/read')
+    @read_only
+    def read():
+        return Note.query.order_by(Note.id.desc()).first().text
+
+    @routing_app.route('/read_for_update')
+    @read_only
+    def read_for_update():
+        return Note.query.with_for_update().first().text
+
+    @routing_app.route('/plain')
+    def plain():
+        return Note.query.order_by(Note.id.desc()).first().text
+
+    @routing_app.route('/update', methods=['POST'])
+    def update():
+        Note.query.filter(Note.text == 'written').update({Note.text: 'updated'}, synchronize_session=False)
+        routing_db.session.commit()
+        return ''
+
+    @routing_app.route('/write', methods=['POST'])
+    @read_only
+    def write():
+        routing_db.session.add(Note(text='written'))
+        routing_db.session.commit()
+        return Note.query.order_by(Note.id.desc()).first().text
+
+    with routing_app.app_context():
+        routing_db.create_all()
+        replica = routing_db.get_engine(routing_app, bind='replica_0')
+        Note.metadata.create_all(replica)
+        routing_db.session.add(Note(text='primary'))
+        routing_db.session.commit()
+        replica.execute(Note.__table__.insert(), text='replica')
+
+    with routing_app.test_client() as client:
+        assert client.get('/read').data == b'replica'
+        assert client.get('/plain').data == b'primary'
+        assert client.get('/read_for_update').data == b'primary'
+        assert client.post('/write').data == b'written'
+        # Pinned to the primary while the replica may still be catching up
+        assert client.get('/read').data == b'written'
+        with client.session_transaction() as sess:
+            sess['primary_until'] = time.time() - 1
+        assert client.get('/read').data == b'replica'
+        # A replica lagging behind more than REPLICA_MAX_LAG is skipped
+        routing_app.extensions['replicas'].measure_lag = lambda engine: 60
+        assert client.get('/read').data == b'written'
+        routing_app.extensions['replicas'].measure_lag = lambda engine: 1
+        assert client.get('/read').data == b'replica'
+        # Query.update() writes without a flush, and pins just the same
+        client.post('/update')
+        assert client.get('/read').data == b'updated'
+
+
+# Importing flaskr and building an app neither loads the optional extras nor touches the database or the disk
+def test_create_app_is_lazy(tmp_path):
+    import os
+    import subprocess
+    code = f"""
+import sys
+import flaskr
+assert 'flaskr.routes' not in sys.modules and 'flask_migrate' not in sys.modules and 'pymysql' not in sys.modules
+flaskr.create_app({{'SQLALCHEMY_DATABASE_URI': 'mysql+pymysql://nobody@127.0.0.1:1/unreachable',
+                    'LOG_FILE': {str(tmp_path / 'app.log')!r}, 'REPORT_JOURNAL_DIR': {str(tmp_path / 'reports')!r},
+                    'MIGRATIONS_ENABLED': False}})
+assert 'flask_migrate' not in sys.modules
+"""
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.dirname(routes.__file__)))
+    assert list(tmp_path.iterdir()) == []
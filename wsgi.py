@@ -0,0 +1,7 @@
+# Entry point for a production WSGI server, e.g. gunicorn -c gunicorn.conf.py wsgi:app
+from flaskr import create_app
+
+# Migrations are applied before the server starts (see the Dockerfile), so the workers don't load Alembic. The
+# workers log to stderr, which gunicorn and Docker collect and rotate; each rotating a shared LOG_FILE on its own
+# would clobber the others' backups
+app = create_app({'MIGRATIONS_ENABLED': False, 'LOG_FILE': None})